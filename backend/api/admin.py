@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     UserProfile, Location, VehicleType, Vehicle, Task, Route, RouteStop,
-    MaintenanceType, MaintenanceLog
+    MaintenanceType, MaintenanceLog, DistanceMatrixEntry, PlanningJob
 )
 
 # Register your models here.
@@ -16,6 +16,8 @@ admin.site.register(Route)
 admin.site.register(RouteStop)
 admin.site.register(MaintenanceType)
 admin.site.register(MaintenanceLog)
+admin.site.register(DistanceMatrixEntry)
+admin.site.register(PlanningJob)
 
 # Example of customizing admin display (optional)
 # class VehicleAdmin(admin.ModelAdmin):
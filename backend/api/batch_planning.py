@@ -0,0 +1,300 @@
+"""
+Batch planning: several (depot, date) plans in one request.
+
+Plans of the same date whose vehicle lists overlap share those vehicles, so they are merged into one
+multi-depot problem in which every vehicle starts and ends at its own depot. The resulting problems
+are independent and are solved concurrently in a process pool, so the batch takes about as long as
+its slowest problem. The travel matrix over the union of all their locations is fetched once and
+memory-mapped by every pool process.
+"""
+import datetime
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from rest_framework import status
+
+from . import shared_matrices
+from .decomposition import create_subproblem_pool, run_subproblems
+from .matrix_providers import get_matrix_provider
+from .models import Location, Task, Vehicle
+from .planning import resolve_drop_penalty, save_solution
+from .search_options import SearchOptionsError, resolve_search_options
+from .vrp_solver import merge_colocated_locations
+
+REQUIRED_BATCH_PLAN_FIELDS = ["depot_id", "task_ids", "vehicle_ids", "date"]
+
+
+def get_batch_processes(num_problems):
+    """Returns the pool size for a batch (settings.VRP_BATCH_PROCESSES, default: CPU count), at most one per problem."""
+    processes = getattr(settings, 'VRP_BATCH_PROCESSES', None) or os.cpu_count() or 1
+    return max(1, min(processes, num_problems))
+
+
+def solve_on_shared_matrix(specs, matrix, addresses, processes, should_stop=None, on_result=None):
+    """
+    Solves independent problems concurrently in a process pool on one precomputed travel matrix.
+    The matrix is written once to a private temporary directory and memory-mapped by every pool process
+    (see PrecomputedMatrixProvider), so the matrix provider is not asked again per problem.
+    Args:
+        specs: Sub-problem specs (see worker_processes.solve_subproblem) whose locations are all in `addresses`.
+        matrix: The TravelMatrix over `addresses`.
+        addresses: The snapped matrix addresses (see merge_colocated_locations).
+        processes: Pool size.
+        should_stop, on_result: As for decomposition.run_subproblems.
+    Returns:
+        One solve_vrp result per spec (None for problems without a solution or that failed).
+    """
+    # A private directory (inside the shared directory if configured, to stay on the same tmpfs):
+    # purge_expired_segments only lists segments at the top level, so it never removes the file
+    # while the pool uses it. The directory is deleted once the pool has finished.
+    with tempfile.TemporaryDirectory(prefix='batch-', dir=shared_matrices.get_shared_dir()) as matrix_dir:
+        matrix_path = os.path.join(matrix_dir, 'matrix' + shared_matrices.SEGMENT_SUFFIX)
+        matrix.save(matrix_path)
+        specs = [dict(spec, matrix_path=matrix_path, matrix_addresses=addresses) for spec in specs]
+        executor, stop_event = create_subproblem_pool(processes)
+        with executor:
+            return run_subproblems(executor, specs, stop_event, should_stop, on_result)
+
+
+def group_batch_plans(plans):
+    """
+    Groups batch plans into independent problems: plans of the same date that share a vehicle are
+    merged (transitively), since a vehicle can only drive one route per day.
+    Args:
+        plans: List of plan dicts with date and vehicle_ids.
+    Returns:
+        Lists of plan indices, one per problem, in request order.
+    """
+    parent = list(range(len(plans)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    first_plan_of_vehicle = {}
+    for index, plan in enumerate(plans):
+        for vehicle_id in plan['vehicle_ids']:
+            key = (plan['date'], vehicle_id)
+            if key in first_plan_of_vehicle:
+                parent[find(index)] = find(first_plan_of_vehicle[key])
+            else:
+                first_plan_of_vehicle[key] = index
+
+    groups = {}
+    for index in range(len(plans)):
+        groups.setdefault(find(index), []).append(index)
+    return sorted(groups.values())
+
+
+def _parse_batch_request(request_data):
+    """
+    Validates the plans and vehicle depot overrides of a batch request.
+    Returns:
+        A tuple (plans, vehicle_depot_ids): normalized plan dicts and vehicle id -> (start, end) depot ids.
+    Raises:
+        SearchOptionsError: If the request is malformed.
+    """
+    plans = request_data.get("plans")
+    if not isinstance(plans, list) or not plans:
+        raise SearchOptionsError("plans must be a non-empty list of {depot_id, date, task_ids, vehicle_ids} objects.")
+    normalized = []
+    for position, plan in enumerate(plans):
+        missing = [field for field in REQUIRED_BATCH_PLAN_FIELDS if not isinstance(plan, dict) or field not in plan]
+        if missing:
+            raise SearchOptionsError(f"Plan {position} is missing required fields: {missing}")
+        try:
+            plan_date = datetime.date.fromisoformat(str(plan["date"]))
+            normalized.append({
+                'depot_id': int(plan["depot_id"]),
+                'date': plan_date.isoformat(),
+                'task_ids': [int(task_id) for task_id in plan["task_ids"]],
+                'vehicle_ids': [int(vehicle_id) for vehicle_id in plan["vehicle_ids"]],
+            })
+        except (TypeError, ValueError):
+            raise SearchOptionsError(f"Plan {position} has an invalid date or id list.")
+
+    task_plans = {}
+    for position, plan in enumerate(normalized):
+        for task_id in plan['task_ids']:
+            if task_plans.setdefault(task_id, position) != position:
+                raise SearchOptionsError(f"Task {task_id} appears in more than one plan.")
+
+    vehicle_depot_ids = {}
+    for vehicle_id, depots in (request_data.get("vehicle_depots") or {}).items():
+        try:
+            start_id = int(depots["start_depot_id"])
+            vehicle_depot_ids[int(vehicle_id)] = (start_id, int(depots.get("end_depot_id") or start_id))
+        except (TypeError, ValueError, KeyError):
+            raise SearchOptionsError(
+                f"vehicle_depots entry of vehicle {vehicle_id} must be {{start_depot_id, end_depot_id}}.")
+    return normalized, vehicle_depot_ids
+
+
+def execute_batch_plan(request_data, progress_callback=None, should_stop=None):
+    """
+    Plans several (depot, date) plans at once and saves the routes of each.
+    Args:
+        request_data: The batch request payload:
+                      "plans": list of {depot_id, date, task_ids, vehicle_ids}. A vehicle listed in several
+                      plans of the same date is shared: those plans become one multi-depot problem.
+                      "vehicle_depots": optional {vehicle_id: {start_depot_id, end_depot_id}}; by default a
+                      vehicle starts and ends at the depot of the first plan listing it.
+                      Plus the matrix_provider, search options and drop_penalty of a single plan request,
+                      applied to every problem.
+        progress_callback: Optional callable(stage, message) receiving progress updates.
+        should_stop: Optional callable() -> bool; when it returns True the running searches stop and
+                     their best routes are saved.
+    Returns:
+        A tuple (response_payload, http_status_code).
+    """
+    def report(stage, message):
+        print(message)
+        if progress_callback:
+            progress_callback(stage, message)
+
+    started = time.monotonic()
+    matrix_provider_name = request_data.get("matrix_provider") # None uses the configured default
+    try:
+        plans, vehicle_depot_ids = _parse_batch_request(request_data)
+        search_options = resolve_search_options(request_data)
+        drop_penalty = resolve_drop_penalty(request_data)
+    except SearchOptionsError as e:
+        return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+
+    # --- Fetch Data ---
+    report('loading', f"Loading {len(plans)} plans.")
+    depot_ids = {plan['depot_id'] for plan in plans} | {depot_id for pair in vehicle_depot_ids.values() for depot_id in pair}
+    depots = Location.objects.filter(type=Location.LocationType.CEDIS).in_bulk(depot_ids)
+    missing_depots = sorted(depot_ids - set(depots))
+    if missing_depots:
+        return {"error": f"Depot locations {missing_depots} not found or not a CEDIS."}, status.HTTP_404_NOT_FOUND
+    # Only PENDING tasks and AVAILABLE vehicles are planned
+    tasks_by_id = Task.objects.filter(status=Task.TaskStatus.PENDING).select_related('origin', 'destination').in_bulk(
+        {task_id for plan in plans for task_id in plan['task_ids']})
+    vehicles_by_id = Vehicle.objects.filter(is_available=True).select_related('type').in_bulk(
+        {vehicle_id for plan in plans for vehicle_id in plan['vehicle_ids']})
+
+    # --- Build the independent problems ---
+    problems = []
+    for group in group_batch_plans(plans):
+        group_plans = [plans[index] for index in group]
+        task_ids = [task_id for plan in group_plans for task_id in plan['task_ids'] if task_id in tasks_by_id]
+        vehicle_depots = {}
+        for plan in group_plans:
+            for vehicle_id in plan['vehicle_ids']:
+                if vehicle_id in vehicles_by_id and vehicle_id not in vehicle_depots:
+                    vehicle_depots[vehicle_id] = vehicle_depot_ids.get(vehicle_id, (plan['depot_id'], plan['depot_id']))
+        problems.append({
+            'date': group_plans[0]['date'],
+            'depot_id': group_plans[0]['depot_id'],
+            'depot_ids': sorted({depot_id for pair in vehicle_depots.values() for depot_id in pair}
+                                | {plan['depot_id'] for plan in group_plans}),
+            'task_ids': list(dict.fromkeys(task_ids)),
+            'vehicle_depots': vehicle_depots,
+        })
+
+    # Task stops at another depot of a multi-depot problem cannot be modelled (depots are route ends only)
+    for problem in problems:
+        if len(problem['depot_ids']) > 1:
+            at_depot = sorted(task_id for task_id in problem['task_ids']
+                              if {tasks_by_id[task_id].origin_id, tasks_by_id[task_id].destination_id} & set(problem['depot_ids']))
+            if at_depot:
+                return {"error": f"Tasks {at_depot} start or end at a depot of a multi-depot plan "
+                                 f"({problem['date']}, depots {problem['depot_ids']}). Plan them separately."}, \
+                    status.HTTP_400_BAD_REQUEST
+
+    results = [None] * len(problems)
+    solvable = [index for index, problem in enumerate(problems) if problem['task_ids'] and problem['vehicle_depots']]
+    if not solvable:
+        return {"warning": "No pending tasks and available vehicles found for any plan."}, status.HTTP_400_BAD_REQUEST
+
+    # --- One travel matrix over the union of all locations, shared by every problem ---
+    union_locations = {depot_id: depots[depot_id] for index in solvable for depot_id in problems[index]['depot_ids']}
+    for index in solvable:
+        for task_id in problems[index]['task_ids']:
+            task = tasks_by_id[task_id]
+            union_locations.setdefault(task.origin_id, task.origin)
+            union_locations.setdefault(task.destination_id, task.destination)
+    _, _, addresses = merge_colocated_locations(list(union_locations.values()))
+    report('matrix', f"Getting the distance/duration matrix for {len(addresses)} nodes of {len(solvable)} problems.")
+    matrix_started = time.monotonic()
+    try:
+        union_matrix = get_matrix_provider(matrix_provider_name).get_matrices(addresses)
+    except ValueError as e: # e.g. unknown matrix provider or missing API key
+        return {"error": f"Solver configuration error: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    except Exception as e:
+        return {"error": f"Failed to get distance/duration matrix: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    matrix_seconds = time.monotonic() - matrix_started
+
+    # --- Solve the problems concurrently ---
+    processes = get_batch_processes(len(solvable))
+    specs = [{
+        'depot_id': problems[index]['depot_id'],
+        'task_ids': problems[index]['task_ids'],
+        'vehicle_ids': list(problems[index]['vehicle_depots']),
+        'vehicle_depots': problems[index]['vehicle_depots'],
+        'matrix_provider': matrix_provider_name,
+        'search_options': search_options,
+        'initial_routes': None,
+        'drop_penalty': drop_penalty,
+    } for index in solvable]
+    report('solving', f"Solving {len(specs)} problems in {processes} processes.")
+
+    solved = []
+    def on_problem_solved(position, result):
+        solved.append(position)
+        problem = problems[solvable[position]]
+        report('solving', f"Problem {problem['date']} depots {problem['depot_ids']} "
+                          f"{'solved' if result else 'found no solution'} ({len(solved)}/{len(specs)} done).")
+
+    for index, result in zip(solvable, solve_on_shared_matrix(specs, union_matrix, addresses, processes,
+                                                              should_stop, on_problem_solved)):
+        results[index] = result
+
+    # --- Save the routes of each problem ---
+    report('saving', "Saving planned routes.")
+    problem_payloads = []
+    for problem, solution in zip(problems, results):
+        payload = {
+            "date": problem['date'],
+            "depot_ids": problem['depot_ids'],
+            "vehicle_ids": list(problem['vehicle_depots']),
+        }
+        if not problem['task_ids'] or not problem['vehicle_depots']:
+            payload["warning"] = "No pending tasks or available vehicles found for this plan."
+        elif not solution or not solution.get('routes'):
+            payload["message"] = "No feasible routes found for the given tasks and vehicles."
+            payload["dropped_task_ids"] = solution.get('dropped_tasks', problem['task_ids']) if solution else problem['task_ids']
+            payload["rejected_tasks"] = solution.get('rejected_tasks', []) if solution else []
+        else:
+            try:
+                created_routes, assigned_task_ids = save_solution(solution, problem['date'])
+            except Exception as e:
+                print(f"Error saving solution to database: {e}")
+                payload["error"] = f"Failed to save planned routes: {str(e)}"
+            else:
+                payload.update({
+                    "created_route_ids": created_routes,
+                    "assigned_task_ids": list(assigned_task_ids),
+                    "planned_routes": solution['routes'],
+                    "dropped_task_ids": solution.get('dropped_tasks', []),
+                    "rejected_tasks": solution.get('rejected_tasks', []),
+                })
+        problem_payloads.append(payload)
+
+    planned = sum(1 for payload in problem_payloads if payload.get("created_route_ids"))
+    stopped_early = bool(should_stop and should_stop())
+    return {
+        "message": (f"Planning stopped on request. Best routes of {planned} of {len(problems)} problems saved."
+                    if stopped_early else f"Planned {planned} of {len(problems)} problems."),
+        "stopped_early": stopped_early,
+        "problems": problem_payloads,
+        "matrix_nodes": len(addresses),
+        "matrix_seconds": round(matrix_seconds, 1),
+        "processes": processes,
+        "elapsed_seconds": round(time.monotonic() - started, 1),
+    }, status.HTTP_201_CREATED if planned else status.HTTP_200_OK
@@ -0,0 +1,335 @@
+"""
+Geographic decomposition of very large plans.
+
+One OR-Tools model over thousands of tasks takes too long to build and search and uses too much
+memory. Instead, tasks are split into regional sub-problems by sweeping around the depot, each
+region gets a share of the vehicles, and the regions are solved concurrently in a process pool.
+A boundary-repair pass then re-solves each pair of neighboring regions together, starting from
+their routes, so tasks near a region border can move to the neighbor's vehicles.
+Regions and repair share one deadline (settings.VRP_MAX_TIME_LIMIT_SECONDS), however many rounds
+the pool needs for them.
+"""
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .search_options import get_max_time_limit_seconds, parse_boolean, resolve_search_options
+from .worker_processes import init_subproblem_process, solve_subproblem
+
+# Plans with at least this many tasks are decomposed unless the request says otherwise
+DEFAULT_DECOMPOSITION_MIN_TASKS = 1000
+# Target number of tasks per regional sub-problem
+DEFAULT_DECOMPOSITION_CLUSTER_SIZE = 200
+# Time limit for re-solving each pair of neighboring regions
+DEFAULT_DECOMPOSITION_REPAIR_TIME_LIMIT_SECONDS = 30
+# The parent checks should_stop this often while sub-problems run
+SUBPROBLEM_POLL_SECONDS = 1.0
+# Searches still running this long after their deadline (e.g. model build overran it) are stopped
+SUBPROBLEM_DEADLINE_GRACE_SECONDS = 5.0
+
+
+def get_decomposition_processes():
+    """Returns the size of the sub-problem process pool (settings.VRP_DECOMPOSITION_PROCESSES, default: CPU count)."""
+    return getattr(settings, 'VRP_DECOMPOSITION_PROCESSES', None) or os.cpu_count() or 1
+
+
+def should_decompose(num_tasks, requested=None):
+    """
+    Decides whether a plan is solved by decomposition.
+    Args:
+        num_tasks: The number of tasks to plan.
+        requested: The plan request's "decompose" value (a boolean, or a string such as "false" from
+                   form data); None decides by size (settings.VRP_DECOMPOSITION_MIN_TASKS).
+    Raises:
+        SearchOptionsError: If `requested` is not a recognized boolean value.
+    """
+    if requested is not None:
+        return parse_boolean(requested, 'decompose')
+    return num_tasks >= getattr(settings, 'VRP_DECOMPOSITION_MIN_TASKS', DEFAULT_DECOMPOSITION_MIN_TASKS)
+
+
+def _task_angle(depot_location, task):
+    # Polar angle of the task (midpoint of origin and destination) around the depot,
+    # with longitude scaled so angles are not distorted away from the equator
+    latitude = (task.origin.latitude + task.destination.latitude) / 2
+    longitude = (task.origin.longitude + task.destination.longitude) / 2
+    x = (longitude - depot_location.longitude) * math.cos(math.radians(depot_location.latitude))
+    y = latitude - depot_location.latitude
+    return math.atan2(y, x)
+
+
+def sweep_clusters(depot_location, tasks, num_clusters):
+    """
+    Splits tasks into angular sectors around the depot with (nearly) equal task counts.
+    The sweep starts at the widest empty angle, so no dense area is cut at the starting ray.
+    Returns:
+        A list of num_clusters task lists; consecutive clusters are geographic neighbors.
+    """
+    ordered = sorted(tasks, key=lambda task: _task_angle(depot_location, task))
+    if len(ordered) > 1:
+        angles = [_task_angle(depot_location, task) for task in ordered]
+        gaps = [angles[i + 1] - angles[i] for i in range(len(angles) - 1)]
+        gaps.append(angles[0] + 2 * math.pi - angles[-1]) # Wrap-around gap
+        start = (max(range(len(gaps)), key=gaps.__getitem__) + 1) % len(ordered)
+        ordered = ordered[start:] + ordered[:start]
+
+    clusters = []
+    for k in range(num_clusters):
+        clusters.append(ordered[k * len(ordered) // num_clusters:(k + 1) * len(ordered) // num_clusters])
+    return clusters
+
+
+def allocate_vehicles(clusters, vehicles):
+    """
+    Shares the vehicles between clusters in proportion to their weight demand (task count if there
+    is no weight), at least one vehicle per cluster. Requires len(vehicles) >= len(clusters).
+    Returns:
+        One vehicle list per cluster.
+    """
+    weights = [sum(task.weight_kg or 0 for task in cluster) for cluster in clusters]
+    if not sum(weights):
+        weights = [len(cluster) for cluster in clusters]
+    total = sum(weights) or 1
+    spare = len(vehicles) - len(clusters)
+    quotas = [spare * weight / total for weight in weights]
+    counts = [1 + int(quota) for quota in quotas]
+    # Largest remainder for the vehicles left after rounding down
+    by_remainder = sorted(range(len(clusters)), key=lambda k: quotas[k] - int(quotas[k]), reverse=True)
+    for k in by_remainder[:len(vehicles) - sum(counts)]:
+        counts[k] += 1
+
+    allocation, offset = [], 0
+    for count in counts:
+        allocation.append(vehicles[offset:offset + count])
+        offset += count
+    return allocation
+
+
+def _neighbor_pair_rounds(num_clusters):
+    """Groups the neighboring cluster pairs into rounds of disjoint pairs, which can run concurrently."""
+    pairs = [(k, k + 1) for k in range(num_clusters - 1)]
+    if num_clusters > 2:
+        pairs.append((num_clusters - 1, 0)) # The sweep wraps around the depot
+    rounds = []
+    for pair in pairs:
+        for pairs_in_round in rounds:
+            if not any(set(pair) & set(other) for other in pairs_in_round):
+                pairs_in_round.append(pair)
+                break
+        else:
+            rounds.append([pair])
+    return rounds
+
+
+def _plan_score(routes, num_dropped):
+    # Serving more tasks always beats a shorter distance
+    return (num_dropped, sum(route['total_distance_meters'] for route in routes))
+
+
+def _route_sequences(routes):
+    """initial_routes (vehicle id -> pickup/delivery location ids) for a warm start from solver routes."""
+    return {
+        route['vehicle_id']: [stop['location_id'] for stop in route['stops'] if stop['type'] in ('PICKUP', 'DELIVERY')]
+        for route in routes
+    }
+
+
+def create_subproblem_pool(processes):
+    """
+    Creates the process pool that solves sub-problems of one plan, plus the event that stops them.
+    'spawn' gives every pool process a clean interpreter: no database connections or OR-Tools
+    state inherited from this process.
+    Returns:
+        A tuple (executor, stop_event).
+    """
+    context = multiprocessing.get_context('spawn')
+    stop_event = context.Event()
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                   initializer=init_subproblem_process, initargs=(stop_event,))
+    return executor, stop_event
+
+
+def run_subproblems(executor, specs, stop_event, should_stop=None, on_result=None, deadline=None):
+    """
+    Submits sub-problems (see worker_processes.solve_subproblem) and collects their results,
+    forwarding a stop request, or the passing of the wall-clock deadline, to the pool.
+    Returns:
+        One solve_vrp result per spec (None for sub-problems without a solution or that failed).
+    """
+    futures = {executor.submit(solve_subproblem, spec): index for index, spec in enumerate(specs)}
+    results = [None] * len(specs)
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=SUBPROBLEM_POLL_SECONDS, return_when=FIRST_COMPLETED)
+        if not stop_event.is_set() and ((should_stop and should_stop())
+                                         or (deadline and time.time() > deadline + SUBPROBLEM_DEADLINE_GRACE_SECONDS)):
+            stop_event.set() # Sub-problem searches stop and return their best solution so far
+        for future in done:
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                # e.g. a sub-problem exceeding the memory limit; its tasks are reported as dropped
+                print(f"Sub-problem {index} failed: {e}")
+            if on_result:
+                on_result(index, results[index])
+    return results
+
+
+def solve_vrp_decomposed(depot_location, tasks, vehicles, matrix_provider_name=None, progress_callback=None,
+                         search_options=None, should_stop=None, initial_routes=None,
+                         cluster_size=None, processes=None, drop_penalty=None):
+    """
+    Solves a large VRP as regional sub-problems in parallel, followed by a boundary-repair pass.
+    Args:
+        depot_location, tasks, vehicles: As for solve_vrp (tasks with origin/destination loaded).
+        matrix_provider_name: Name of the matrix provider each sub-problem uses (see get_matrix_provider);
+                              a name rather than an instance, since sub-problems run in other processes.
+        progress_callback: Optional callable(stage, message).
+        search_options: Options from resolve_search_options, applied to every sub-problem.
+                        The boundary repair uses settings.VRP_DECOMPOSITION_REPAIR_TIME_LIMIT_SECONDS.
+                        Every search also ends by the plan deadline (get_max_time_limit_seconds() from now);
+                        repair rounds left at the deadline are skipped.
+        should_stop: Optional callable() -> bool; when it returns True the running sub-problems stop
+                     with their best solution and the repair pass is skipped.
+        initial_routes: Optional current routes (re-optimization); each region starts from the part of
+                        its vehicles' routes that lies in the region.
+        cluster_size: Target tasks per region. Defaults to settings.VRP_DECOMPOSITION_CLUSTER_SIZE.
+        processes: Pool size. Defaults to get_decomposition_processes().
+        drop_penalty: As for solve_vrp, applied to every sub-problem.
+    Returns:
+        A dict shaped like the solve_vrp result (routes, dropped_tasks, rejected_tasks) plus 'decomposition' statistics,
+        or None if no region could be solved.
+    """
+    def report(stage, message):
+        print(message)
+        if progress_callback:
+            progress_callback(stage, message)
+
+    started = time.monotonic()
+    if search_options is None:
+        search_options = resolve_search_options()
+    # Regions and repair share one deadline, so the plan as a whole respects the server time limit
+    time_limit = get_max_time_limit_seconds()
+    deadline = time.time() + time_limit
+    cluster_size = cluster_size or getattr(settings, 'VRP_DECOMPOSITION_CLUSTER_SIZE', DEFAULT_DECOMPOSITION_CLUSTER_SIZE)
+    # Every region needs at least one vehicle
+    num_clusters = max(1, min(math.ceil(len(tasks) / cluster_size), len(vehicles)))
+    processes = max(1, min(processes or get_decomposition_processes(), num_clusters))
+
+    cluster_tasks = sweep_clusters(depot_location, tasks, num_clusters)
+    cluster_vehicles = allocate_vehicles(cluster_tasks, vehicles)
+    tasks_by_id = {task.id: task for task in tasks}
+
+    def make_spec(task_list, vehicle_list, options, warm_start):
+        vehicle_ids = [vehicle.id for vehicle in vehicle_list]
+        return {
+            'depot_id': depot_location.id,
+            'task_ids': [task.id for task in task_list],
+            'vehicle_ids': vehicle_ids,
+            'matrix_provider': matrix_provider_name,
+            'search_options': options,
+            'initial_routes': {vehicle_id: warm_start[vehicle_id] for vehicle_id in vehicle_ids
+                               if vehicle_id in warm_start} if warm_start else None,
+            'drop_penalty': drop_penalty,
+            'deadline': deadline,
+        }
+
+    report('decomposition', f"Solving {len(tasks)} tasks as {num_clusters} regional sub-problems "
+                            f"in {processes} processes (deadline {time_limit:.0f}s).")
+
+    executor, stop_event = create_subproblem_pool(processes)
+    with executor:
+        # --- 1. Solve the regions concurrently ---
+        solved = []
+        def on_region_solved(index, result):
+            solved.append(index)
+            report('decomposition', f"Region {index + 1}/{num_clusters} "
+                                    f"{'solved' if result else 'found no solution'} ({len(solved)}/{num_clusters} done).")
+
+        specs = [make_spec(cluster_tasks[k], cluster_vehicles[k], search_options, initial_routes)
+                 for k in range(num_clusters)]
+        results = run_subproblems(executor, specs, stop_event, should_stop, on_region_solved, deadline=deadline)
+
+        cluster_routes = [result['routes'] if result else [] for result in results]
+        # Tasks of regions without a solution stay in their region so the repair can place them
+        cluster_dropped = [set() if result else {task.id for task in cluster_tasks[k]}
+                           for k, result in enumerate(results)]
+        # Tasks rejected by the pre-screen cannot be served by any vehicle; keep them out of the repair
+        rejected_tasks = {}
+        for result in results:
+            for rejected in (result or {}).get('rejected_tasks') or []:
+                rejected_tasks.setdefault(rejected['task_id'], rejected)
+        for k, result in enumerate(results):
+            if result:
+                cluster_dropped[k] |= set(result.get('dropped_tasks') or [])
+                cluster_dropped[k] -= rejected_tasks.keys()
+
+        # --- 2. Boundary repair: re-solve neighboring regions together, from their current routes ---
+        repair_options = dict(search_options, time_limit_seconds=getattr(
+            settings, 'VRP_DECOMPOSITION_REPAIR_TIME_LIMIT_SECONDS', DEFAULT_DECOMPOSITION_REPAIR_TIME_LIMIT_SECONDS))
+        repaired_pairs = 0
+        for pairs in _neighbor_pair_rounds(num_clusters):
+            if stop_event.is_set() or (should_stop and should_stop()):
+                print("Stop requested. Skipping the boundary repair.")
+                break
+            if time.time() >= deadline:
+                print("Plan deadline reached. Skipping the rest of the boundary repair.")
+                break
+            pair_specs = []
+            for a, b in pairs:
+                pair_routes = cluster_routes[a] + cluster_routes[b]
+                pair_task_ids = [stop['task_id'] for route in pair_routes for stop in route['stops'] if stop['task_id']]
+                pair_task_ids += sorted(cluster_dropped[a] | cluster_dropped[b])
+                pair_specs.append(make_spec(
+                    [tasks_by_id[task_id] for task_id in dict.fromkeys(pair_task_ids)],
+                    cluster_vehicles[a] + cluster_vehicles[b], repair_options, _route_sequences(pair_routes)))
+            report('decomposition', f"Boundary repair of region pairs {pairs}.")
+            try:
+                pair_results = run_subproblems(executor, pair_specs, stop_event, should_stop, deadline=deadline)
+            except BrokenProcessPool as e:
+                # A pool process died (e.g. memory limit); keep the region solutions found so far
+                print(f"Boundary repair aborted: {e}")
+                break
+
+            for (a, b), result in zip(pairs, pair_results):
+                if not result:
+                    continue
+                old_dropped = cluster_dropped[a] | cluster_dropped[b]
+                new_dropped = set(result.get('dropped_tasks') or [])
+                if _plan_score(result['routes'], len(new_dropped)) >= _plan_score(
+                        cluster_routes[a] + cluster_routes[b], len(old_dropped)):
+                    continue
+                # Keep the improvement; each route stays in the region of its vehicle
+                vehicle_ids_a = {vehicle.id for vehicle in cluster_vehicles[a]}
+                cluster_routes[a] = [route for route in result['routes'] if route['vehicle_id'] in vehicle_ids_a]
+                cluster_routes[b] = [route for route in result['routes'] if route['vehicle_id'] not in vehicle_ids_a]
+                cluster_dropped[a], cluster_dropped[b] = new_dropped, set()
+                repaired_pairs += 1
+
+    routes = [route for region_routes in cluster_routes for route in region_routes]
+    dropped_tasks = sorted(set().union(*cluster_dropped) | rejected_tasks.keys())
+    if not routes:
+        return None
+    report('decomposition', f"Decomposed solve finished in {time.monotonic() - started:.1f}s: "
+                            f"{len(routes)} routes, {repaired_pairs} region pairs improved by the repair, "
+                            f"{len(dropped_tasks)} tasks unplanned.")
+    return {
+        'routes': routes,
+        'dropped_tasks': dropped_tasks,
+        'rejected_tasks': list(rejected_tasks.values()),
+        'warm_started': any(result and result.get('warm_started') for result in results),
+        'decomposition': {
+            'regions': num_clusters,
+            'processes': processes,
+            'region_task_counts': [len(cluster) for cluster in cluster_tasks],
+            'region_vehicle_counts': [len(cluster) for cluster in cluster_vehicles],
+            'repaired_region_pairs': repaired_pairs,
+            'elapsed_seconds': round(time.monotonic() - started, 1),
+        },
+    }
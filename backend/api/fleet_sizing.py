@@ -0,0 +1,301 @@
+"""
+Fleet-sizing what-if sweeps: how many vehicles of each VehicleType does a task set need?
+
+A sweep solves the same tasks with varying vehicle subsets (and optionally varying search options)
+and reports a cost/coverage curve. Nothing is written to the database. The scenarios are independent,
+so they are solved concurrently in a process pool on one travel matrix fetched once for all of them
+(see batch_planning.solve_on_shared_matrix).
+"""
+import itertools
+import time
+
+from django.conf import settings
+from rest_framework import status
+
+from .batch_planning import get_batch_processes, solve_on_shared_matrix
+from .matrix_providers import get_matrix_provider
+from .models import Location, Task, Vehicle
+from .planning import resolve_drop_penalty
+from .search_options import SEARCH_OPTION_FIELDS, SearchOptionsError, resolve_search_options
+from .vrp_solver import merge_colocated_locations
+
+FLEET_SWEEP_MODES = ('per_type', 'joint')
+DEFAULT_FLEET_SWEEP_MAX_SCENARIOS = 100
+# Fields a scenario may override on top of the sweep request
+SCENARIO_OVERRIDE_FIELDS = ['search_profile', 'drop_penalty', *SEARCH_OPTION_FIELDS]
+
+
+def get_max_sweep_scenarios():
+    """Returns the maximum number of scenarios of one sweep (settings.VRP_FLEET_SWEEP_MAX_SCENARIOS)."""
+    return getattr(settings, 'VRP_FLEET_SWEEP_MAX_SCENARIOS', DEFAULT_FLEET_SWEEP_MAX_SCENARIOS)
+
+
+def build_sweep_scenarios(fleet, mode='per_type', counts=None):
+    """
+    Generates the vehicle counts of a sweep.
+    Args:
+        fleet: Dict type id -> number of vehicles of that type in the candidate pool.
+        mode: 'per_type': each type's count is varied on its own while every other type keeps its full
+              count, which gives the minimum of each type given the rest of the fleet.
+              'joint': every combination of counts, which gives the smallest mixed fleets.
+        counts: Optional dict type id -> counts to try for that type (default: 0 up to the pool size;
+                from 1 if it is the only type, since an empty fleet needs no solve).
+    Returns:
+        A list of unique dicts type id -> count, the full fleet first.
+    """
+    counts = counts or {}
+    ranges = {}
+    for type_id, available in fleet.items():
+        lowest = 0 if len(fleet) > 1 else 1
+        ranges[type_id] = sorted({count for count in counts.get(type_id, range(lowest, available + 1))
+                                  if 0 <= count <= available} | {available})
+
+    if mode == 'joint':
+        combinations = [dict(zip(ranges, values)) for values in itertools.product(*ranges.values())]
+    else:
+        combinations = [{**fleet, type_id: count} for type_id, type_counts in ranges.items()
+                        for count in type_counts]
+
+    scenarios = [dict(fleet)]
+    seen = {tuple(sorted(fleet.items()))}
+    for combination in combinations:
+        key = tuple(sorted(combination.items()))
+        if key not in seen and any(combination.values()):
+            seen.add(key)
+            scenarios.append(combination)
+    return scenarios
+
+
+def summarize_sweep(scenarios, fleet):
+    """
+    Derives the sizing answer from solved scenarios.
+    Args:
+        scenarios: Scenario payloads with vehicle_counts, num_vehicles, assigned_tasks and total_distance_meters.
+        fleet: Dict type id -> number of vehicles of that type in the candidate pool.
+    Returns:
+        A dict with:
+        - target_assigned_tasks: the most tasks any scenario assigned (tasks nobody serves, e.g. too heavy
+          for every vehicle, don't count against a fleet).
+        - curve: per total vehicle count, the best scenario (most tasks, then shortest distance).
+        - min_vehicles_per_type: per type, the fewest vehicles of it reaching the target while every
+          other type keeps its full count (None if no such scenario was solved).
+        - smallest_fleets: the scenarios with the fewest vehicles in total that reach the target.
+    """
+    solved = [scenario for scenario in scenarios if scenario['solved']]
+    target = max((scenario['assigned_tasks'] for scenario in solved), default=0)
+    covering = [scenario for scenario in solved if scenario['assigned_tasks'] >= target]
+
+    best_by_size = {}
+    for scenario in solved:
+        rank = (-scenario['assigned_tasks'], scenario['total_distance_meters'])
+        best = best_by_size.get(scenario['num_vehicles'])
+        if best is None or rank < (-best['assigned_tasks'], best['total_distance_meters']):
+            best_by_size[scenario['num_vehicles']] = scenario
+    curve = [{
+        'num_vehicles': num_vehicles,
+        'vehicle_counts': scenario['vehicle_counts'],
+        'assigned_tasks': scenario['assigned_tasks'],
+        'coverage': scenario['coverage'],
+        'total_distance_meters': scenario['total_distance_meters'],
+    } for num_vehicles, scenario in sorted(best_by_size.items())]
+
+    min_vehicles_per_type = {}
+    for type_id in fleet:
+        others_full = [scenario for scenario in covering
+                       if all(scenario['vehicle_counts'][other] == fleet[other] for other in fleet if other != type_id)]
+        min_vehicles_per_type[type_id] = min((scenario['vehicle_counts'][type_id] for scenario in others_full), default=None)
+
+    fewest = min((scenario['num_vehicles'] for scenario in covering), default=None)
+    return {
+        'target_assigned_tasks': target,
+        'curve': curve,
+        'min_vehicles_per_type': min_vehicles_per_type,
+        'smallest_fleets': [scenario['vehicle_counts'] for scenario in covering if scenario['num_vehicles'] == fewest],
+    }
+
+
+def _parse_scenarios(request_data, fleet):
+    """
+    Returns the scenarios of a sweep request as (vehicle counts, search options, drop penalty, overrides) tuples.
+    Raises:
+        SearchOptionsError: If the request is malformed or has too many scenarios.
+    """
+    def type_counts(value, field):
+        try:
+            return {int(type_id): value_of_type for type_id, value_of_type in (value or {}).items()}
+        except (TypeError, ValueError, AttributeError):
+            raise SearchOptionsError(f"{field} must map vehicle type ids to counts.")
+
+    requested = request_data.get("scenarios")
+    if requested is None:
+        mode = request_data.get("sweep") or 'per_type'
+        if mode not in FLEET_SWEEP_MODES:
+            raise SearchOptionsError(f"Unknown sweep '{mode}'. Available: {list(FLEET_SWEEP_MODES)}")
+        try:
+            counts = {type_id: [int(count) for count in type_counts_list]
+                      for type_id, type_counts_list in type_counts(request_data.get("counts"), "counts").items()}
+        except (TypeError, ValueError):
+            raise SearchOptionsError("counts must map vehicle type ids to lists of counts.")
+        requested = [{'vehicle_counts': vehicle_counts} for vehicle_counts in build_sweep_scenarios(fleet, mode, counts)]
+    elif not isinstance(requested, list) or not requested:
+        raise SearchOptionsError("scenarios must be a non-empty list of {vehicle_counts, ...} objects.")
+
+    if len(requested) > get_max_sweep_scenarios():
+        raise SearchOptionsError(
+            f"The sweep has {len(requested)} scenarios, more than the maximum of {get_max_sweep_scenarios()}. "
+            f"Narrow it down with counts or explicit scenarios.")
+
+    scenarios = []
+    for position, scenario in enumerate(requested):
+        if not isinstance(scenario, dict):
+            raise SearchOptionsError(f"Scenario {position} must be an object.")
+        vehicle_counts = type_counts(scenario.get("vehicle_counts", fleet), f"Scenario {position} vehicle_counts")
+        unknown_types = sorted(set(vehicle_counts) - set(fleet))
+        if unknown_types:
+            raise SearchOptionsError(f"Scenario {position} uses vehicle types {unknown_types} that have no vehicles in the pool.")
+        try:
+            vehicle_counts = {type_id: int(vehicle_counts.get(type_id, 0)) for type_id in fleet}
+        except (TypeError, ValueError):
+            raise SearchOptionsError(f"Scenario {position} vehicle_counts must be integers.")
+        if any(count < 0 or count > fleet[type_id] for type_id, count in vehicle_counts.items()):
+            raise SearchOptionsError(f"Scenario {position} vehicle_counts must be between 0 and the vehicles in the pool {fleet}.")
+        # Search options and drop penalty of the sweep, overridden per scenario
+        overrides = {field: scenario[field] for field in SCENARIO_OVERRIDE_FIELDS if field in scenario}
+        scenario_request = dict(request_data, **overrides)
+        scenarios.append((vehicle_counts, resolve_search_options(scenario_request), resolve_drop_penalty(scenario_request), overrides))
+    return scenarios
+
+
+def execute_fleet_sweep(request_data, progress_callback=None, should_stop=None):
+    """
+    Runs a fleet-sizing sweep: solves one task set with varying vehicle subsets, without saving routes.
+    Args:
+        request_data: The sweep request payload:
+                      "depot_id": the depot.
+                      "task_ids" or "date": the tasks, by id or all tasks required on a date (any status,
+                      so past peak days can be replayed).
+                      "vehicle_ids": optional candidate pool (default: all available vehicles). A scenario
+                      with n vehicles of a type uses the first n of that type by id.
+                      "sweep": 'per_type' (default) or 'joint', see build_sweep_scenarios;
+                      "counts": optional {type_id: [counts]} limiting the counts tried per type.
+                      "scenarios": optional explicit list of {"vehicle_counts": {type_id: count}, ...} used
+                      instead of a generated sweep; each may override search options and drop_penalty.
+                      Plus the matrix_provider, search options and drop_penalty of a plan request.
+        progress_callback: Optional callable(stage, message) receiving progress updates.
+        should_stop: Optional callable() -> bool; when it returns True the running searches stop and
+                     report their best solution so far.
+    Returns:
+        A tuple (response_payload, http_status_code).
+    """
+    def report(stage, message):
+        print(message)
+        if progress_callback:
+            progress_callback(stage, message)
+
+    started = time.monotonic()
+    matrix_provider_name = request_data.get("matrix_provider") # None uses the configured default
+    depot_id = request_data.get("depot_id")
+    task_ids = request_data.get("task_ids")
+    plan_date_str = request_data.get("date")
+    if depot_id is None or (task_ids is None and not plan_date_str):
+        return {"error": "Missing required fields: depot_id and task_ids or date"}, status.HTTP_400_BAD_REQUEST
+
+    # --- Fetch Data ---
+    try:
+        depot = Location.objects.get(pk=depot_id, type=Location.LocationType.CEDIS)
+    except (Location.DoesNotExist, TypeError, ValueError):
+        return {"error": f"Depot location with id {depot_id} not found or not a CEDIS."}, status.HTTP_404_NOT_FOUND
+    tasks = Task.objects.select_related('origin', 'destination').order_by('id')
+    tasks = list(tasks.filter(pk__in=task_ids) if task_ids is not None else tasks.filter(required_date=plan_date_str))
+    vehicles = Vehicle.objects.select_related('type').order_by('type_id', 'id')
+    vehicles = list(vehicles.filter(pk__in=request_data["vehicle_ids"]) if request_data.get("vehicle_ids") is not None
+                    else vehicles.filter(is_available=True))
+    if not tasks or not vehicles:
+        return {"warning": "No tasks or vehicles found for the sweep."}, status.HTTP_400_BAD_REQUEST
+
+    vehicles_by_type = {}
+    for vehicle in vehicles:
+        vehicles_by_type.setdefault(vehicle.type_id, []).append(vehicle)
+    fleet = {type_id: len(type_vehicles) for type_id, type_vehicles in vehicles_by_type.items()}
+    try:
+        scenarios = _parse_scenarios(request_data, fleet)
+    except SearchOptionsError as e:
+        return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+
+    # --- One travel matrix for all scenarios ---
+    locations = {depot.id: depot}
+    for task in tasks:
+        locations.setdefault(task.origin_id, task.origin)
+        locations.setdefault(task.destination_id, task.destination)
+    _, _, addresses = merge_colocated_locations(list(locations.values()))
+    report('matrix', f"Getting the distance/duration matrix for {len(addresses)} nodes.")
+    matrix_started = time.monotonic()
+    try:
+        matrix = get_matrix_provider(matrix_provider_name).get_matrices(addresses)
+    except ValueError as e: # e.g. unknown matrix provider or missing API key
+        return {"error": f"Solver configuration error: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    except Exception as e:
+        return {"error": f"Failed to get distance/duration matrix: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    matrix_seconds = time.monotonic() - matrix_started
+
+    # --- Solve the scenarios concurrently ---
+    specs = [{
+        'depot_id': depot.id,
+        'task_ids': [task.id for task in tasks],
+        'vehicle_ids': [vehicle.id for type_id, count in vehicle_counts.items() for vehicle in vehicles_by_type[type_id][:count]],
+        'matrix_provider': matrix_provider_name,
+        'search_options': search_options,
+        'initial_routes': None,
+        'drop_penalty': drop_penalty,
+    } for vehicle_counts, search_options, drop_penalty, _ in scenarios]
+    solvable = [index for index, spec in enumerate(specs) if spec['vehicle_ids']]
+    processes = get_batch_processes(len(solvable))
+    report('solving', f"Solving {len(solvable)} fleet scenarios for {len(tasks)} tasks in {processes} processes.")
+
+    solved = []
+    def on_scenario_solved(position, result):
+        solved.append(position)
+        report('solving', f"Scenario {solvable[position]} {'solved' if result else 'found no solution'} "
+                          f"({len(solved)}/{len(solvable)} done).")
+
+    results = [None] * len(specs)
+    if solvable:
+        for index, result in zip(solvable, solve_on_shared_matrix([specs[index] for index in solvable], matrix, addresses,
+                                                                  processes, should_stop, on_scenario_solved)):
+            results[index] = result
+
+    # --- Cost/coverage per scenario ---
+    payloads = []
+    for (vehicle_counts, _, _, overrides), spec, result in zip(scenarios, specs, results):
+        routes = result.get('routes', []) if result else []
+        dropped_task_ids = result.get('dropped_tasks', []) if result else spec['task_ids']
+        assigned = len(tasks) - len(dropped_task_ids)
+        payloads.append({
+            'vehicle_counts': vehicle_counts,
+            'num_vehicles': len(spec['vehicle_ids']),
+            'overrides': overrides,
+            'solved': result is not None,
+            'vehicles_used': len(routes),
+            'assigned_tasks': assigned,
+            'coverage': round(assigned / len(tasks), 4),
+            'dropped_task_ids': dropped_task_ids,
+            'rejected_tasks': result.get('rejected_tasks', []) if result else [],
+            'total_distance_meters': sum(route['total_distance_meters'] for route in routes),
+            'total_duration_seconds': sum(route['total_duration_seconds'] for route in routes),
+        })
+
+    stopped_early = bool(should_stop and should_stop())
+    return {
+        "message": ("Sweep stopped on request; scenarios report their best solution so far."
+                    if stopped_early else f"Solved {sum(1 for payload in payloads if payload['solved'])} of {len(payloads)} fleet scenarios."),
+        "stopped_early": stopped_early,
+        "num_tasks": len(tasks),
+        "fleet": {type_id: {'name': type_vehicles[0].type.name, 'vehicles': len(type_vehicles)}
+                  for type_id, type_vehicles in vehicles_by_type.items()},
+        **summarize_sweep(payloads, fleet),
+        "scenarios": payloads,
+        "matrix_nodes": len(addresses),
+        "matrix_seconds": round(matrix_seconds, 1),
+        "processes": processes,
+        "elapsed_seconds": round(time.monotonic() - started, 1),
+    }, status.HTTP_200_OK
@@ -0,0 +1,282 @@
+"""
+Cheapest feasible insertion of one pickup/delivery task into the already planned routes of a date,
+without running the solver.
+
+Every (pickup position, delivery position) pair on every route is priced at once with numpy
+(added distance, the solver's objective); candidates are then checked for feasibility in order of
+cost - capacity, location time windows and the route time cap, mirroring the solver model - and
+the first feasible one is committed.
+"""
+import time
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+
+from .matrix_providers import get_matrix_provider
+from .models import Route, RouteStop, Task
+from .vrp_solver import MAX_ROUTE_DURATION_SECONDS, _location_time_window, merge_colocated_locations
+
+# Route statuses that can still receive tasks
+INSERTABLE_ROUTE_STATUSES = [Route.RouteStatus.PENDING, Route.RouteStatus.ASSIGNED]
+# Sequence numbers are moved out of the way by this offset before renumbering (unique per route)
+SEQUENCE_SHIFT = 100000
+
+
+class InsertionError(Exception):
+    """Raised when a task cannot be inserted into the planned routes."""
+    def __init__(self, message, status_code=409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _stop_demands(task):
+    """Returns the (weight, volume) load change at the task's pickup and delivery stops, as in solve_vrp."""
+    weight = int(task.weight_kg or 0)
+    volume = int(task.volume_m3 or 0)
+    if task.type == Task.TaskType.DELIVERY:
+        # Delivery tasks only carry demand at their destination
+        return (0, 0), (weight, volume)
+    return (weight, volume), (-weight, -volume)
+
+
+def _route_visits(route, route_tasks):
+    """
+    Builds the visit list of a route (depots excluded): one dict per stop with its location,
+    task and load change. RouteStop has no task link, so stops are matched to the route's tasks
+    by location and stop type.
+    """
+    unmatched_pickups = list(route_tasks)
+    unmatched_deliveries = list(route_tasks)
+    visits = []
+    for stop in route.stops.all():
+        task = None
+        if stop.stop_type == RouteStop.StopType.PICKUP:
+            task = next((t for t in unmatched_pickups if t.origin_id == stop.location_id), None)
+            if task is not None:
+                unmatched_pickups.remove(task)
+        elif stop.stop_type == RouteStop.StopType.DELIVERY:
+            task = next((t for t in unmatched_deliveries if t.destination_id == stop.location_id), None)
+            if task is not None:
+                unmatched_deliveries.remove(task)
+        else:
+            continue
+        pickup_demand, delivery_demand = _stop_demands(task) if task else ((0, 0), (0, 0))
+        visits.append({
+            'stop': stop,
+            'location': stop.location,
+            'demand': pickup_demand if stop.stop_type == RouteStop.StopType.PICKUP else delivery_demand,
+        })
+    return visits
+
+
+class _RouteCandidate:
+    """A planned route prepared for insertion: its vehicle capacities and the node sequence depot -> visits -> depot."""
+    def __init__(self, route, visits, depot_location):
+        self.route = route
+        self.visits = visits
+        self.depot_location = depot_location
+        self.capacity_weight = int(route.vehicle.type.max_weight_kg or 0)
+        self.capacity_volume = int(route.vehicle.type.max_volume_m3 or 0)
+        self.nodes = None # Filled once the matrix nodes are known
+
+
+def _is_feasible(sequence, durations, service_times, time_windows, capacity_weight, capacity_volume):
+    """
+    Checks one visit sequence (depot -> ... -> depot, as (node, demand) tuples) like the solver model
+    does: loads stay within [0, capacity], every node is served inside its time window (waiting is
+    allowed, depot windows are not enforced) and no time exceeds the route time cap.
+    Returns:
+        The route end time in seconds, or None if infeasible.
+    """
+    load_weight = load_volume = 0
+    current_time = 0
+    previous_node = None
+    last_index = len(sequence) - 1
+    for position, (node, (weight, volume)) in enumerate(sequence):
+        if previous_node is not None:
+            # Service time is incurred once per visited node, before leaving it
+            current_time += int(durations[previous_node, node]) + (service_times[previous_node] if node != previous_node else 0)
+        if 0 < position < last_index:
+            window_start, window_end = time_windows[node]
+            current_time = max(current_time, window_start)
+            if current_time > window_end:
+                return None
+        if current_time > MAX_ROUTE_DURATION_SECONDS:
+            return None
+        load_weight += weight
+        load_volume += volume
+        if not (0 <= load_weight <= capacity_weight and 0 <= load_volume <= capacity_volume):
+            return None
+        previous_node = node
+    return current_time
+
+
+def find_best_insertion(task, routes, route_tasks, matrix_provider):
+    """
+    Finds the cheapest feasible position for a task's pickup and delivery in the given routes.
+    Args:
+        task: The Task to insert.
+        routes: Route objects with stops (and stop locations) and vehicle types prefetched.
+        route_tasks: Dict mapping route id to the list of tasks assigned to it.
+        matrix_provider: The MatrixProvider used for distances/durations.
+    Returns:
+        A dict with route, pickup_position, delivery_position (indices in the route's visit list
+        after insertion), added_distance_meters, end_time_seconds, evaluated_positions and feasibility_checks.
+    Raises:
+        InsertionError: If no feasible position exists.
+    """
+    # --- Collect the locations involved and build one matrix over them ---
+    candidates = []
+    locations = {task.origin_id: task.origin, task.destination_id: task.destination}
+    for route in routes:
+        stops = list(route.stops.all())
+        depot_stop = next((s for s in stops if s.stop_type == RouteStop.StopType.START_DEPOT), None)
+        if depot_stop is None:
+            print(f"Warning: Route {route.id} has no start depot stop. Skipping it for insertion.")
+            continue
+        visits = _route_visits(route, route_tasks.get(route.id, []))
+        candidates.append(_RouteCandidate(route, visits, depot_stop.location))
+        locations[depot_stop.location_id] = depot_stop.location
+        for visit in visits:
+            locations[visit['location'].id] = visit['location']
+    if not candidates:
+        raise InsertionError("No planned routes to insert the task into.", status_code=404)
+
+    node_locations, location_index_map, addresses = merge_colocated_locations(list(locations.values()))
+    travel_matrix = matrix_provider.get_matrices(addresses)
+    distances = np.asarray(travel_matrix.distances, dtype=np.int64)
+    durations = np.asarray(travel_matrix.durations, dtype=np.int64)
+    # Per node, as in solve_vrp: service times summed and time windows intersected over merged locations
+    service_times = [sum(int((loc.average_service_time_mins or 0) * 60) for loc in group) for group in node_locations]
+    time_windows = []
+    for group in node_locations:
+        member_windows = [_location_time_window(loc) for loc in group]
+        window = (max(w[0] for w in member_windows), min(w[1] for w in member_windows))
+        time_windows.append(window if window[0] <= window[1] else member_windows[0])
+
+    pickup_node = location_index_map[task.origin_id]
+    delivery_node = location_index_map[task.destination_id]
+    pickup_demand, delivery_demand = _stop_demands(task)
+
+    # --- Price every (pickup position, delivery position) pair of every route ---
+    priced = [] # (added distance, candidate index, pickup position, delivery position)
+    evaluated_positions = 0
+    for candidate_index, candidate in enumerate(candidates):
+        depot_node = location_index_map[candidate.depot_location.id]
+        nodes = np.array([depot_node] + [location_index_map[v['location'].id] for v in candidate.visits] + [depot_node])
+        candidate.nodes = nodes
+        arc_from, arc_to = nodes[:-1], nodes[1:] # Arc k connects sequence positions k and k+1
+        arc_cost = distances[arc_from, arc_to]
+        pickup_detour = distances[arc_from, pickup_node] + distances[pickup_node, arc_to] - arc_cost
+        delivery_detour = distances[arc_from, delivery_node] + distances[delivery_node, arc_to] - arc_cost
+        # Pickup on arc i, delivery on arc j >= i; on the same arc they are inserted back to back
+        added = pickup_detour[:, np.newaxis] + delivery_detour[np.newaxis, :]
+        same_arc = (distances[arc_from, pickup_node] + distances[pickup_node, delivery_node]
+                    + distances[delivery_node, arc_to] - arc_cost)
+        np.fill_diagonal(added, same_arc)
+        pickup_arcs, delivery_arcs = np.triu_indices(len(arc_cost))
+        costs = added[pickup_arcs, delivery_arcs]
+        evaluated_positions += len(costs)
+        priced.extend(zip(costs.tolist(), [candidate_index] * len(costs), pickup_arcs.tolist(), delivery_arcs.tolist()))
+
+    # --- Check candidates cheapest first; the first feasible one is the best ---
+    priced.sort(key=lambda entry: entry[0])
+    pickup_entry = (pickup_node, pickup_demand)
+    delivery_entry = (delivery_node, delivery_demand)
+    for checks, (added_distance, candidate_index, pickup_arc, delivery_arc) in enumerate(priced, start=1):
+        candidate = candidates[candidate_index]
+        sequence = [(candidate.nodes[0], (0, 0))]
+        sequence += [(candidate.nodes[k + 1], visit['demand']) for k, visit in enumerate(candidate.visits)]
+        sequence.append((candidate.nodes[-1], (0, 0)))
+        # Insert the delivery first so the pickup position stays valid
+        sequence.insert(delivery_arc + 1, delivery_entry)
+        sequence.insert(pickup_arc + 1, pickup_entry)
+        end_time = _is_feasible(sequence, durations, service_times, time_windows,
+                                candidate.capacity_weight, candidate.capacity_volume)
+        if end_time is not None:
+            return {
+                'route': candidate.route,
+                'pickup_position': pickup_arc, # Position among the route's visits (depots excluded)
+                'delivery_position': delivery_arc + 1,
+                'added_distance_meters': int(added_distance),
+                'end_time_seconds': end_time,
+                'evaluated_positions': evaluated_positions,
+                'feasibility_checks': checks,
+            }
+
+    raise InsertionError(
+        f"No feasible insertion position found for task {task.id} in {len(candidates)} routes. "
+        f"Consider re-optimizing the day's routes.")
+
+
+def insert_task(task_id, plan_date_str=None, matrix_provider_name=None):
+    """
+    Inserts a PENDING task into the cheapest feasible position of a date's planned routes and saves it.
+    Args:
+        task_id: The id of the task to insert.
+        plan_date_str: The date whose routes are considered (YYYY-MM-DD). Defaults to the task's required date.
+        matrix_provider_name: Optional MatrixProvider name ('google', 'cache', 'haversine' or 'chained').
+                         Defaults to settings.VRP_MATRIX_PROVIDER.
+    Returns:
+        A dict describing the insertion (route_id, vehicle_id, positions, added distance, timings).
+    Raises:
+        InsertionError: If the task is not insertable or no feasible position exists.
+        ValueError: If the matrix provider is unknown or not configured.
+    """
+    started = time.monotonic()
+
+    try:
+        task = Task.objects.select_related('origin', 'destination').get(pk=task_id)
+    except Task.DoesNotExist:
+        raise InsertionError(f"Task with ID {task_id} not found.", status_code=404)
+    if task.status != Task.TaskStatus.PENDING:
+        raise InsertionError(f"Task {task_id} is not PENDING (status: {task.status}).", status_code=400)
+    plan_date_str = plan_date_str or task.required_date
+    matrix_provider = get_matrix_provider(matrix_provider_name)
+
+    with transaction.atomic():
+        routes = list(Route.objects.select_for_update().filter(
+            planned_date=plan_date_str, status__in=INSERTABLE_ROUTE_STATUSES,
+        ).select_related('vehicle__type').prefetch_related('stops__location'))
+        route_tasks = {}
+        for route_task in Task.objects.filter(route__in=routes, status=Task.TaskStatus.ASSIGNED):
+            route_tasks.setdefault(route_task.route_id, []).append(route_task)
+
+        best = find_best_insertion(task, routes, route_tasks, matrix_provider)
+        route = best['route']
+
+        # --- Commit: shift the following stops and add the two new ones ---
+        stops = [s for s in route.stops.all()]
+        depot_start = [s for s in stops if s.stop_type == RouteStop.StopType.START_DEPOT]
+        depot_end = [s for s in stops if s.stop_type == RouteStop.StopType.END_DEPOT]
+        visit_stops = [s for s in stops if s.stop_type in (RouteStop.StopType.PICKUP, RouteStop.StopType.DELIVERY)]
+        pickup_stop = RouteStop(route=route, location=task.origin, stop_type=RouteStop.StopType.PICKUP)
+        delivery_stop = RouteStop(route=route, location=task.destination, stop_type=RouteStop.StopType.DELIVERY)
+        visit_stops.insert(best['pickup_position'], pickup_stop)
+        visit_stops.insert(best['delivery_position'], delivery_stop)
+        ordered = depot_start + visit_stops + depot_end
+
+        # Move existing sequence numbers out of the way first: (route, sequence_order) is unique
+        RouteStop.objects.filter(route=route).update(sequence_order=F('sequence_order') + SEQUENCE_SHIFT)
+        for sequence_order, stop in enumerate(ordered):
+            stop.sequence_order = sequence_order
+        RouteStop.objects.bulk_update([s for s in ordered if s.pk], ['sequence_order'])
+        RouteStop.objects.bulk_create([pickup_stop, delivery_stop])
+
+        route.total_distance_km = (route.total_distance_km or 0) + best['added_distance_meters'] / 1000.0
+        route.total_duration_mins = round(best['end_time_seconds'] / 60.0)
+        route.save(update_fields=['total_distance_km', 'total_duration_mins', 'updated_at'])
+        Task.objects.filter(pk=task.pk).update(status=Task.TaskStatus.ASSIGNED, route=route)
+
+    return {
+        'task_id': task.id,
+        'route_id': route.id,
+        'vehicle_id': route.vehicle_id,
+        'pickup_sequence_order': pickup_stop.sequence_order,
+        'delivery_sequence_order': delivery_stop.sequence_order,
+        'added_distance_meters': best['added_distance_meters'],
+        'evaluated_positions': best['evaluated_positions'],
+        'feasibility_checks': best['feasibility_checks'],
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+    }
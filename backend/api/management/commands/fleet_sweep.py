@@ -0,0 +1,79 @@
+"""
+Fleet-sizing what-if sweep from the command line, e.g. before a season on a past peak day:
+
+    python manage.py fleet_sweep --depot 1 --date 2024-12-20 --profile preview
+    python manage.py fleet_sweep --depot 1 --date 2024-12-20 --sweep joint --counts 2=4,6,8 --json
+
+Solves the day's tasks with varying vehicles per VehicleType in parallel processes (see
+api.fleet_sizing) and prints the cost/coverage curve. No routes are saved.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.fleet_sizing import FLEET_SWEEP_MODES, execute_fleet_sweep
+
+
+class Command(BaseCommand):
+    help = "Solves a task set with varying numbers of vehicles per type and prints the cost/coverage curve."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depot', type=int, required=True, help="Depot (CEDIS) location id.")
+        parser.add_argument('--date', help="Use all tasks required on this date (YYYY-MM-DD).")
+        parser.add_argument('--tasks', help="Comma-separated task ids, instead of --date.")
+        parser.add_argument('--vehicles', help="Comma-separated candidate vehicle ids. Default: all available vehicles.")
+        parser.add_argument('--sweep', choices=FLEET_SWEEP_MODES, default='per_type',
+                            help="per_type: vary one type at a time, the others at full count. joint: all combinations.")
+        parser.add_argument('--counts', action='append', default=[], metavar='TYPE_ID=N,N,...',
+                            help="Counts to try for a vehicle type (repeatable). Default: 0 up to the pool size.")
+        parser.add_argument('--profile', help="Search profile of every scenario, e.g. preview.")
+        parser.add_argument('--time-limit', type=int, help="Solver time limit per scenario in seconds.")
+        parser.add_argument('--provider', help="Matrix provider (google, cache, haversine or chained).")
+        parser.add_argument('--json', action='store_true', help="Print the full result as JSON.")
+
+    def handle(self, *args, **options):
+        if not options['date'] and not options['tasks']:
+            raise CommandError("Give --date or --tasks.")
+        try:
+            request_data = {
+                'depot_id': options['depot'],
+                'date': options['date'],
+                'sweep': options['sweep'],
+                'counts': {type_id: [int(count) for count in type_counts.split(',')]
+                           for type_id, type_counts in (entry.split('=', 1) for entry in options['counts'])},
+            }
+            if options['tasks']:
+                request_data['task_ids'] = [int(task_id) for task_id in options['tasks'].split(',')]
+            if options['vehicles']:
+                request_data['vehicle_ids'] = [int(vehicle_id) for vehicle_id in options['vehicles'].split(',')]
+        except ValueError:
+            raise CommandError("--tasks, --vehicles and --counts take comma-separated integers (--counts TYPE_ID=N,N).")
+        if options['profile']:
+            request_data['search_profile'] = options['profile']
+        if options['time_limit']:
+            request_data['time_limit_seconds'] = options['time_limit']
+        if options['provider']:
+            request_data['matrix_provider'] = options['provider']
+
+        payload, http_status = execute_fleet_sweep(request_data)
+        if http_status >= 400:
+            raise CommandError(payload.get('error') or payload.get('warning'))
+        if options['json']:
+            self.stdout.write(json.dumps(payload, indent=2))
+            return
+
+        type_names = {type_id: fleet_type['name'] for type_id, fleet_type in payload['fleet'].items()}
+        self.stdout.write(f"{payload['message']} {payload['num_tasks']} tasks, {payload['processes']} processes, "
+                          f"{payload['elapsed_seconds']}s.")
+        self.stdout.write("Vehicles  Tasks   Coverage  Distance (km)  Fleet")
+        for point in payload['curve']:
+            fleet = ', '.join(f"{count} {type_names[type_id]}" for type_id, count in point['vehicle_counts'].items())
+            self.stdout.write(f"{point['num_vehicles']:>8}  {point['assigned_tasks']:>5}  {point['coverage']:>9.1%}"
+                              f"  {point['total_distance_meters'] / 1000:>13.1f}  {fleet}")
+        for type_id, count in payload['min_vehicles_per_type'].items():
+            self.stdout.write(self.style.SUCCESS(
+                f"Minimum {type_names[type_id]}: {count if count is not None else 'not reached'} "
+                f"(of {payload['fleet'][type_id]['vehicles']}, other types at full count)."))
+        if payload['target_assigned_tasks'] < payload['num_tasks']:
+            self.stdout.write(self.style.WARNING(
+                f"No scenario serves all tasks: at most {payload['target_assigned_tasks']} of {payload['num_tasks']}."))
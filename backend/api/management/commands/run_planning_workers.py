@@ -0,0 +1,96 @@
+"""
+Runs a bounded pool of solver worker processes that execute queued planning jobs.
+
+    python manage.py run_planning_workers --workers 4
+"""
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.planning_jobs import default_worker_name, fail_jobs_of_worker, requeue_stale_jobs
+from api.worker_processes import run_planning_worker
+
+DEFAULT_PLANNING_WORKERS = 2
+DEFAULT_WORKER_MEMORY_LIMIT_MB = 2048
+# RUNNING jobs without a heartbeat for this long are considered abandoned (running jobs refresh it
+# every VRP_JOB_HEARTBEAT_INTERVAL_SECONDS, see planning_jobs.JobHeartbeat)
+DEFAULT_STALE_AFTER_SECONDS = 1800
+
+
+class Command(BaseCommand):
+    help = "Starts solver worker processes that claim and execute queued planning jobs from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=getattr(settings, 'VRP_PLANNING_WORKERS', DEFAULT_PLANNING_WORKERS),
+                            help="Number of solver worker processes.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds an idle worker waits before checking the queue again.")
+        parser.add_argument('--stale-after', type=int, default=DEFAULT_STALE_AFTER_SECONDS,
+                            help="Requeue RUNNING jobs whose worker has not reported for this many seconds.")
+        parser.add_argument('--memory-limit-mb', type=int,
+                            default=getattr(settings, 'VRP_WORKER_MEMORY_LIMIT_MB', DEFAULT_WORKER_MEMORY_LIMIT_MB),
+                            help="Address space limit per worker process in MB (0 disables it).")
+
+    def handle(self, *args, **options):
+        num_workers = max(1, options['workers'])
+        poll_interval = options['poll_interval']
+        stale_after = options['stale_after']
+        memory_limit_mb = options['memory_limit_mb']
+
+        requeued = requeue_stale_jobs(stale_after)
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale planning job(s)."))
+
+        # Child processes must open their own database connections
+        connections.close_all()
+
+        processes = {}
+        def start_worker(index):
+            process = multiprocessing.Process(
+                target=run_planning_worker,
+                args=(index, poll_interval, memory_limit_mb),
+                name=f'planning-worker-{index}',
+                # Not daemonic: decomposed plans start their own process pool (daemonic processes
+                # cannot have children). Workers are terminated explicitly on shutdown below.
+                daemon=False,
+            )
+            process.start()
+            processes[index] = process
+
+        # Stop cleanly on SIGTERM (process managers) as well as Ctrl+C
+        def handle_sigterm(signum, frame):
+            raise KeyboardInterrupt
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+        for index in range(num_workers):
+            start_worker(index)
+        self.stdout.write(self.style.SUCCESS(f"Started {num_workers} planning worker(s). Press Ctrl+C to stop."))
+
+        try:
+            while True:
+                time.sleep(5)
+                # Replace workers that died (e.g. killed for exceeding the memory limit).
+                # Their job is failed rather than requeued, as it would most likely crash the next worker too.
+                for index, process in list(processes.items()):
+                    if not process.is_alive():
+                        self.stdout.write(self.style.WARNING(
+                            f"Planning worker {index} exited with code {process.exitcode}. Restarting."))
+                        fail_jobs_of_worker(
+                            default_worker_name(index, pid=process.pid),
+                            f"Solver worker process exited unexpectedly (exit code {process.exitcode}). "
+                            f"The plan may exceed the memory limit of {memory_limit_mb} MB per solve.")
+                        start_worker(index)
+                requeue_stale_jobs(stale_after)
+                connections.close_all()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping planning workers...")
+        finally:
+            for process in processes.values():
+                process.terminate()
+            for process in processes.values():
+                process.join(timeout=10)
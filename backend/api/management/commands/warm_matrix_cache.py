@@ -0,0 +1,91 @@
+"""
+Prefetches pairwise distances/durations for the active location network into the
+persistent matrix store, so the first plans of the day start warm.
+
+Run it after each deploy or from cron, e.g. nightly:
+    python manage.py warm_matrix_cache --sleep 1 --max-elements 200000
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import matrix_store
+from api.models import Location, Task
+from api.vrp_solver import get_google_maps_client, merge_colocated_locations, prefetch_matrix_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Warms the distance matrix store for all depots (CEDIS) and the locations of PENDING tasks. "
+        "Progress is resumable: pairs already in the store are skipped, so an interrupted or "
+        "budget-limited run continues where it stopped when run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Only consider PENDING tasks required on this date (YYYY-MM-DD).")
+        parser.add_argument('--batch-size', type=int, default=25,
+                            help="Origins (matrix rows) prefetched per batch. Default: 25.")
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Seconds to pause between batches, to leave API quota for interactive planning.")
+        parser.add_argument('--max-elements', type=int, default=None,
+                            help="Stop after requesting about this many API elements (resume on the next run).")
+        parser.add_argument('--purge-expired', action='store_true',
+                            help="Delete expired store entries before warming.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many pairs are missing.")
+
+    def handle(self, *args, **options):
+        if options['purge_expired']:
+            deleted = matrix_store.purge_expired_cells()
+            self.stdout.write(f"Purged {deleted} expired matrix entries.")
+
+        # --- Collect the active network: depots + locations referenced by pending tasks ---
+        pending_tasks = Task.objects.filter(status=Task.TaskStatus.PENDING)
+        if options['date']:
+            pending_tasks = pending_tasks.filter(required_date=options['date'])
+        task_location_ids = set(pending_tasks.values_list('origin_id', flat=True))
+        task_location_ids |= set(pending_tasks.values_list('destination_id', flat=True))
+
+        depots = list(Location.objects.filter(type=Location.LocationType.CEDIS).order_by('id'))
+        others = list(Location.objects.filter(pk__in=task_location_ids)
+                      .exclude(type=Location.LocationType.CEDIS).order_by('id'))
+        if not depots and not others:
+            self.stdout.write("No depots or pending task locations found. Nothing to warm.")
+            return
+
+        # Snap exactly like solve_vrp so the stored keys match the keys plans will look up
+        _, _, addresses = merge_colocated_locations(depots + others)
+        num_nodes = len(addresses)
+        total_pairs = num_nodes * num_nodes
+        stored = len(matrix_store.load_cells(addresses))
+        self.stdout.write(
+            f"{len(depots)} depots and {len(others)} task locations -> {num_nodes} matrix nodes. "
+            f"{stored}/{total_pairs} pairs already stored.")
+
+        if options['dry_run'] or stored >= total_pairs:
+            return
+
+        try:
+            client = get_google_maps_client()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # --- Prefetch row batches; each batch only requests what is still missing ---
+        batch_size = max(1, options['batch_size'])
+        max_elements = options['max_elements']
+        requested = 0
+        num_batches = -(-num_nodes // batch_size)
+        for batch_number, start in enumerate(range(0, num_nodes, batch_size), start=1):
+            origin_indices = list(range(start, min(start + batch_size, num_nodes)))
+            fetched = prefetch_matrix_rows(client, addresses, origin_indices)
+            requested += fetched
+            self.stdout.write(f"Batch {batch_number}/{num_batches}: requested {fetched} elements ({requested} total).")
+
+            if max_elements is not None and requested >= max_elements:
+                self.stdout.write(self.style.WARNING(
+                    f"Reached --max-elements ({max_elements}). Run again to resume."))
+                return
+            if fetched and options['sleep'] and batch_number < num_batches:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Matrix store warm: {total_pairs} pairs for {num_nodes} nodes."))
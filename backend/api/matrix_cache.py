@@ -0,0 +1,138 @@
+"""
+Bounded in-process LRU cache for TravelMatrix objects.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024 # 256 MB per worker
+DEFAULT_CACHE_MAX_ENTRIES = 256 # Bounds memory-mapped entries too (open mappings, address space)
+DEFAULT_CACHE_TTL_SECONDS = 3600 # 1 hour
+# Expired entries are swept at most this often (on any cache access)
+SWEEP_INTERVAL_SECONDS = 60
+
+
+class MatrixCache:
+    """
+    Thread-safe LRU cache of TravelMatrix objects with a memory budget in bytes and a cap on entries.
+    Memory-mapped (shared) matrices don't count against the byte budget, only against the entry cap.
+    - Least recently used entries are evicted when the budget or the entry cap is exceeded.
+    - Expired entries (older than the TTL) are swept proactively on any access,
+      not only when their own key is looked up again.
+    - Counters for hits, misses, evictions, expirations and bytes held are exposed via stats().
+    """
+    def __init__(self, max_bytes=None, ttl_seconds=None, max_entries=None):
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(
+            settings, 'DISTANCE_MATRIX_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+        self.max_entries = max_entries if max_entries is not None else getattr(
+            settings, 'DISTANCE_MATRIX_CACHE_MAX_ENTRIES', DEFAULT_CACHE_MAX_ENTRIES)
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else getattr(
+            settings, 'DISTANCE_MATRIX_CACHE_TTL_SECONDS', DEFAULT_CACHE_TTL_SECONDS)
+        self._entries = OrderedDict() # key -> (stored_at, matrix), least recently used first
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Returns the cached TravelMatrix for `key`, or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep_expired(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, matrix = entry
+            if now - stored_at >= self.ttl_seconds:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return matrix
+
+    def peek(self, key):
+        """
+        Returns the cached TravelMatrix for `key`, or None, without counting a hit or miss and
+        without refreshing its LRU position. For re-checks after a lookup was already counted.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] >= self.ttl_seconds:
+                return None
+            return entry[1]
+
+    def put(self, key, matrix):
+        """Caches `matrix` under `key`, evicting least recently used entries to stay within budget and cap."""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep_expired(now)
+            if key in self._entries:
+                self._remove(key)
+            if self.max_entries <= 0: # Caching disabled
+                return
+            entry_bytes = self._entry_bytes(matrix)
+            if entry_bytes > self.max_bytes:
+                print(f"Warning: Matrix of {entry_bytes} bytes exceeds the cache budget of {self.max_bytes} bytes. Not cached.")
+                return
+            self._entries[key] = (now, matrix)
+            self.bytes_held += entry_bytes
+            while self.bytes_held > self.max_bytes or len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        """Drops all entries (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes_held = 0
+
+    def stats(self):
+        """Returns a snapshot of the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes_held': self.bytes_held,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @staticmethod
+    def _entry_bytes(matrix):
+        # Pages of a memory-mapped matrix belong to the OS page cache, not to this worker
+        return 0 if matrix.is_memory_mapped else matrix.nbytes
+
+    def _remove(self, key):
+        _, matrix = self._entries.pop(key)
+        self.bytes_held -= self._entry_bytes(matrix)
+
+    def _sweep_expired(self, now):
+        # Caller must hold the lock
+        if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        expired_keys = [key for key, (stored_at, _) in self._entries.items() if now - stored_at >= self.ttl_seconds]
+        for key in expired_keys:
+            self._remove(key)
+        self.expirations += len(expired_keys)
@@ -0,0 +1,183 @@
+"""
+Pluggable providers for distance/duration matrices.
+
+solve_vrp asks a provider for the matrices of a list of (lat, lng) addresses.
+Providers can be Google Maps (network), the persistent pair store (no network),
+an offline great-circle estimate, or a chain that falls back from one to the next.
+"""
+import numpy as np
+from django.conf import settings
+
+from . import matrix_store
+from .travel_matrix import TravelMatrix
+
+EARTH_RADIUS_METERS = 6371000
+DEFAULT_DETOUR_FACTOR = 1.3 # Road distance / great-circle distance
+DEFAULT_AVERAGE_SPEED_KMH = 40
+DEFAULT_PROVIDER_CHAIN = ['cache', 'google', 'haversine']
+
+
+class MatrixProviderError(Exception):
+    """Raised when a provider cannot produce the requested matrices."""
+    pass
+
+
+class MatrixProvider:
+    """
+    Base class for matrix providers.
+    Subclasses implement get_matrices(addresses) and return a TravelMatrix,
+    with distances in meters and durations in seconds, indexed like `addresses`.
+    """
+    name = None
+
+    def get_matrices(self, addresses):
+        raise NotImplementedError
+
+
+class GoogleMapsMatrixProvider(MatrixProvider):
+    """
+    Fetches matrices from the Google Maps Distance Matrix API (with store and in-memory caching).
+    """
+    name = 'google'
+
+    def __init__(self, client=None):
+        # Imported here because vrp_solver depends on this module
+        from .vrp_solver import get_google_maps_client
+        # Resolve the client up front so a missing API key surfaces as a configuration error
+        self.client = client or get_google_maps_client()
+
+    def get_matrices(self, addresses):
+        from .vrp_solver import create_distance_matrix
+        return create_distance_matrix(self.client, addresses)
+
+
+class StoredMatrixProvider(MatrixProvider):
+    """
+    Serves matrices from the persistent pair store only. Never touches the network.
+    Raises MatrixProviderError if any pair is missing or expired.
+    """
+    name = 'cache'
+
+    def get_matrices(self, addresses):
+        keys = [matrix_store.coordinate_key(addr) for addr in addresses]
+        cells = matrix_store.load_cells(addresses)
+        missing = sum(1 for o in keys for d in keys if (o, d) not in cells)
+        if missing:
+            raise MatrixProviderError(f"{missing} of {len(keys) * len(keys)} matrix cells are not in the store.")
+        matrix = TravelMatrix.empty(len(keys))
+        for i, origin_key in enumerate(keys):
+            for j, destination_key in enumerate(keys):
+                matrix.distances[i, j], matrix.durations[i, j] = cells[(origin_key, destination_key)]
+        return matrix
+
+
+class HaversineMatrixProvider(MatrixProvider):
+    """
+    Offline estimate: vectorized great-circle distance times a road detour factor,
+    and duration from a constant average speed. Computes N=2,000 in milliseconds.
+    """
+    name = 'haversine'
+
+    def __init__(self, detour_factor=None, average_speed_kmh=None):
+        self.detour_factor = detour_factor or getattr(settings, 'VRP_HAVERSINE_DETOUR_FACTOR', DEFAULT_DETOUR_FACTOR)
+        self.average_speed_kmh = average_speed_kmh or getattr(
+            settings, 'VRP_HAVERSINE_AVERAGE_SPEED_KMH', DEFAULT_AVERAGE_SPEED_KMH)
+
+    def get_matrices(self, addresses):
+        coords = np.radians(np.asarray(addresses, dtype=np.float64).reshape(-1, 2))
+        lat = coords[:, 0]
+        lng = coords[:, 1]
+
+        # Haversine formula over all pairs at once (broadcast rows against columns)
+        dlat = lat[:, None] - lat[None, :]
+        dlng = lng[:, None] - lng[None, :]
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+        great_circle = 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+        distances = np.rint(great_circle * self.detour_factor)
+        durations = np.rint(distances / (self.average_speed_kmh / 3.6))
+        return TravelMatrix(distances, durations)
+
+
+class ChainedMatrixProvider(MatrixProvider):
+    """
+    Tries each provider in order and returns the first result, so planning degrades
+    gracefully (e.g. to the offline estimate) when Google Maps is slow or down.
+    """
+    name = 'chained'
+
+    def __init__(self, providers):
+        self.providers = providers
+
+    def get_matrices(self, addresses):
+        errors = []
+        for provider in self.providers:
+            try:
+                matrix = provider.get_matrices(addresses)
+                print(f"Matrix provider '{provider.name}' served {len(addresses)} addresses.")
+                return matrix
+            except Exception as e:
+                print(f"Matrix provider '{provider.name}' failed: {e}")
+                errors.append(f"{provider.name}: {e}")
+        raise MatrixProviderError(f"All matrix providers failed ({'; '.join(errors)}).")
+
+
+class PrecomputedMatrixProvider(MatrixProvider):
+    """
+    Serves sub-matrices of one precomputed matrix over a union of addresses, e.g. the matrix of a
+    whole batch of plans fetched once and shared by the processes solving its sub-problems.
+    Not selectable by name: it is built around a matrix (see load()).
+    """
+    name = 'precomputed'
+
+    def __init__(self, matrix, addresses):
+        self.matrix = matrix
+        self.index_by_key = {matrix_store.coordinate_key(addr): i for i, addr in enumerate(addresses)}
+
+    @classmethod
+    def load(cls, path, addresses):
+        """Memory-maps a matrix written by TravelMatrix.save() (shared pages across processes)."""
+        return cls(TravelMatrix.load(path, mmap=True), addresses)
+
+    def get_matrices(self, addresses):
+        try:
+            indices = [self.index_by_key[matrix_store.coordinate_key(addr)] for addr in addresses]
+        except KeyError as e:
+            raise MatrixProviderError(f"Address {e} is not part of the precomputed matrix.")
+        return self.matrix.submatrix(indices)
+
+
+PROVIDER_CLASSES = {
+    GoogleMapsMatrixProvider.name: GoogleMapsMatrixProvider,
+    StoredMatrixProvider.name: StoredMatrixProvider,
+    HaversineMatrixProvider.name: HaversineMatrixProvider,
+}
+
+
+def get_matrix_provider(name=None):
+    """
+    Builds the matrix provider by name.
+    Args:
+        name: 'google', 'cache', 'haversine' or 'chained'. Defaults to settings.VRP_MATRIX_PROVIDER.
+    Returns:
+        A MatrixProvider instance.
+    Raises:
+        ValueError: If the name is unknown or the provider is not configured (e.g. missing API key).
+    """
+    name = name or getattr(settings, 'VRP_MATRIX_PROVIDER', GoogleMapsMatrixProvider.name)
+    if name == ChainedMatrixProvider.name:
+        providers = []
+        for link in getattr(settings, 'VRP_MATRIX_PROVIDER_CHAIN', DEFAULT_PROVIDER_CHAIN):
+            try:
+                providers.append(get_matrix_provider(link))
+            except ValueError as e:
+                # Skip unconfigured links (e.g. no Google key in dev) instead of failing the whole chain
+                print(f"Warning: Skipping matrix provider '{link}' in chain: {e}")
+        if not providers:
+            raise ValueError("No matrix provider in VRP_MATRIX_PROVIDER_CHAIN could be configured.")
+        return ChainedMatrixProvider(providers)
+
+    if name not in PROVIDER_CLASSES:
+        valid = ', '.join(list(PROVIDER_CLASSES) + [ChainedMatrixProvider.name])
+        raise ValueError(f"Unknown matrix provider '{name}'. Valid options are: {valid}")
+    return PROVIDER_CLASSES[name]()
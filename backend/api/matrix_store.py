@@ -0,0 +1,110 @@
+"""
+Persistent, cross-process store for distance/duration matrix cells.
+
+Cells are kept per ordered (origin, destination) coordinate pair in the
+DistanceMatrixEntry table, so every worker (and every deploy) shares them.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DistanceMatrixEntry
+
+# Entries older than this are ignored and re-fetched (default: 30 days)
+DEFAULT_STORE_TTL_SECONDS = 30 * 24 * 3600
+# Number of decimals kept when building coordinate keys (~0.1 m precision)
+COORDINATE_KEY_DECIMALS = 6
+# Keep IN (...) clauses below the SQLite bound parameter limit
+QUERY_BATCH_SIZE = 500
+
+
+def get_store_ttl_seconds():
+    """Returns the TTL for stored matrix cells, configurable via settings.DISTANCE_MATRIX_STORE_TTL_SECONDS."""
+    return getattr(settings, 'DISTANCE_MATRIX_STORE_TTL_SECONDS', DEFAULT_STORE_TTL_SECONDS)
+
+
+def coordinate_key(address):
+    """
+    Builds the stable string key used to store a coordinate.
+    Args:
+        address: A (lat, lng) tuple.
+    Returns:
+        A string like '19.432608,-99.133209'.
+    """
+    lat, lng = address
+    return f"{float(lat):.{COORDINATE_KEY_DECIMALS}f},{float(lng):.{COORDINATE_KEY_DECIMALS}f}"
+
+
+def load_cells(addresses, destinations=None):
+    """
+    Loads every fresh stored cell between the given addresses.
+    Args:
+        addresses: A list of (lat, lng) tuples (the origins).
+        destinations: Optional list of (lat, lng) destination tuples. Defaults to `addresses`.
+    Returns:
+        A dict mapping (origin_key, destination_key) to (distance_meters, duration_seconds).
+    """
+    origin_keys = list({coordinate_key(addr) for addr in addresses})
+    if destinations is None:
+        destination_keys = origin_keys
+    else:
+        destination_keys = list({coordinate_key(addr) for addr in destinations})
+    if not origin_keys or not destination_keys:
+        return {}
+
+    cutoff = timezone.now() - timedelta(seconds=get_store_ttl_seconds())
+    cells = {}
+    for start in range(0, len(origin_keys), QUERY_BATCH_SIZE):
+        origin_batch = origin_keys[start:start + QUERY_BATCH_SIZE]
+        for dest_start in range(0, len(destination_keys), QUERY_BATCH_SIZE):
+            dest_batch = destination_keys[dest_start:dest_start + QUERY_BATCH_SIZE]
+            rows = DistanceMatrixEntry.objects.filter(
+                origin_key__in=origin_batch,
+                destination_key__in=dest_batch,
+                fetched_at__gte=cutoff,
+            ).values_list('origin_key', 'destination_key', 'distance_meters', 'duration_seconds')
+            for origin_key, destination_key, distance, duration in rows:
+                cells[(origin_key, destination_key)] = (distance, duration)
+    return cells
+
+
+def save_cells(cells):
+    """
+    Inserts or refreshes matrix cells in the persistent store.
+    Args:
+        cells: A dict mapping (origin_key, destination_key) to (distance_meters, duration_seconds).
+    """
+    if not cells:
+        return
+
+    now = timezone.now()
+    entries = [
+        DistanceMatrixEntry(
+            origin_key=origin_key,
+            destination_key=destination_key,
+            distance_meters=distance,
+            duration_seconds=duration,
+            fetched_at=now,
+        )
+        for (origin_key, destination_key), (distance, duration) in cells.items()
+    ]
+    # Upsert so concurrent workers storing the same pair don't fail each other
+    DistanceMatrixEntry.objects.bulk_create(
+        entries,
+        batch_size=QUERY_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['origin_key', 'destination_key'],
+        update_fields=['distance_meters', 'duration_seconds', 'fetched_at'],
+    )
+
+
+def purge_expired_cells():
+    """
+    Deletes stored cells older than the TTL.
+    Returns:
+        The number of deleted entries.
+    """
+    cutoff = timezone.now() - timedelta(seconds=get_store_ttl_seconds())
+    deleted, _ = DistanceMatrixEntry.objects.filter(fetched_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_maintenancetype_maintenancelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistanceMatrixEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin_key', models.CharField(help_text="Origin coordinates as 'lat,lng'", max_length=32)),
+                ('destination_key', models.CharField(help_text="Destination coordinates as 'lat,lng'", max_length=32)),
+                ('distance_meters', models.PositiveIntegerField()),
+                ('duration_seconds', models.PositiveIntegerField()),
+                ('fetched_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'distance matrix entries',
+                'unique_together': {('origin_key', 'destination_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_planningjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='planningjob',
+            name='best_solution',
+            field=models.JSONField(blank=True, help_text='Best solution found so far while solving (cost, routes, elapsed time)', null=True),
+        ),
+    ]
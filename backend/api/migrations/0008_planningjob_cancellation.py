@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_planningjob_best_solution'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='planningjob',
+            name='cancel_requested',
+            field=models.BooleanField(default=False, help_text='Set to stop the running solve and keep the best solution so far'),
+        ),
+        migrations.AlterField(
+            model_name='planningjob',
+            name='status',
+            field=models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled')], db_index=True, default='QUEUED', max_length=10),
+        ),
+    ]
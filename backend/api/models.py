@@ -271,3 +271,80 @@ class MaintenanceLog(models.Model):
 
     class Meta:
         ordering = ['-scheduled_date', '-completion_date']
+
+
+# --- Routing Data Cache Models ---
+
+class DistanceMatrixEntry(models.Model):
+    """
+    Persistent distance/duration for one ordered (origin, destination) coordinate pair.
+    Shared by every worker process, so locations already seen cost no Google Maps elements.
+    Coordinates are stored as rounded "lat,lng" keys (see matrix_store.coordinate_key).
+    """
+    origin_key = models.CharField(max_length=32, help_text="Origin coordinates as 'lat,lng'")
+    destination_key = models.CharField(max_length=32, help_text="Destination coordinates as 'lat,lng'")
+    distance_meters = models.PositiveIntegerField()
+    duration_seconds = models.PositiveIntegerField()
+    fetched_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.origin_key} -> {self.destination_key}: {self.distance_meters}m / {self.duration_seconds}s"
+
+    class Meta:
+        unique_together = ('origin_key', 'destination_key')
+        verbose_name_plural = 'distance matrix entries'
+
+
+class MatrixFetchLease(models.Model):
+    """
+    Cross-process lock held while one worker fetches matrix cells for a location set from Google Maps.
+    Other workers wait for it to be released and then read the cells from DistanceMatrixEntry.
+    """
+    key = models.CharField(max_length=64, unique=True, help_text="Hash of the sorted coordinate keys")
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Lease {self.key[:12]} held by {self.owner} until {self.expires_at}"
+
+
+# --- Asynchronous Planning ---
+
+class PlanningJob(models.Model):
+    """
+    A route planning request executed in the background by a solver worker process.
+    The database row is the queue: workers claim QUEUED jobs and write progress and results back.
+    """
+    class JobStatus(models.TextChoices):
+        QUEUED = 'QUEUED', _('Queued')
+        RUNNING = 'RUNNING', _('Running')
+        SUCCEEDED = 'SUCCEEDED', _('Succeeded')
+        FAILED = 'FAILED', _('Failed')
+        CANCELLED = 'CANCELLED', _('Cancelled')
+
+    status = models.CharField(
+        max_length=10,
+        choices=JobStatus.choices,
+        default=JobStatus.QUEUED,
+        db_index=True
+    )
+    request_data = models.JSONField(help_text="The plan request payload (depot_id, task_ids, vehicle_ids, date, ...)")
+    progress = models.JSONField(default=dict, blank=True, help_text="Latest progress update (stage, message)")
+    best_solution = models.JSONField(blank=True, null=True, help_text="Best solution found so far while solving (cost, routes, elapsed time)")
+    result = models.JSONField(blank=True, null=True, help_text="Response payload of the finished plan")
+    result_status_code = models.PositiveIntegerField(blank=True, null=True, help_text="HTTP status of the finished plan")
+    error = models.TextField(blank=True, null=True)
+    cancel_requested = models.BooleanField(default=False, help_text="Set to stop the running solve and keep the best solution so far")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='planning_jobs')
+    worker = models.CharField(max_length=100, blank=True, null=True, help_text="Worker process that claimed the job")
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True, help_text="Last progress update from the worker")
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Planning job {self.id} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
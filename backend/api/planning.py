@@ -0,0 +1,301 @@
+"""
+Route planning workflow shared by the synchronous plan endpoint and the background planning jobs:
+fetch the requested depot/tasks/vehicles, run the solver and save the resulting routes.
+"""
+from django.db import transaction
+from rest_framework import status
+
+from .models import Location, Vehicle, Task, Route, RouteStop
+from .decomposition import should_decompose, solve_vrp_decomposed
+from .matrix_providers import get_matrix_provider
+from .portfolio import solve_vrp_portfolio
+from .search_options import SearchOptionsError, parse_boolean, resolve_portfolio_options, resolve_search_options
+from .vrp_solver import solve_vrp
+
+REQUIRED_PLAN_FIELDS = ["depot_id", "task_ids", "vehicle_ids", "date"]
+
+
+def missing_plan_fields(request_data):
+    """Returns the required plan fields missing from the request data."""
+    return [field for field in REQUIRED_PLAN_FIELDS if field not in request_data]
+
+
+def resolve_drop_penalty(request_data):
+    """
+    Returns the request's drop_penalty as an int, or None to use settings.VRP_TASK_DROP_PENALTY.
+    Raises:
+        SearchOptionsError: If it is not a non-negative integer.
+    """
+    drop_penalty = request_data.get("drop_penalty")
+    if drop_penalty is None:
+        return None
+    try:
+        drop_penalty = int(drop_penalty)
+    except (TypeError, ValueError):
+        drop_penalty = -1
+    if drop_penalty < 0:
+        raise SearchOptionsError("drop_penalty must be a non-negative integer.")
+    return drop_penalty
+
+
+def save_solution(solution, plan_date_str, replace_routes=None):
+    """
+    Persists solver routes as Route/RouteStop rows and links each task to the route that serves it.
+    Args:
+        solution: The dictionary returned by solve_vrp (must contain routes).
+        plan_date_str: The planned date (YYYY-MM-DD).
+        replace_routes: Optional existing Route rows being re-optimized. A vehicle keeps its Route row
+                        (stops are rewritten), routes left empty are deleted, and their tasks that are
+                        no longer planned go back to PENDING.
+    Returns:
+        A tuple (route_ids, assigned_task_ids).
+    """
+    with transaction.atomic(): # Ensure all DB changes succeed or fail together
+        saved_routes = []
+        assigned_task_ids = set()
+        reusable_routes = {route.vehicle_id: route for route in (replace_routes or [])}
+
+        for route_data in solution['routes']:
+            vehicle = Vehicle.objects.get(pk=route_data['vehicle_id'])
+            route = reusable_routes.pop(vehicle.id, None)
+            if route is None:
+                # Create Route object
+                route = Route.objects.create(
+                    vehicle=vehicle,
+                    planned_date=plan_date_str, # Store the planned date
+                    status=Route.RouteStatus.ASSIGNED, # Mark as assigned
+                    total_distance_km=route_data['total_distance_meters'] / 1000.0,
+                    total_duration_mins=round(route_data['total_duration_seconds'] / 60.0),
+                    # Add start/end times later if calculated by solver
+                )
+            else:
+                # Re-optimized route: keep the row (and its id), rewrite the stops
+                route.status = Route.RouteStatus.ASSIGNED
+                route.total_distance_km = route_data['total_distance_meters'] / 1000.0
+                route.total_duration_mins = round(route_data['total_duration_seconds'] / 60.0)
+                route.save(update_fields=['status', 'total_distance_km', 'total_duration_mins', 'updated_at'])
+                route.stops.all().delete()
+            saved_routes.append(route.id)
+
+            # Create RouteStop objects
+            route_task_ids = set()
+            for i, stop_data in enumerate(route_data['stops']):
+                location = Location.objects.get(pk=stop_data['location_id'])
+                RouteStop.objects.create(
+                    route=route,
+                    location=location,
+                    sequence_order=i,
+                    stop_type=stop_data['type'],
+                    # TODO: Convert seconds back to DateTime based on plan_date_str + seconds
+                    # estimated_arrival_time=...,
+                    # estimated_departure_time=...,
+                    # Add load changes etc. later
+                )
+                # Collect the tasks served by this route
+                if stop_data['task_id']:
+                    route_task_ids.add(stop_data['task_id'])
+
+            # Mark the route's tasks as assigned to it
+            Task.objects.filter(pk__in=route_task_ids).update(status=Task.TaskStatus.ASSIGNED, route=route)
+            assigned_task_ids |= route_task_ids
+
+        if replace_routes:
+            replaced_route_ids = [route.id for route in replace_routes]
+            Task.objects.filter(route_id__in=replaced_route_ids).exclude(pk__in=assigned_task_ids).update(
+                status=Task.TaskStatus.PENDING, route=None)
+            Route.objects.filter(pk__in=[route.id for route in reusable_routes.values()]).delete()
+
+    return saved_routes, assigned_task_ids
+
+
+def load_current_routes(plan_date_str, depot_id):
+    """
+    Loads the routes of a date and depot that can still be re-optimized (not yet in transit or completed).
+    Args:
+        plan_date_str: The planned date (YYYY-MM-DD).
+        depot_id: The depot being re-planned. Only routes starting there are loaded, so other
+                  depots' routes of the same day are left alone.
+    Returns:
+        A tuple (routes, tasks, initial_routes) where tasks are the ASSIGNED tasks of those routes
+        and initial_routes maps vehicle id to the ordered pickup/delivery location ids of its route.
+    """
+    routes = list(Route.objects.filter(
+        planned_date=plan_date_str,
+        status__in=[Route.RouteStatus.PENDING, Route.RouteStatus.ASSIGNED],
+        stops__stop_type=RouteStop.StopType.START_DEPOT,
+        stops__location_id=depot_id,
+    ).distinct().prefetch_related('stops'))
+    tasks = list(Task.objects.filter(route__in=routes, status=Task.TaskStatus.ASSIGNED)
+                 .select_related('origin', 'destination'))
+    initial_routes = {}
+    for route in routes:
+        initial_routes.setdefault(route.vehicle_id, []).extend(
+            stop.location_id for stop in route.stops.all() # Ordered by sequence_order
+            if stop.stop_type in (RouteStop.StopType.PICKUP, RouteStop.StopType.DELIVERY))
+    return routes, tasks, initial_routes
+
+
+def execute_plan(request_data, progress_callback=None, solution_callback=None, should_stop=None):
+    """
+    Runs a full planning request: fetch data, solve, save routes.
+    Args:
+        request_data: Dict with depot_id, task_ids, vehicle_ids, date and optional matrix_provider,
+                      search_profile and search option overrides (see search_options.SEARCH_OPTION_FIELDS).
+                      With "reoptimize": true the date's current routes from this depot and their tasks are planned
+                      together with the new tasks, starting from the current stop sequences.
+                      "decompose": true/false forces or disables the regional decomposition of large
+                      plans (by default used from settings.VRP_DECOMPOSITION_MIN_TASKS tasks).
+                      "portfolio": true (or a list of search option overrides) runs several searches
+                      in parallel and keeps the best (see search_options.resolve_portfolio_options).
+                      "drop_penalty" overrides settings.VRP_TASK_DROP_PENALTY (0: every task is mandatory).
+                      With "dry_run": true the routes are returned but not saved, so the tasks stay PENDING
+                      and re-running the unchanged request is served from the solution cache.
+        progress_callback: Optional callable(stage, message) receiving progress updates.
+        solution_callback: Optional callable(snapshot) receiving each improving solution (see solve_vrp).
+        should_stop: Optional callable() -> bool; when it returns True the search stops early and the
+                     best solution found so far is saved (see solve_vrp).
+    Returns:
+        A tuple (response_payload, http_status_code).
+    """
+    def report(stage, message):
+        if progress_callback:
+            progress_callback(stage, message)
+
+    depot_id = request_data.get("depot_id")
+    task_ids = request_data.get("task_ids", [])
+    vehicle_ids = request_data.get("vehicle_ids", [])
+    plan_date_str = request_data.get("date") # Keep as string for now
+    matrix_provider_name = request_data.get("matrix_provider") # None uses the configured default
+    reoptimize = request_data.get("reoptimize")
+    dry_run = request_data.get("dry_run")
+    decompose = request_data.get("decompose") # None decides by plan size
+    try:
+        reoptimize = parse_boolean(reoptimize, 'reoptimize')
+        dry_run = parse_boolean(dry_run, 'dry_run')
+        if decompose is not None:
+            decompose = parse_boolean(decompose, 'decompose')
+        search_options = resolve_search_options(request_data)
+        portfolio_options = resolve_portfolio_options(request_data)
+        drop_penalty = resolve_drop_penalty(request_data) # None uses the configured default
+    except SearchOptionsError as e:
+        return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+
+    # --- Fetch Data ---
+    report('loading', "Loading depot, tasks and vehicles.")
+    try:
+        depot = Location.objects.get(pk=depot_id, type=Location.LocationType.CEDIS)
+        # Fetch only PENDING tasks for the specified IDs
+        tasks_to_plan = list(Task.objects.filter(pk__in=task_ids, status=Task.TaskStatus.PENDING)
+                             .select_related('origin', 'destination'))
+        # Fetch only AVAILABLE vehicles for the specified IDs
+        available_vehicles = list(Vehicle.objects.filter(pk__in=vehicle_ids, is_available=True))
+
+        current_routes, initial_routes = [], None
+        if reoptimize:
+            # Re-plan the day's current routes together with the new tasks
+            current_routes, current_tasks, initial_routes = load_current_routes(plan_date_str, depot.id)
+            planned_task_ids = {task.id for task in tasks_to_plan}
+            tasks_to_plan += [task for task in current_tasks if task.id not in planned_task_ids]
+            vehicle_ids_in_plan = {vehicle.id for vehicle in available_vehicles}
+            available_vehicles += list(Vehicle.objects.filter(
+                pk__in=[route.vehicle_id for route in current_routes], is_available=True
+            ).exclude(pk__in=vehicle_ids_in_plan))
+
+        if not tasks_to_plan:
+            return {"warning": "No pending tasks found for the given IDs."}, status.HTTP_400_BAD_REQUEST
+        if not available_vehicles:
+            return {"warning": "No available vehicles found for the given IDs."}, status.HTTP_400_BAD_REQUEST
+
+    except Location.DoesNotExist:
+        return {"error": f"Depot location with ID {depot_id} not found or is not a CEDIS."}, status.HTTP_404_NOT_FOUND
+    except Vehicle.DoesNotExist: # Should not happen with filter but good practice
+         return {"error": "One or more specified vehicles not found."}, status.HTTP_404_NOT_FOUND
+    except Task.DoesNotExist: # Should not happen with filter but good practice
+         return {"error": "One or more specified tasks not found."}, status.HTTP_404_NOT_FOUND
+    except Exception as e:
+         return {"error": f"Error fetching data: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    # --- Call Solver ---
+    try:
+        # TODO: Pass plan_date_str to solver if needed for multi-day or date-specific logic
+        matrix_provider = get_matrix_provider(matrix_provider_name)
+        if should_decompose(len(tasks_to_plan), decompose):
+            # Very large plan: regional sub-problems solved in parallel processes.
+            # Improving solutions are not streamed, as each process only sees its own region.
+            solution = solve_vrp_decomposed(depot, tasks_to_plan, available_vehicles,
+                                            matrix_provider_name=matrix_provider_name,
+                                            progress_callback=progress_callback, search_options=search_options,
+                                            should_stop=should_stop, initial_routes=initial_routes,
+                                            drop_penalty=drop_penalty)
+        elif portfolio_options:
+            # Improving solutions are not streamed: each search runs in its own process
+            solution = solve_vrp_portfolio(depot, tasks_to_plan, available_vehicles, portfolio_options,
+                                           matrix_provider_name=matrix_provider_name,
+                                           progress_callback=progress_callback, should_stop=should_stop,
+                                           initial_routes=initial_routes, drop_penalty=drop_penalty)
+        else:
+            solution = solve_vrp(depot, tasks_to_plan, available_vehicles, matrix_provider=matrix_provider,
+                                 progress_callback=progress_callback, search_options=search_options,
+                                 solution_callback=solution_callback, should_stop=should_stop,
+                                 initial_routes=initial_routes, drop_penalty=drop_penalty)
+    except ValueError as e: # Catch specific errors like missing API key
+        return {"error": f"Solver configuration error: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    except Exception as e:
+        # Log the full error details here
+        print(f"Unhandled solver error: {e}")
+        return {"error": f"An unexpected error occurred during route planning: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    stopped_early = bool(should_stop and should_stop())
+
+    # --- Process Solution ---
+    if solution and solution.get('routes') and dry_run:
+        # Review only: nothing is saved, the tasks stay PENDING
+        return {
+            "message": "Dry run: routes planned but not saved.",
+            "dry_run": True,
+            "stopped_early": stopped_early,
+            "reoptimized": reoptimize,
+            "warm_started": solution.get('warm_started', False),
+            "cached": solution.get('cached', False),
+            "decomposition": solution.get('decomposition'),
+            "portfolio": solution.get('portfolio'),
+            "planned_routes": solution.get('routes', []),
+            "dropped_task_ids": solution.get('dropped_tasks', []),
+            "rejected_tasks": solution.get('rejected_tasks', []),
+        }, status.HTTP_200_OK
+    elif solution and solution.get('routes'):
+        report('saving', "Saving planned routes.")
+        try:
+            created_routes, assigned_task_ids = save_solution(solution, plan_date_str, replace_routes=current_routes)
+
+            # Include the detailed solution routes in the response
+            return {
+                "message": ("Planning stopped on request. Best routes found so far saved."
+                            if stopped_early else "Routes planned successfully."),
+                "stopped_early": stopped_early,
+                "reoptimized": reoptimize,
+                "warm_started": solution.get('warm_started', False),
+                "cached": solution.get('cached', False), # Unchanged input: stored solution returned
+                "decomposition": solution.get('decomposition'), # None unless decomposed
+                "portfolio": solution.get('portfolio'), # Winning configuration, None unless portfolio mode
+                "created_route_ids": created_routes,
+                "assigned_task_ids": list(assigned_task_ids),
+                "planned_routes": solution.get('routes', []), # Add the detailed routes here
+                "dropped_task_ids": solution.get('dropped_tasks', []), # Left unplanned (still PENDING)
+                "rejected_tasks": solution.get('rejected_tasks', []), # Provably infeasible, with the reason
+            }, status.HTTP_201_CREATED
+
+        except Exception as e:
+            # Log the error
+            print(f"Error saving solution to database: {e}")
+            return {"error": f"Failed to save planned routes: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    elif stopped_early:
+        return {"message": "Planning stopped on request before any routes were found."}, status.HTTP_200_OK
+    else:
+        # Handle case where solver runs but finds no solution
+        response = {"message": "No feasible routes found for the given tasks and vehicles."}
+        if solution:
+            # Every task was dropped (e.g. all rejected by the feasibility pre-screen)
+            response["dropped_task_ids"] = solution.get('dropped_tasks', [])
+            response["rejected_tasks"] = solution.get('rejected_tasks', [])
+        return response, status.HTTP_200_OK # 200 OK, but indicate no solution found
@@ -0,0 +1,364 @@
+"""
+Database-backed queue of background planning jobs.
+
+The PlanningJob table is the queue, so no external broker is needed:
+plan_routes_view enqueues a job, solver worker processes (see the
+run_planning_workers command) claim QUEUED jobs, report progress and store
+the final result, which clients poll through the job detail endpoint.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .models import PlanningJob
+from .batch_planning import execute_batch_plan
+from .fleet_sizing import execute_fleet_sweep
+from .planning import execute_plan
+
+DEFAULT_POLL_INTERVAL_SECONDS = 1.0
+# Improving solutions are written to the job at most this often (the solver can find many per second)
+DEFAULT_SOLUTION_SNAPSHOT_INTERVAL_SECONDS = 1.0
+# Running jobs check for a cancel request at most this often
+DEFAULT_CANCEL_POLL_INTERVAL_SECONDS = 1.0
+# Running jobs refresh their heartbeat this often, whatever the solver is doing (see JobHeartbeat)
+DEFAULT_JOB_HEARTBEAT_INTERVAL_SECONDS = 30.0
+FINISHED_JOB_STATUSES = (
+    PlanningJob.JobStatus.SUCCEEDED, PlanningJob.JobStatus.FAILED, PlanningJob.JobStatus.CANCELLED)
+
+
+def enqueue_planning_job(request_data, user=None):
+    """
+    Creates a QUEUED planning job for the given plan request.
+    Args:
+        request_data: The plan request payload (same fields as plan_routes_view, or plan_batch_view; a
+                      fleet_sweep_view request is marked with "fleet_sweep": true).
+        user: The requesting user, if authenticated.
+    Returns:
+        The created PlanningJob.
+    """
+    data = dict(request_data.items()) if hasattr(request_data, 'items') else dict(request_data)
+    data.pop('async', None)
+    return PlanningJob.objects.create(
+        request_data=data,
+        created_by=user if user is not None and user.is_authenticated else None,
+        progress={'stage': 'queued', 'message': "Waiting for a solver worker."},
+    )
+
+
+def claim_next_job(worker_name):
+    """
+    Atomically claims the oldest QUEUED job for this worker.
+    The conditional UPDATE makes the claim safe between concurrent workers on any database backend.
+    Returns:
+        The claimed PlanningJob, or None if the queue is empty.
+    """
+    candidate_ids = PlanningJob.objects.filter(
+        status=PlanningJob.JobStatus.QUEUED
+    ).order_by('created_at', 'id').values_list('id', flat=True)[:5]
+
+    for job_id in candidate_ids:
+        now = timezone.now()
+        claimed = PlanningJob.objects.filter(pk=job_id, status=PlanningJob.JobStatus.QUEUED).update(
+            status=PlanningJob.JobStatus.RUNNING,
+            worker=worker_name,
+            started_at=now,
+            heartbeat_at=now,
+            progress={'stage': 'starting', 'message': f"Claimed by {worker_name}."},
+        )
+        if claimed:
+            return PlanningJob.objects.get(pk=job_id)
+    return None
+
+
+def cancel_planning_job(job):
+    """
+    Cancels a planning job.
+    A QUEUED job is cancelled right away. For a RUNNING job a cancel request is recorded:
+    its worker stops the search and saves the best solution found so far.
+    Returns:
+        True if the job was cancelled or a cancel request recorded, False if it had already finished.
+    """
+    now = timezone.now()
+    if PlanningJob.objects.filter(pk=job.pk, status=PlanningJob.JobStatus.QUEUED).update(
+            status=PlanningJob.JobStatus.CANCELLED,
+            cancel_requested=True,
+            progress={'stage': 'cancelled', 'message': "Cancelled before a solver worker picked it up."},
+            finished_at=now):
+        return True
+    return bool(PlanningJob.objects.filter(pk=job.pk, status=PlanningJob.JobStatus.RUNNING).update(
+        cancel_requested=True))
+
+
+class CancellationCheck:
+    """
+    should_stop callable for solve_vrp: returns True once the job has a cancel request.
+    OR-Tools calls it continuously during the search, so the database is polled at most once per interval.
+    """
+    def __init__(self, job_id, interval_seconds=None):
+        self.job_id = job_id
+        self.interval_seconds = interval_seconds if interval_seconds is not None else getattr(
+            settings, 'VRP_CANCEL_POLL_INTERVAL_SECONDS', DEFAULT_CANCEL_POLL_INTERVAL_SECONDS)
+        self.cancelled = False
+        self._last_poll = None
+
+    def __call__(self):
+        if self.cancelled:
+            return True
+        now = time.monotonic()
+        if self._last_poll is not None and now - self._last_poll < self.interval_seconds:
+            return False
+        self._last_poll = now
+        self.cancelled = PlanningJob.objects.filter(pk=self.job_id, cancel_requested=True).exists()
+        if self.cancelled:
+            print(f"Cancel requested for planning job {self.job_id}. Stopping the search.")
+        return self.cancelled
+
+
+def update_job_progress(job_id, stage, message, **extra):
+    """Stores the latest progress update of a running job and refreshes its heartbeat."""
+    progress = {'stage': stage, 'message': message, **extra}
+    PlanningJob.objects.filter(pk=job_id).update(progress=progress, heartbeat_at=timezone.now())
+
+
+class BestSolutionRecorder:
+    """
+    Solution callback for solve_vrp that stores the latest improving solution on the job and
+    refreshes the job heartbeat. Writes are throttled to one per interval; an improvement that
+    arrives inside the interval is written when the interval ends, so the newest one is never lost.
+    """
+    def __init__(self, job_id, interval_seconds=None):
+        self.job_id = job_id
+        self.interval_seconds = interval_seconds if interval_seconds is not None else getattr(
+            settings, 'VRP_SOLUTION_SNAPSHOT_INTERVAL_SECONDS', DEFAULT_SOLUTION_SNAPSHOT_INTERVAL_SECONDS)
+        self._lock = threading.Lock()
+        self._pending = None
+        self._last_write = None
+        self._timer = None
+        self._closed = False
+
+    def __call__(self, snapshot):
+        with self._lock:
+            if self._closed:
+                return
+            self._pending = snapshot
+            wait = 0 if self._last_write is None else self.interval_seconds - (time.monotonic() - self._last_write)
+            if wait <= 0:
+                self._write_pending()
+            elif self._timer is None:
+                self._timer = threading.Timer(wait, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def close(self):
+        """Stops writing snapshots (call before storing the final result)."""
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _flush_from_timer(self):
+        try:
+            with self._lock:
+                self._timer = None
+                if not self._closed and self._pending is not None:
+                    self._write_pending()
+        finally:
+            connection.close() # The timer thread opened its own database connection
+
+    def _write_pending(self):
+        # Caller must hold the lock
+        snapshot, self._pending = self._pending, None
+        self._last_write = time.monotonic()
+        PlanningJob.objects.filter(pk=self.job_id).update(
+            best_solution=snapshot,
+            heartbeat_at=timezone.now(),
+            progress={
+                'stage': 'solving',
+                'message': f"Solution {snapshot['solution_number']} found (cost {snapshot['cost']}).",
+                'solution_number': snapshot['solution_number'],
+                'cost': snapshot['cost'],
+                'elapsed_seconds': snapshot['elapsed_seconds'],
+            },
+        )
+
+
+class JobHeartbeat:
+    """
+    Background thread that refreshes the heartbeat of a running job at a fixed interval.
+    Progress updates and solution snapshots refresh it too, but batch plans, sweeps, decomposed plans
+    and long searches without improvements can go quiet for much longer than the stale threshold of
+    requeue_stale_jobs, which would hand a live job to a second worker.
+    Only a job still RUNNING on this worker is touched, so a job that was taken over is left alone.
+    """
+    def __init__(self, job, interval_seconds=None):
+        self.job_id = job.id
+        self.worker = job.worker
+        self.interval_seconds = interval_seconds if interval_seconds is not None else getattr(
+            settings, 'VRP_JOB_HEARTBEAT_INTERVAL_SECONDS', DEFAULT_JOB_HEARTBEAT_INTERVAL_SECONDS)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'job-heartbeat-{job.id}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.interval_seconds):
+                PlanningJob.objects.filter(
+                    pk=self.job_id, worker=self.worker, status=PlanningJob.JobStatus.RUNNING
+                ).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close() # The heartbeat thread opened its own database connection
+
+
+def finish_job(job, **fields):
+    """
+    Stores the final state of a job, unless the job is no longer RUNNING on this worker (e.g. it was
+    requeued and taken over by another worker, whose result must not be overwritten).
+    Returns:
+        True if the job was updated.
+    """
+    updated = PlanningJob.objects.filter(
+        pk=job.id, worker=job.worker, status=PlanningJob.JobStatus.RUNNING
+    ).update(finished_at=timezone.now(), **fields)
+    if not updated:
+        print(f"Planning job {job.id} is no longer running on {job.worker}; its result was not stored.")
+    return bool(updated)
+
+
+def run_job(job):
+    """
+    Executes a claimed job and records its result.
+    Plans that end with an error response (4xx/5xx) are marked FAILED with the response kept as result;
+    plans stopped by a cancel request are marked CANCELLED (their best routes are still saved).
+    """
+    print(f"Running planning job {job.id}.")
+    solution_recorder = BestSolutionRecorder(job.id)
+    cancellation = CancellationCheck(job.id)
+    heartbeat = JobHeartbeat(job).start()
+    try:
+        if job.request_data.get('fleet_sweep'):
+            # Fleet-sizing what-if sweep (see fleet_sizing); nothing is saved but the job result
+            payload, http_status = execute_fleet_sweep(
+                job.request_data,
+                progress_callback=lambda stage, message: update_job_progress(job.id, stage, message),
+                should_stop=cancellation,
+            )
+        elif 'plans' in job.request_data:
+            # Batch request (see batch_planning); improving solutions are not streamed
+            payload, http_status = execute_batch_plan(
+                job.request_data,
+                progress_callback=lambda stage, message: update_job_progress(job.id, stage, message),
+                should_stop=cancellation,
+            )
+        else:
+            payload, http_status = execute_plan(
+                job.request_data,
+                progress_callback=lambda stage, message: update_job_progress(job.id, stage, message),
+                solution_callback=solution_recorder,
+                should_stop=cancellation,
+            )
+    except Exception as e:
+        heartbeat.stop()
+        solution_recorder.close()
+        print(f"Planning job {job.id} crashed: {e}")
+        finish_job(
+            job,
+            status=PlanningJob.JobStatus.FAILED,
+            error=f"{e}\n{traceback.format_exc()}",
+            progress={'stage': 'failed', 'message': str(e)},
+        )
+        return
+
+    heartbeat.stop()
+    solution_recorder.close()
+    succeeded = http_status < 400
+    if not succeeded:
+        final_status = PlanningJob.JobStatus.FAILED
+    elif cancellation.cancelled:
+        final_status = PlanningJob.JobStatus.CANCELLED
+    else:
+        final_status = PlanningJob.JobStatus.SUCCEEDED
+    if finish_job(
+        job,
+        status=final_status,
+        result=payload,
+        result_status_code=http_status,
+        error=None if succeeded else (payload.get('error') or payload.get('warning')),
+        progress={'stage': 'finished', 'message': payload.get('message') or payload.get('error') or payload.get('warning')},
+    ):
+        print(f"Planning job {job.id} finished with HTTP status {http_status}.")
+
+
+def requeue_stale_jobs(stale_after_seconds):
+    """
+    Puts RUNNING jobs whose worker stopped reporting (crashed or killed) back in the queue.
+    Stale jobs with a cancel request are marked CANCELLED instead.
+    Returns:
+        The number of requeued jobs.
+    """
+    now = timezone.now()
+    stale_jobs = PlanningJob.objects.filter(
+        status=PlanningJob.JobStatus.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=stale_after_seconds),
+    )
+    stale_jobs.filter(cancel_requested=True).update(
+        status=PlanningJob.JobStatus.CANCELLED,
+        progress={'stage': 'cancelled', 'message': "Cancelled; the worker stopped responding."},
+        finished_at=now,
+    )
+    return stale_jobs.filter(cancel_requested=False).update(
+        status=PlanningJob.JobStatus.QUEUED,
+        worker=None,
+        progress={'stage': 'queued', 'message': "Requeued after the previous worker stopped responding."},
+    )
+
+
+def fail_jobs_of_worker(worker_name, reason):
+    """
+    Marks the RUNNING jobs of a worker process that died as FAILED (instead of requeueing them:
+    a job that crashes its worker, e.g. by exceeding the memory limit, would crash the next one too).
+    Returns:
+        The number of failed jobs.
+    """
+    return PlanningJob.objects.filter(status=PlanningJob.JobStatus.RUNNING, worker=worker_name).update(
+        status=PlanningJob.JobStatus.FAILED,
+        error=reason,
+        progress={'stage': 'failed', 'message': reason},
+        finished_at=timezone.now(),
+    )
+
+
+def default_worker_name(index=0, pid=None):
+    """Builds a worker name unique across hosts and processes (pid defaults to the current process)."""
+    return f"{socket.gethostname()}:{pid or os.getpid()}:{index}"
+
+
+def worker_loop(worker_name, poll_interval=DEFAULT_POLL_INTERVAL_SECONDS, max_jobs=None):
+    """
+    Claims and runs jobs until max_jobs have been processed (forever if None).
+    Sleeps poll_interval seconds whenever the queue is empty.
+    """
+    processed = 0
+    print(f"Planning worker {worker_name} started.")
+    while max_jobs is None or processed < max_jobs:
+        close_old_connections()
+        job = claim_next_job(worker_name)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
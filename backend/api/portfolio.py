@@ -0,0 +1,102 @@
+"""
+Portfolio solving: the same plan is searched with several configurations (first solution strategy,
+metaheuristic, random seed) in parallel processes under one shared deadline, and the lowest-cost
+solution is kept. Which configuration works best varies a lot between depots, so idle cores buy
+better plans at the same latency.
+"""
+import time
+
+from django.conf import settings
+
+from .decomposition import create_subproblem_pool, run_subproblems
+from .search_options import get_max_time_limit_seconds
+
+# Options that identify a portfolio member in results
+MEMBER_CONFIGURATION_FIELDS = ('first_solution_strategy', 'local_search_metaheuristic', 'random_seed')
+
+
+def get_portfolio_processes(num_members):
+    """Returns the pool size for a portfolio (settings.VRP_PORTFOLIO_PROCESSES, default: one per member)."""
+    return max(1, min(getattr(settings, 'VRP_PORTFOLIO_PROCESSES', None) or num_members, num_members))
+
+
+def _solution_cost(result):
+    # Serving more tasks always beats a shorter distance (distance is the solver objective)
+    return (len(result.get('dropped_tasks') or []), sum(route['total_distance_meters'] for route in result['routes']))
+
+
+def solve_vrp_portfolio(depot_location, tasks, vehicles, member_options, matrix_provider_name=None,
+                        progress_callback=None, should_stop=None, initial_routes=None, processes=None,
+                        drop_penalty=None):
+    """
+    Runs one search per portfolio member in a process pool and returns the best solution.
+    Args:
+        depot_location, tasks, vehicles: As for solve_vrp.
+        member_options: List of resolved search options, one per member (see resolve_portfolio_options).
+        matrix_provider_name: Name of the matrix provider each member uses (see get_matrix_provider).
+        progress_callback: Optional callable(stage, message).
+        should_stop: Optional callable() -> bool; when it returns True every member stops with its best solution.
+        initial_routes: Optional current routes every member starts from (re-optimization).
+        processes: Pool size. Defaults to get_portfolio_processes().
+        drop_penalty: As for solve_vrp, applied to every member.
+    Returns:
+        The winning solve_vrp result with a 'portfolio' entry (winning configuration and the cost of
+        every member), or None if no member found a solution.
+    """
+    def report(stage, message):
+        print(message)
+        if progress_callback:
+            progress_callback(stage, message)
+
+    started = time.monotonic()
+    processes = processes or get_portfolio_processes(len(member_options))
+    # All members share one deadline: the longest member time limit, counted from now
+    time_limit = max(options.get('time_limit_seconds') or get_max_time_limit_seconds() for options in member_options)
+    deadline = time.time() + time_limit
+    specs = [{
+        'depot_id': depot_location.id,
+        'task_ids': [task.id for task in tasks],
+        'vehicle_ids': [vehicle.id for vehicle in vehicles],
+        'matrix_provider': matrix_provider_name,
+        'search_options': options,
+        'initial_routes': initial_routes,
+        'deadline': deadline,
+        'drop_penalty': drop_penalty,
+    } for options in member_options]
+
+    report('portfolio', f"Running a portfolio of {len(specs)} searches in {processes} processes "
+                        f"(deadline {time_limit:.0f}s).")
+    finished = []
+    def on_member_finished(index, result):
+        finished.append(index)
+        cost = _solution_cost(result)[1] if result else None
+        report('portfolio', f"Portfolio search {index + 1}/{len(specs)} finished with cost {cost} "
+                            f"({len(finished)}/{len(specs)} done).")
+
+    executor, stop_event = create_subproblem_pool(processes)
+    with executor:
+        results = run_subproblems(executor, specs, stop_event, should_stop, on_member_finished, deadline=deadline)
+
+    members = []
+    for options, result in zip(member_options, results):
+        members.append({
+            'configuration': {field: options.get(field) for field in MEMBER_CONFIGURATION_FIELDS},
+            'cost': _solution_cost(result)[1] if result else None,
+            'dropped_tasks': len(result.get('dropped_tasks') or []) if result else None,
+        })
+    solved = [index for index, result in enumerate(results) if result]
+    if not solved:
+        return None
+    winner = min(solved, key=lambda index: _solution_cost(results[index]))
+    report('portfolio', f"Portfolio finished in {time.monotonic() - started:.1f}s. "
+                        f"Best: search {winner + 1} {members[winner]['configuration']} with cost {members[winner]['cost']}.")
+
+    solution = results[winner]
+    solution['portfolio'] = {
+        'winner': winner,
+        'winning_configuration': members[winner]['configuration'],
+        'members': members,
+        'processes': processes,
+        'elapsed_seconds': round(time.monotonic() - started, 1),
+    }
+    return solution
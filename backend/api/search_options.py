@@ -0,0 +1,267 @@
+"""
+Solver search options: named profiles plus per-request overrides, turned into
+OR-Tools RoutingSearchParameters.
+
+A profile trades latency for quality, e.g. a 5-second interactive 'preview'
+versus a 10-minute 'overnight' plan. Profiles come from settings.VRP_SEARCH_PROFILES
+and any option can be overridden per plan request.
+"""
+from django.conf import settings
+from ortools.constraint_solver import pywrapcp
+from ortools.constraint_solver import routing_enums_pb2
+
+# Plan request fields that override the selected profile
+SEARCH_OPTION_FIELDS = [
+    'first_solution_strategy',
+    'local_search_metaheuristic',
+    'time_limit_seconds',
+    'solution_limit',
+    'log_search',
+    'random_seed',
+    'num_neighbors',
+    'symmetry_breaking',
+]
+
+# Symmetry breaking among identical vehicles (same VehicleType), see vrp_solver.vehicle_symmetry_groups:
+# 'ordered_usage': within a group, a vehicle may only be used if the one ranked before it is used.
+# 'fixed_cost_tiers': within a group, each vehicle costs slightly more to use than the one before it.
+SYMMETRY_BREAKING_MODES = ('ordered_usage', 'fixed_cost_tiers')
+# Arc-based first solution strategies (e.g. PATH_CHEAPEST_ARC, SAVINGS) find no first solution under
+# 'ordered_usage'; insertion heuristics fill the vehicles in order
+ORDERED_USAGE_FIRST_SOLUTION_STRATEGIES = (
+    'AUTOMATIC', 'PARALLEL_CHEAPEST_INSERTION', 'SEQUENTIAL_CHEAPEST_INSERTION', 'LOCAL_CHEAPEST_INSERTION')
+
+DEFAULT_SEARCH_PROFILES = {
+    # Interactive preview: a good-enough plan in a few seconds
+    'preview': {
+        'first_solution_strategy': 'PATH_CHEAPEST_ARC',
+        'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH',
+        'time_limit_seconds': 5,
+    },
+    'standard': {
+        'first_solution_strategy': 'PATH_CHEAPEST_ARC',
+        'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH',
+        'time_limit_seconds': 30,
+    },
+    # Overnight batch planning: spend minutes improving the plan
+    'overnight': {
+        'first_solution_strategy': 'PARALLEL_CHEAPEST_INSERTION',
+        'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH',
+        'time_limit_seconds': 600,
+    },
+}
+DEFAULT_SEARCH_PROFILE = 'standard'
+
+# Searches run side by side in portfolio mode ("portfolio": true); each entry overrides the
+# plan's search options. The lowest-cost solution wins.
+DEFAULT_PORTFOLIO = [
+    {'first_solution_strategy': 'PATH_CHEAPEST_ARC', 'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH'},
+    {'first_solution_strategy': 'PARALLEL_CHEAPEST_INSERTION', 'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH'},
+    {'first_solution_strategy': 'LOCAL_CHEAPEST_INSERTION', 'local_search_metaheuristic': 'TABU_SEARCH'},
+    {'first_solution_strategy': 'PATH_CHEAPEST_ARC', 'local_search_metaheuristic': 'SIMULATED_ANNEALING', 'random_seed': 7},
+]
+# Upper bound for any requested time limit, also applied when none is requested,
+# so no solve can occupy a solver worker longer than this
+DEFAULT_MAX_TIME_LIMIT_SECONDS = 3600
+
+# Largest random_seed (OR-Tools seeds are int32)
+MAX_RANDOM_SEED = 2 ** 31 - 1
+
+# String values of boolean request fields (form data)
+TRUE_STRINGS = ('1', 'true', 'yes', 'on')
+FALSE_STRINGS = ('0', 'false', 'no', 'off', '')
+
+# Metaheuristics that stop by themselves at a local optimum; the others run until a limit is hit
+SELF_TERMINATING_METAHEURISTICS = ('AUTOMATIC', 'GREEDY_DESCENT', 'UNSET')
+
+
+class SearchOptionsError(ValueError):
+    """Raised when a profile name or a search option in a plan request is invalid."""
+    pass
+
+
+def get_search_profiles():
+    """Returns the available search profiles, configurable via settings.VRP_SEARCH_PROFILES."""
+    return getattr(settings, 'VRP_SEARCH_PROFILES', DEFAULT_SEARCH_PROFILES)
+
+
+def get_max_time_limit_seconds():
+    """Returns the server-enforced solver wall time limit, configurable via settings.VRP_MAX_TIME_LIMIT_SECONDS."""
+    return getattr(settings, 'VRP_MAX_TIME_LIMIT_SECONDS', DEFAULT_MAX_TIME_LIMIT_SECONDS)
+
+
+def get_portfolio():
+    """Returns the default portfolio of search configurations, configurable via settings.VRP_PORTFOLIO."""
+    return getattr(settings, 'VRP_PORTFOLIO', DEFAULT_PORTFOLIO)
+
+
+def resolve_search_options(request_data=None):
+    """
+    Builds the effective search options for a plan request.
+    Args:
+        request_data: The plan request payload. An optional `search_profile` selects the profile
+                      (default: settings.VRP_DEFAULT_SEARCH_PROFILE); any field of
+                      SEARCH_OPTION_FIELDS overrides the profile value.
+    Returns:
+        A validated dict of search options (see SEARCH_OPTION_FIELDS) plus the profile name.
+    Raises:
+        SearchOptionsError: If the profile or any option is invalid.
+    """
+    request_data = request_data or {}
+    profiles = get_search_profiles()
+    profile_name = request_data.get('search_profile') or getattr(
+        settings, 'VRP_DEFAULT_SEARCH_PROFILE', DEFAULT_SEARCH_PROFILE)
+    if profile_name not in profiles:
+        raise SearchOptionsError(
+            f"Unknown search profile '{profile_name}'. Available: {sorted(profiles)}")
+
+    options = {field: None for field in SEARCH_OPTION_FIELDS}
+    options.update(profiles[profile_name])
+    for field in SEARCH_OPTION_FIELDS:
+        if request_data.get(field) is not None:
+            options[field] = request_data[field]
+
+    # --- Validate ---
+    if options['first_solution_strategy'] is not None:
+        options['first_solution_strategy'] = _enum_name(
+            routing_enums_pb2.FirstSolutionStrategy, options['first_solution_strategy'], 'first_solution_strategy')
+    if options['local_search_metaheuristic'] is not None:
+        options['local_search_metaheuristic'] = _enum_name(
+            routing_enums_pb2.LocalSearchMetaheuristic, options['local_search_metaheuristic'], 'local_search_metaheuristic')
+
+    max_time_limit = get_max_time_limit_seconds()
+    if options['time_limit_seconds'] is not None:
+        options['time_limit_seconds'] = _positive_number(options['time_limit_seconds'], 'time_limit_seconds', float)
+        if options['time_limit_seconds'] > max_time_limit:
+            raise SearchOptionsError(f"time_limit_seconds cannot exceed {max_time_limit} seconds.")
+    if options['solution_limit'] is not None:
+        options['solution_limit'] = _positive_number(options['solution_limit'], 'solution_limit', int)
+    options['log_search'] = parse_boolean(options['log_search'], 'log_search')
+    if options['random_seed'] is not None:
+        options['random_seed'] = _random_seed(options['random_seed'])
+    if options['num_neighbors'] is not None:
+        # Successors kept per node in the sparse successor graph (see vrp_solver.build_successor_graph)
+        options['num_neighbors'] = _positive_number(options['num_neighbors'], 'num_neighbors', int)
+    if options['symmetry_breaking'] is not None:
+        mode = str(options['symmetry_breaking']).lower()
+        if mode not in SYMMETRY_BREAKING_MODES + ('none',):
+            raise SearchOptionsError(
+                f"Invalid symmetry_breaking '{options['symmetry_breaking']}'. Valid values: {list(SYMMETRY_BREAKING_MODES) + ['none']}")
+        options['symmetry_breaking'] = None if mode == 'none' else mode
+    if (options['symmetry_breaking'] == 'ordered_usage'
+            and (options['first_solution_strategy'] or 'AUTOMATIC') not in ORDERED_USAGE_FIRST_SOLUTION_STRATEGIES):
+        raise SearchOptionsError(
+            f"symmetry_breaking ordered_usage requires an insertion first_solution_strategy: "
+            f"{list(ORDERED_USAGE_FIRST_SOLUTION_STRATEGIES)}")
+
+    metaheuristic = options['local_search_metaheuristic'] or 'AUTOMATIC'
+    if (metaheuristic not in SELF_TERMINATING_METAHEURISTICS
+            and options['time_limit_seconds'] is None and options['solution_limit'] is None):
+        # e.g. Guided Local Search never stops on its own
+        raise SearchOptionsError(
+            f"local_search_metaheuristic {metaheuristic} requires time_limit_seconds or solution_limit.")
+
+    options['search_profile'] = profile_name
+    return options
+
+
+def resolve_portfolio_options(request_data=None):
+    """
+    Builds the search options of every portfolio member of a plan request.
+    Args:
+        request_data: The plan request payload. "portfolio" is true (use settings.VRP_PORTFOLIO) or a list
+                      of option overrides, one per member; each member starts from the request's options.
+    Returns:
+        A list of resolved search option dicts, or None if the request does not ask for a portfolio.
+    Raises:
+        SearchOptionsError: If the portfolio or any member's options are invalid.
+    """
+    request_data = request_data or {}
+    portfolio = request_data.get('portfolio')
+    if isinstance(portfolio, str): # e.g. form data
+        portfolio = parse_boolean(portfolio, 'portfolio')
+    if not portfolio:
+        return None
+    members = get_portfolio() if portfolio is True else portfolio
+    if not isinstance(members, list) or not all(isinstance(member, dict) for member in members):
+        raise SearchOptionsError("portfolio must be true or a list of search option objects.")
+    resolved = []
+    for member in members:
+        unknown = set(member) - set(SEARCH_OPTION_FIELDS)
+        if unknown:
+            raise SearchOptionsError(f"Unknown portfolio options {sorted(unknown)}. Valid: {SEARCH_OPTION_FIELDS}")
+        resolved.append(resolve_search_options({**request_data, **member}))
+    return resolved
+
+
+def build_search_parameters(options):
+    """
+    Converts resolved search options into OR-Tools routing search parameters.
+    A time limit is always set: the requested one, or the server maximum if none was requested.
+    (random_seed, num_neighbors and symmetry_breaking are applied by solve_vrp, which knows the model.)
+    Args:
+        options: A dict returned by resolve_search_options.
+    Returns:
+        A RoutingSearchParameters protobuf.
+    """
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    if options.get('first_solution_strategy'):
+        search_parameters.first_solution_strategy = getattr(
+            routing_enums_pb2.FirstSolutionStrategy, options['first_solution_strategy'])
+    if options.get('local_search_metaheuristic'):
+        search_parameters.local_search_metaheuristic = getattr(
+            routing_enums_pb2.LocalSearchMetaheuristic, options['local_search_metaheuristic'])
+    time_limit_seconds = min(options.get('time_limit_seconds') or get_max_time_limit_seconds(),
+                             get_max_time_limit_seconds())
+    search_parameters.time_limit.FromMilliseconds(int(time_limit_seconds * 1000))
+    if options.get('solution_limit'):
+        search_parameters.solution_limit = options['solution_limit']
+    search_parameters.log_search = bool(options.get('log_search'))
+    return search_parameters
+
+
+def _enum_name(enum_type, value, field):
+    # Accept the enum name in any case, e.g. 'guided_local_search'
+    name = str(value).upper()
+    valid_names = list(enum_type.Value.keys())
+    if name not in valid_names:
+        raise SearchOptionsError(f"Invalid {field} '{value}'. Valid values: {valid_names}")
+    return name
+
+
+def _positive_number(value, field, number_type):
+    try:
+        number = number_type(value)
+    except (TypeError, ValueError):
+        raise SearchOptionsError(f"{field} must be a number.")
+    if number <= 0:
+        raise SearchOptionsError(f"{field} must be greater than zero.")
+    return number
+
+
+def _random_seed(value):
+    # Any int32 seed, 0 included, as taken by the OR-Tools solver's ReSeed
+    try:
+        seed = int(value)
+    except (TypeError, ValueError):
+        raise SearchOptionsError("random_seed must be a number.")
+    if not 0 <= seed <= MAX_RANDOM_SEED:
+        raise SearchOptionsError(f"random_seed must be between 0 and {MAX_RANDOM_SEED}.")
+    return seed
+
+
+def parse_boolean(value, field):
+    """
+    Parses a boolean request field. Form and multipart data send strings, so "false" and "0" must not
+    count as true: accepts true/false, 1/0, yes/no and on/off (any case) besides real booleans.
+    Raises:
+        SearchOptionsError: For any other string.
+    """
+    if isinstance(value, str):
+        normalized = value.strip().lower()
+        if normalized in TRUE_STRINGS:
+            return True
+        if normalized in FALSE_STRINGS:
+            return False
+        raise SearchOptionsError(f"{field} must be true or false, got '{value}'.")
+    return bool(value)
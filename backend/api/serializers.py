@@ -3,7 +3,7 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import ( # Import all models needed
     Location, VehicleType, Vehicle, UserProfile, Task, Route, RouteStop,
-    MaintenanceType, MaintenanceLog
+    MaintenanceType, MaintenanceLog, PlanningJob
 )
 
 class LocationSerializer(serializers.ModelSerializer):
@@ -135,4 +135,17 @@ class RouteSerializer(serializers.ModelSerializer):
         read_only_fields = [
              'status_display', 'created_at', 'updated_at', 'stops', 'tasks', 'vehicle'
              # Most fields are read-only as they are set by planning
-        ]
\ No newline at end of file
+        ]
+
+class PlanningJobSerializer(serializers.ModelSerializer):
+    """Serializer for background planning jobs (read-only; jobs are created by the plan endpoint)."""
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = PlanningJob
+        fields = [
+            'id', 'status', 'status_display', 'request_data', 'progress', 'best_solution',
+            'result', 'result_status_code', 'error', 'cancel_requested', 'worker',
+            'created_at', 'started_at', 'heartbeat_at', 'finished_at'
+        ]
+        read_only_fields = fields
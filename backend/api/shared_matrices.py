@@ -0,0 +1,136 @@
+"""
+Matrices shared zero-copy across worker processes through memory-mapped files.
+
+When settings.DISTANCE_MATRIX_SHARED_DIR is set, every matrix built by
+create_distance_matrix is published there as a TravelMatrix .npy file named after
+a hash of its (ordered) addresses. Other workers attach to it with a read-only
+memory map, so all processes share the same pages of the OS page cache instead of
+each holding a private copy. Point the directory at a tmpfs such as /dev/shm to
+keep the segments in RAM.
+
+The directory itself is the index: `<hash>.npy` holds the arrays and the file's
+modification time is used for the TTL. list_segments() reads it for metrics/cleanup.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from . import matrix_store
+from .travel_matrix import TravelMatrix
+
+DEFAULT_SHARED_TTL_SECONDS = 3600
+SEGMENT_SUFFIX = '.npy'
+
+
+def get_shared_dir():
+    """Returns the shared segment directory (created on demand), or None if shared mode is disabled."""
+    shared_dir = getattr(settings, 'DISTANCE_MATRIX_SHARED_DIR', None)
+    if not shared_dir:
+        return None
+    path = Path(shared_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _ttl_seconds():
+    return getattr(settings, 'DISTANCE_MATRIX_SHARED_TTL_SECONDS', DEFAULT_SHARED_TTL_SECONDS)
+
+
+def segment_name(addresses):
+    """Builds the segment name for an ordered list of (lat, lng) addresses."""
+    joined = '|'.join(matrix_store.coordinate_key(addr) for addr in addresses)
+    return hashlib.sha256(joined.encode()).hexdigest()[:32]
+
+
+def attach(addresses):
+    """
+    Attaches to the published matrix for these addresses, if any.
+    Returns:
+        A memory-mapped, read-only TravelMatrix, or None if there is no fresh segment.
+    """
+    shared_dir = get_shared_dir()
+    if shared_dir is None:
+        return None
+    path = shared_dir / (segment_name(addresses) + SEGMENT_SUFFIX)
+    try:
+        if time.time() - path.stat().st_mtime >= _ttl_seconds():
+            return None
+        matrix = TravelMatrix.load(path, mmap=True)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Warning: Could not attach shared matrix segment {path.name}: {e}")
+        return None
+    if matrix.size != len(addresses):
+        print(f"Warning: Shared matrix segment {path.name} has size {matrix.size}, expected {len(addresses)}. Ignoring.")
+        return None
+    return matrix
+
+
+def publish(addresses, matrix):
+    """
+    Writes the matrix as a shared segment. The file is written under a temporary
+    name and renamed into place, so readers never see a partial segment.
+    Returns:
+        The segment path, or None if shared mode is disabled or the write failed.
+    """
+    shared_dir = get_shared_dir()
+    if shared_dir is None:
+        return None
+    path = shared_dir / (segment_name(addresses) + SEGMENT_SUFFIX)
+    try:
+        fd, tmp_name = tempfile.mkstemp(dir=shared_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                matrix.save(tmp_file)
+            os.replace(tmp_name, path)
+        except BaseException:
+            # Don't leave the partial file behind: purge_expired_segments only removes segments
+            os.unlink(tmp_name)
+            raise
+    except Exception as e:
+        print(f"Warning: Could not publish shared matrix segment {path.name}: {e}")
+        return None
+    return path
+
+
+def list_segments():
+    """
+    Returns the segment index: one dict per published matrix (name, bytes, age_seconds).
+    """
+    shared_dir = get_shared_dir()
+    if shared_dir is None:
+        return []
+    now = time.time()
+    segments = []
+    for path in shared_dir.glob('*' + SEGMENT_SUFFIX):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        segments.append({'name': path.stem, 'bytes': stat.st_size, 'age_seconds': round(now - stat.st_mtime)})
+    return segments
+
+
+def purge_expired_segments():
+    """
+    Deletes segments older than the TTL (workers that already mapped them keep their mapping).
+    Returns:
+        The number of deleted segments.
+    """
+    shared_dir = get_shared_dir()
+    if shared_dir is None:
+        return 0
+    deleted = 0
+    for segment in list_segments():
+        if segment['age_seconds'] >= _ttl_seconds():
+            try:
+                (shared_dir / (segment['name'] + SEGMENT_SUFFIX)).unlink()
+                deleted += 1
+            except FileNotFoundError:
+                pass
+    return deleted
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.db.models import F # For atomic updates
-from .models import Route, Vehicle, UserProfile, User
+from .models import Location, Route, Task, Vehicle, VehicleType, UserProfile, User
+from .vrp_solver import solution_cache
 
 @receiver(post_save, sender=Route)
 def update_odometer_on_route_completion(sender, instance, created, **kwargs):
@@ -75,4 +76,18 @@ def save_user_profile(sender, instance, **kwargs):
     except UserProfile.DoesNotExist:
          # If profile doesn't exist (e.g., for users created before signal), create it
          UserProfile.objects.create(user=instance)
-         print(f"UserProfile created for existing user {instance.username} during save.")
\ No newline at end of file
+         print(f"UserProfile created for existing user {instance.username} during save.")
+
+
+# Drop cached solutions computed from a row that changed (see solution_cache). Cache keys hash the
+# solver input, so stale entries could never be hit anyway; this frees them right away.
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=Vehicle)
+@receiver(post_save, sender=VehicleType)
+@receiver(post_delete, sender=Location)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Vehicle)
+@receiver(post_delete, sender=VehicleType)
+def invalidate_cached_solutions(sender, instance, **kwargs):
+    solution_cache.invalidate(sender._meta.model_name, instance.pk)
@@ -0,0 +1,129 @@
+"""
+Coalescing of identical concurrent work ("single flight").
+
+- SingleFlight: threads of one process asking for the same key share one call.
+- fetch_lease: a database lease so only one worker process fetches a given
+  location set from Google Maps while the others wait for the result.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import MatrixFetchLease
+
+DEFAULT_LEASE_SECONDS = 300 # A crashed leader blocks others at most this long
+DEFAULT_LEASE_WAIT_SECONDS = 120
+LEASE_POLL_INTERVAL_SECONDS = 0.5
+
+
+class _Call:
+    """An in-flight call whose result is shared by every waiter."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time within this process; concurrent callers
+    with the same key block and receive the same result (or exception).
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Args:
+            key: A hashable key identifying identical work.
+            fn: A zero-argument callable doing the work.
+        Returns:
+            The result of fn(), from this call or from the one already in flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def lease_key(address_keys):
+    """Builds the lease key for a location set (order-insensitive)."""
+    return hashlib.sha256('|'.join(sorted(set(address_keys))).encode()).hexdigest()
+
+
+def _try_acquire(key, owner, lease_seconds):
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            MatrixFetchLease.objects.create(key=key, owner=owner, expires_at=now + timedelta(seconds=lease_seconds))
+        return True
+    except IntegrityError:
+        # Take over a lease whose holder died without releasing it
+        deleted, _ = MatrixFetchLease.objects.filter(key=key, expires_at__lt=now).delete()
+        if deleted:
+            return _try_acquire(key, owner, lease_seconds)
+        return False
+
+
+@contextmanager
+def fetch_lease(key):
+    """
+    Context manager coordinating matrix fetches for the same location set across processes.
+    Yields True if this process holds the lease (and should fetch), or False after another
+    process held it and released it (or the wait timed out) - the caller should then re-read
+    the persistent store before fetching whatever is still missing.
+    """
+    lease_seconds = getattr(settings, 'DISTANCE_MATRIX_FETCH_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+    wait_seconds = getattr(settings, 'DISTANCE_MATRIX_FETCH_LEASE_WAIT_SECONDS', DEFAULT_LEASE_WAIT_SECONDS)
+    owner = f"{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:8]}"
+
+    try:
+        acquired = _try_acquire(key, owner, lease_seconds)
+    except Exception as e:
+        # Coordination is an optimization; never fail a fetch because the lease table is unavailable
+        print(f"Warning: Could not acquire matrix fetch lease: {e}")
+        yield True
+        return
+
+    if not acquired:
+        print(f"Another worker is fetching this location set. Waiting up to {wait_seconds}s.")
+        deadline = time.monotonic() + wait_seconds
+        while time.monotonic() < deadline:
+            time.sleep(LEASE_POLL_INTERVAL_SECONDS)
+            if not MatrixFetchLease.objects.filter(key=key, expires_at__gte=timezone.now()).exists():
+                break
+        yield False
+        return
+
+    try:
+        yield True
+    finally:
+        MatrixFetchLease.objects.filter(key=key, owner=owner).delete()
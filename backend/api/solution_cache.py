@@ -0,0 +1,171 @@
+"""
+Content-addressed in-process cache of solver results.
+Planners often re-run the same plan while reviewing results; a request whose normalized solver input
+(tasks, vehicles, locations and time windows, search options, travel matrix) is unchanged returns the
+stored solution instead of searching again.
+A saved plan marks its tasks ASSIGNED, so repeating it finds no pending tasks and never reaches the
+cache; review runs use "dry_run": true (see planning.execute_plan), which leaves the tasks PENDING.
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_SOLUTION_CACHE_MAX_ENTRIES = 64 # Per worker process; 0 disables the cache
+DEFAULT_SOLUTION_CACHE_TTL_SECONDS = 3600 # 1 hour
+
+
+def solution_cache_key(depot_location, node_locations, tasks, vehicles, travel_matrix, time_windows,
+                       service_times, search_options, initial_routes=None, drop_penalty=None, vehicle_depots=None):
+    """
+    Hashes the normalized solver input into a cache key.
+    Any change of a row the solver reads (coordinates, time windows, service times, demands,
+    capacities) or of the travel matrix gives a new key, so a stale solution is never returned,
+    even for changes made in other processes or with queryset updates (which send no signals).
+    Args:
+        depot_location: The depot Location.
+        node_locations: Merged location groups per matrix node (see merge_colocated_locations).
+        tasks, vehicles: As passed to solve_vrp. Tasks are normalized by id; the vehicle order is kept,
+                         as it defines the vehicle indices of the model.
+        travel_matrix: The TravelMatrix of the nodes; its contents act as the matrix version.
+        time_windows, service_times: Per-node model data.
+        search_options: Resolved search options (see resolve_search_options).
+        initial_routes: Optional warm-start routes (vehicle id -> location ids).
+        drop_penalty: The effective task drop penalty.
+        vehicle_depots: Optional vehicle id -> (start Location, end Location) of a multi-depot plan.
+    Returns:
+        A hex digest string.
+    """
+    normalized = {
+        'depot': depot_location.id,
+        'nodes': [[(location.id, location.name) for location in group] for group in node_locations],
+        'tasks': sorted((task.id, task.origin_id, task.destination_id, task.type,
+                         float(task.weight_kg or 0), float(task.volume_m3 or 0)) for task in tasks),
+        'vehicles': [(vehicle.id, vehicle.type_id, float(vehicle.type.max_weight_kg or 0),
+                      float(vehicle.type.max_volume_m3 or 0)) for vehicle in vehicles],
+        'time_windows': [list(window) for window in time_windows],
+        'service_times': list(service_times),
+        'search_options': sorted((search_options or {}).items()),
+        'initial_routes': sorted((initial_routes or {}).items()),
+        'drop_penalty': drop_penalty,
+        'vehicle_depots': sorted((vehicle_id, start.id, end.id)
+                                 for vehicle_id, (start, end) in (vehicle_depots or {}).items()),
+    }
+    digest = hashlib.sha256(json.dumps(normalized, default=str).encode())
+    digest.update(travel_matrix.distances.tobytes())
+    digest.update(travel_matrix.durations.tobytes())
+    return digest.hexdigest()
+
+
+def solution_references(depot_location, tasks, vehicles, vehicle_depots=None):
+    """Returns the (model name, pk) pairs of the rows a solution was computed from."""
+    references = {('location', depot_location.id)}
+    for start, end in (vehicle_depots or {}).values():
+        references.update({('location', start.id), ('location', end.id)})
+    for task in tasks:
+        references.update({('task', task.id), ('location', task.origin_id), ('location', task.destination_id)})
+    for vehicle in vehicles:
+        references.update({('vehicle', vehicle.id), ('vehicletype', vehicle.type_id)})
+    return references
+
+
+class SolutionCache:
+    """
+    Thread-safe LRU cache of solve_vrp results keyed by solution_cache_key().
+    - At most max_entries results are kept; least recently used entries are evicted first.
+    - Entries older than the TTL are dropped when looked up.
+    - invalidate() drops every entry computed from a given row (called from model signals), so
+      edited data frees its entries right away instead of waiting for the LRU.
+    - Results are copied in and out, so callers may modify what they get.
+    """
+    def __init__(self, max_entries=None, ttl_seconds=None):
+        self.max_entries = max_entries if max_entries is not None else getattr(
+            settings, 'VRP_SOLUTION_CACHE_MAX_ENTRIES', DEFAULT_SOLUTION_CACHE_MAX_ENTRIES)
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else getattr(
+            settings, 'VRP_SOLUTION_CACHE_TTL_SECONDS', DEFAULT_SOLUTION_CACHE_TTL_SECONDS)
+        self._entries = OrderedDict() # key -> (stored_at, result, references), least recently used first
+        self._keys_by_reference = {} # (model name, pk) -> keys of the entries computed from that row
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Returns a copy of the cached result for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, result, _ = entry
+            if time.monotonic() - stored_at >= self.ttl_seconds:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(result)
+
+    def put(self, key, result, references=()):
+        """Caches a copy of `result` under `key`, remembering the (model name, pk) rows it depends on."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            references = frozenset(references)
+            self._entries[key] = (time.monotonic(), copy.deepcopy(result), references)
+            for reference in references:
+                self._keys_by_reference.setdefault(reference, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, model_name, pk):
+        """Drops every entry computed from the given row. Returns the number of entries dropped."""
+        with self._lock:
+            keys = self._keys_by_reference.pop((model_name, pk), set())
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """Drops all entries (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_reference.clear()
+
+    def stats(self):
+        """Returns a snapshot of the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        _, _, references = self._entries.pop(key)
+        for reference in references:
+            keys = self._keys_by_reference.get(reference)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_reference[reference]
@@ -1,3 +1,1465 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import time as clock_time, timedelta
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import googlemaps
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import matrix_store, shared_matrices
+from .batch_planning import _parse_batch_request, group_batch_plans, solve_on_shared_matrix
+from .decomposition import allocate_vehicles, should_decompose, solve_vrp_decomposed, sweep_clusters
+from .fleet_sizing import build_sweep_scenarios, summarize_sweep
+from .insertion import InsertionError, find_best_insertion, insert_task
+from .matrix_cache import MatrixCache
+from .matrix_providers import (
+    ChainedMatrixProvider, HaversineMatrixProvider, MatrixProvider, MatrixProviderError, PrecomputedMatrixProvider,
+    get_matrix_provider,
+)
+from .models import DistanceMatrixEntry, Location, PlanningJob, Route, RouteStop, Task, Vehicle, VehicleType
+from .planning import execute_plan, load_current_routes
+from .portfolio import solve_vrp_portfolio
+from .planning_jobs import (
+    BestSolutionRecorder, CancellationCheck, JobHeartbeat, cancel_planning_job, claim_next_job, enqueue_planning_job, finish_job, requeue_stale_jobs, run_job,
+)
+from .search_options import (
+    SearchOptionsError, build_search_parameters, parse_boolean, resolve_portfolio_options, resolve_search_options,
+)
+from .single_flight import SingleFlight, fetch_lease
+from .solution_cache import SolutionCache
+from .travel_matrix import TravelMatrix
+from .worker_processes import limit_process_memory
+from .vrp_solver import (
+    ElementRateLimiter, _group_missing_cells, _request_with_backoff, _tile_block, build_successor_graph,
+    create_distance_matrix, merge_colocated_locations, prefetch_matrix_rows, solution_cache, solve_vrp,
+)
+
+
+class GridMatrixProvider(MatrixProvider):
+    """Manhattan distance on the coordinates: 0.01 degrees is 1 km, driven at 10 m/s."""
+    name = 'grid'
+
+    def get_matrices(self, addresses):
+        coords = np.asarray(addresses, dtype=np.float64)
+        distances = np.rint(np.abs(coords[:, None, :] - coords[None, :, :]).sum(axis=2) * 100000)
+        return TravelMatrix(distances, distances / 10)
+
+
+class PlanningJobLifecycleTests(TestCase):
+    def test_claim_takes_oldest_queued_job_once(self):
+        first = enqueue_planning_job({'depot_id': 1, 'async': True})
+        second = enqueue_planning_job({'depot_id': 2})
+
+        claimed = claim_next_job('worker-a')
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(claimed.status, PlanningJob.JobStatus.RUNNING)
+        self.assertEqual(claimed.worker, 'worker-a')
+        self.assertNotIn('async', claimed.request_data)
+        self.assertEqual(claim_next_job('worker-b').pk, second.pk)
+        self.assertIsNone(claim_next_job('worker-c'))
+
+    def test_cancel_queued_and_running_jobs(self):
+        queued = enqueue_planning_job({'depot_id': 1})
+        self.assertTrue(cancel_planning_job(queued))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, PlanningJob.JobStatus.CANCELLED)
+
+        running = enqueue_planning_job({'depot_id': 1})
+        claim_next_job('worker-a')
+        self.assertTrue(cancel_planning_job(running))
+        running.refresh_from_db()
+        self.assertEqual(running.status, PlanningJob.JobStatus.RUNNING)
+        self.assertTrue(running.cancel_requested)
+
+        running.status = PlanningJob.JobStatus.SUCCEEDED
+        running.save()
+        self.assertFalse(cancel_planning_job(running))
+
+    def test_requeue_only_stale_jobs(self):
+        live = enqueue_planning_job({'depot_id': 1})
+        stale = enqueue_planning_job({'depot_id': 2})
+        stale_cancelled = enqueue_planning_job({'depot_id': 3})
+        for _ in range(3):
+            claim_next_job('worker-a')
+        old = timezone.now() - timedelta(seconds=600)
+        PlanningJob.objects.filter(pk__in=[stale.pk, stale_cancelled.pk]).update(heartbeat_at=old)
+        PlanningJob.objects.filter(pk=stale_cancelled.pk).update(cancel_requested=True)
+
+        self.assertEqual(requeue_stale_jobs(300), 1)
+        statuses = dict(PlanningJob.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[live.pk], PlanningJob.JobStatus.RUNNING)
+        self.assertEqual(statuses[stale.pk], PlanningJob.JobStatus.QUEUED)
+        self.assertEqual(statuses[stale_cancelled.pk], PlanningJob.JobStatus.CANCELLED)
+
+    def test_finish_job_does_not_overwrite_a_job_taken_over(self):
+        enqueue_planning_job({'depot_id': 1})
+        job = claim_next_job('worker-a')
+        PlanningJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=600))
+        requeue_stale_jobs(300)
+        claim_next_job('worker-b')
+
+        self.assertFalse(finish_job(job, status=PlanningJob.JobStatus.SUCCEEDED, result={'message': 'stale'}))
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlanningJob.JobStatus.RUNNING)
+        self.assertEqual(job.worker, 'worker-b')
+        self.assertIsNone(job.result)
+
+    def test_run_job_stores_result_of_its_own_job(self):
+        enqueue_planning_job({'depot_id': 1})
+        job = claim_next_job('worker-a')
+        with mock.patch('api.planning_jobs.execute_plan', return_value=({'message': 'Planned.'}, 201)):
+            run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlanningJob.JobStatus.SUCCEEDED)
+        self.assertEqual(job.result_status_code, 201)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_run_job_marks_error_responses_failed(self):
+        enqueue_planning_job({'depot_id': 1})
+        job = claim_next_job('worker-a')
+        with mock.patch('api.planning_jobs.execute_plan', return_value=({'error': 'Bad input.'}, 400)):
+            run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlanningJob.JobStatus.FAILED)
+        self.assertEqual(job.error, 'Bad input.')
+
+    def test_run_job_dispatches_batch_and_fleet_sweep_requests(self):
+        enqueue_planning_job({'plans': []})
+        enqueue_planning_job({'depot_id': 1, 'fleet_sweep': True})
+        with mock.patch('api.planning_jobs.execute_batch_plan', return_value=({'message': 'batch'}, 201)) as batch, \
+                mock.patch('api.planning_jobs.execute_fleet_sweep', return_value=({'message': 'sweep'}, 200)) as sweep:
+            run_job(claim_next_job('worker-a'))
+            run_job(claim_next_job('worker-a'))
+        self.assertEqual(batch.call_count, 1)
+        self.assertEqual(sweep.call_count, 1)
+
+
+class PlanningJobHeartbeatTests(TransactionTestCase):
+    def test_heartbeat_keeps_a_quiet_job_from_being_requeued(self):
+        enqueue_planning_job({'depot_id': 1})
+        job = claim_next_job('worker-a')
+        PlanningJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=600))
+
+        heartbeat = JobHeartbeat(job, interval_seconds=0.05).start()
+        time.sleep(0.3)
+        heartbeat.stop()
+
+        self.assertEqual(requeue_stale_jobs(300), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlanningJob.JobStatus.RUNNING)
+
+    def test_heartbeat_ignores_a_job_taken_over(self):
+        enqueue_planning_job({'depot_id': 1})
+        job = claim_next_job('worker-a')
+        PlanningJob.objects.filter(pk=job.pk).update(worker='worker-b')
+        old = timezone.now() - timedelta(seconds=600)
+        PlanningJob.objects.filter(pk=job.pk).update(heartbeat_at=old)
+
+        heartbeat = JobHeartbeat(job, interval_seconds=0.05).start()
+        time.sleep(0.3)
+        heartbeat.stop()
+
+        job.refresh_from_db()
+        self.assertEqual(job.heartbeat_at, old)
+
+
+class BestSolutionRecorderTests(TransactionTestCase):
+    def snapshot(self, number):
+        return {'solution_number': number, 'cost': 1000 - number, 'elapsed_seconds': number / 10, 'routes': []}
+
+    def best_solution(self, job):
+        job.refresh_from_db()
+        return job.best_solution and job.best_solution['solution_number']
+
+    def test_improvements_inside_the_interval_collapse_to_the_newest(self):
+        job = enqueue_planning_job({'depot_id': 1})
+        recorder = BestSolutionRecorder(job.pk, interval_seconds=0.3)
+        recorder(self.snapshot(1)) # The first solution is written at once
+        self.assertEqual(self.best_solution(job), 1)
+        recorder(self.snapshot(2))
+        recorder(self.snapshot(3))
+        self.assertEqual(self.best_solution(job), 1)
+        time.sleep(0.6) # Solution 2 is never written, 3 when the interval ends
+        self.assertEqual(self.best_solution(job), 3)
+        self.assertEqual(job.progress['stage'], 'solving')
+        self.assertEqual(job.progress['cost'], 997)
+        self.assertIsNotNone(job.heartbeat_at)
+
+        recorder.close()
+        recorder(self.snapshot(4))
+        self.assertEqual(self.best_solution(job), 3)
+
+    def test_close_drops_a_pending_snapshot(self):
+        job = enqueue_planning_job({'depot_id': 1})
+        recorder = BestSolutionRecorder(job.pk, interval_seconds=0.2)
+        recorder(self.snapshot(1))
+        recorder(self.snapshot(2))
+        recorder.close()
+        time.sleep(0.4)
+        self.assertEqual(self.best_solution(job), 1)
+
+
+class PlanningJobStreamTests(TestCase):
+    async def read_stream(self, job_id):
+        response = await self.async_client.get(f'/api/routes/plan/jobs/{job_id}/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_stream_of_a_finished_job(self):
+        job = await PlanningJob.objects.acreate(
+            request_data={'depot_id': 1}, status=PlanningJob.JobStatus.SUCCEEDED,
+            progress={'stage': 'saving', 'message': 'Saving routes.'},
+            best_solution={'solution_number': 4, 'cost': 1200},
+            result={'message': 'Planned.'}, result_status_code=201)
+        events = [event.split('\n') for event in (await self.read_stream(job.pk)).strip().split('\n\n')]
+        self.assertEqual([lines[0] for lines in events], ['event: progress', 'event: solution', 'event: done'])
+        self.assertEqual(json.loads(events[0][1][len('data: '):]),
+                         {'status': 'SUCCEEDED', 'stage': 'saving', 'message': 'Saving routes.'})
+        self.assertEqual(json.loads(events[1][1][len('data: '):]), {'solution_number': 4, 'cost': 1200})
+        self.assertEqual(json.loads(events[2][1][len('data: '):]), {
+            'status': 'SUCCEEDED', 'result_status_code': 201, 'result': {'message': 'Planned.'}, 'error': None})
+
+    async def test_stream_of_an_unknown_job(self):
+        response = await self.async_client.get('/api/routes/plan/jobs/999/stream/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ReoptimizationScopeTests(TestCase):
+    """Re-optimizing one depot must not touch the routes of other depots planned for the same day."""
+    plan_date = '2026-03-02'
+
+    def setUp(self):
+        self.depot_a = Location.objects.create(name='CEDIS A', latitude=19.43, longitude=-99.13, type=Location.LocationType.CEDIS)
+        self.depot_b = Location.objects.create(name='CEDIS B', latitude=20.67, longitude=-103.35, type=Location.LocationType.CEDIS)
+        self.stops_a = [Location.objects.create(name=f'A{i}', latitude=19.40 + i / 100, longitude=-99.10) for i in range(4)]
+        self.stops_b = [Location.objects.create(name=f'B{i}', latitude=20.60 + i / 100, longitude=-103.30) for i in range(2)]
+        van = VehicleType.objects.create(name='Van', max_weight_kg=1000, max_volume_m3=10)
+        self.vehicle_a = Vehicle.objects.create(license_plate='VA', type=van)
+        self.vehicle_b = Vehicle.objects.create(license_plate='VB', type=van)
+        self.route_a, self.task_a = self._planned_route(self.vehicle_a, self.depot_a, *self.stops_a[:2])
+        self.route_b, self.task_b = self._planned_route(self.vehicle_b, self.depot_b, *self.stops_b)
+
+    def _planned_route(self, vehicle, depot, origin, destination):
+        route = Route.objects.create(vehicle=vehicle, planned_date=self.plan_date, status=Route.RouteStatus.ASSIGNED)
+        for order, (location, stop_type) in enumerate([
+                (depot, RouteStop.StopType.START_DEPOT), (origin, RouteStop.StopType.PICKUP),
+                (destination, RouteStop.StopType.DELIVERY), (depot, RouteStop.StopType.END_DEPOT)]):
+            RouteStop.objects.create(route=route, location=location, sequence_order=order, stop_type=stop_type)
+        task = Task.objects.create(origin=origin, destination=destination, weight_kg=10, required_date=self.plan_date,
+                                   status=Task.TaskStatus.ASSIGNED, route=route)
+        return route, task
+
+    def test_reoptimize_false_string_keeps_current_routes(self):
+        new_task = Task.objects.create(origin=self.stops_a[2], destination=self.stops_a[3], weight_kg=10,
+                                       required_date=self.plan_date)
+        payload, http_status = execute_plan({
+            'depot_id': self.depot_a.id, 'task_ids': [new_task.id], 'vehicle_ids': [self.vehicle_a.id],
+            'date': self.plan_date, 'reoptimize': 'false', 'matrix_provider': 'haversine',
+            'search_profile': 'preview', 'time_limit_seconds': 1,
+        })
+        self.assertEqual(http_status, 201, payload)
+        self.assertFalse(payload['reoptimized'])
+        self.assertEqual(payload['assigned_task_ids'], [new_task.id])
+        self.task_a.refresh_from_db()
+        self.assertEqual(self.task_a.route_id, self.route_a.id)
+
+    def test_load_current_routes_only_loads_routes_of_the_depot(self):
+        routes, tasks, initial_routes = load_current_routes(self.plan_date, self.depot_a.id)
+        self.assertEqual([route.pk for route in routes], [self.route_a.pk])
+        self.assertEqual([task.pk for task in tasks], [self.task_a.pk])
+        self.assertEqual(initial_routes, {self.vehicle_a.id: [self.stops_a[0].id, self.stops_a[1].id]})
+
+        routes, tasks, _ = load_current_routes(self.plan_date, self.depot_b.id)
+        self.assertEqual([route.pk for route in routes], [self.route_b.pk])
+        self.assertEqual([task.pk for task in tasks], [self.task_b.pk])
+
+    def test_reoptimize_leaves_other_depots_routes_alone(self):
+        new_task = Task.objects.create(origin=self.stops_a[2], destination=self.stops_a[3], weight_kg=10,
+                                       required_date=self.plan_date)
+        payload, http_status = execute_plan({
+            'depot_id': self.depot_a.id, 'task_ids': [new_task.id], 'vehicle_ids': [self.vehicle_a.id],
+            'date': self.plan_date, 'reoptimize': True, 'matrix_provider': 'haversine',
+            'search_profile': 'preview', 'time_limit_seconds': 1,
+        })
+        self.assertEqual(http_status, 201, payload)
+        self.assertEqual(set(payload['assigned_task_ids']), {self.task_a.id, new_task.id})
+
+        self.route_b.refresh_from_db()
+        self.task_b.refresh_from_db()
+        self.assertEqual(self.task_b.status, Task.TaskStatus.ASSIGNED)
+        self.assertEqual(self.task_b.route_id, self.route_b.id)
+        self.assertEqual(list(self.route_b.stops.values_list('location_id', flat=True)),
+                         [self.depot_b.id, self.stops_b[0].id, self.stops_b[1].id, self.depot_b.id])
+
+
+class PlanRequestValidationTests(TestCase):
+    """Invalid plan options are rejected with 400 up front, also for async requests (no job is queued)."""
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('planner'))
+        self.plan = {'depot_id': 1, 'task_ids': [1], 'vehicle_ids': [1], 'date': '2026-03-02', 'async': True}
+
+    def test_async_plan_rejects_invalid_drop_penalty(self):
+        for drop_penalty in (-1, 'abc'):
+            response = self.client.post('/api/routes/plan/', dict(self.plan, drop_penalty=drop_penalty), format='json')
+            self.assertEqual(response.status_code, 400, drop_penalty)
+            self.assertIn('drop_penalty', response.data['error'])
+        self.assertFalse(PlanningJob.objects.exists())
+
+    def test_async_plan_with_valid_options_is_queued(self):
+        response = self.client.post('/api/routes/plan/', dict(self.plan, drop_penalty=0), format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(PlanningJob.objects.get().request_data['drop_penalty'], 0)
+
+    def test_plan_rejects_unrecognized_decompose(self):
+        response = self.client.post('/api/routes/plan/', dict(self.plan, decompose='sometimes'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('decompose', response.data['error'])
+        response = self.client.post('/api/routes/plan/', dict(self.plan, decompose='false', **{'async': 'true'}))
+        self.assertEqual(response.status_code, 202)
+        payload, http_status = execute_plan(dict(self.plan, decompose='sometimes'))
+        self.assertEqual(http_status, 400)
+        self.assertFalse(PlanningJob.objects.exclude(request_data__decompose='false').exists())
+
+    def test_plan_rejects_unrecognized_reoptimize(self):
+        response = self.client.post('/api/routes/plan/', dict(self.plan, reoptimize='maybe'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('reoptimize', response.data['error'])
+        self.assertEqual(execute_plan(dict(self.plan, reoptimize='maybe'))[1], 400)
+
+    def test_plan_rejects_unrecognized_dry_run(self):
+        response = self.client.post('/api/routes/plan/', dict(self.plan, dry_run='maybe'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('dry_run', response.data['error'])
+
+    def test_async_false_string_runs_synchronously(self):
+        # Form data: "false" must not enqueue a job; the plan runs now (and fails: the depot does not exist)
+        response = self.client.post('/api/routes/plan/', dict(self.plan, **{'async': 'false'}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(PlanningJob.objects.exists())
+        response = self.client.post('/api/routes/plan/', dict(self.plan, **{'async': 'later'}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_async_batch_and_fleet_sweep_reject_invalid_drop_penalty(self):
+        batch = {'plans': [{'depot_id': 1, 'task_ids': [1], 'vehicle_ids': [1], 'date': '2026-03-02'}],
+                 'drop_penalty': -5, 'async': True}
+        self.assertEqual(self.client.post('/api/routes/plan/batch/', batch, format='json').status_code, 400)
+        sweep = {'depot_id': 1, 'date': '2026-03-02', 'drop_penalty': -5, 'async': True}
+        self.assertEqual(self.client.post('/api/routes/fleet-sweep/', sweep, format='json').status_code, 400)
+        self.assertFalse(PlanningJob.objects.exists())
+
+
+class BooleanFieldTests(TestCase):
+    def test_parse_boolean_accepts_form_strings(self):
+        for value in (True, 1, 'true', 'True', '1', 'yes', 'on'):
+            self.assertIs(parse_boolean(value, 'field'), True, value)
+        for value in (False, 0, 'false', 'FALSE', '0', 'no', 'off', ''):
+            self.assertIs(parse_boolean(value, 'field'), False, value)
+        with self.assertRaises(SearchOptionsError):
+            parse_boolean('maybe', 'field')
+
+    def test_should_decompose(self):
+        self.assertFalse(should_decompose(10000, 'false'))
+        self.assertFalse(should_decompose(10000, '0'))
+        self.assertTrue(should_decompose(1, 'true'))
+        self.assertFalse(should_decompose(1))
+        self.assertTrue(should_decompose(10000))
+        with self.assertRaises(SearchOptionsError):
+            should_decompose(1, 'sometimes')
+
+    def test_log_search_and_portfolio_strings(self):
+        self.assertFalse(resolve_search_options({'log_search': 'false'})['log_search'])
+        self.assertIsNone(resolve_portfolio_options({'portfolio': 'false'}))
+        self.assertTrue(resolve_portfolio_options({'portfolio': 'true'}))
+        with self.assertRaises(SearchOptionsError):
+            resolve_search_options({'log_search': 'maybe'})
+
+
+class SharedMatrixPublishTests(TestCase):
+    addresses = [(19.43, -99.13), (19.44, -99.14)]
+
+    def setUp(self):
+        shared_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(shared_dir.cleanup)
+        self.shared_dir = Path(shared_dir.name)
+        settings_override = override_settings(DISTANCE_MATRIX_SHARED_DIR=shared_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.matrix = TravelMatrix(np.array([[0, 5], [6, 0]]), np.array([[0, 50], [60, 0]]))
+
+    def test_publish_and_attach(self):
+        self.assertIsNotNone(shared_matrices.publish(self.addresses, self.matrix))
+        attached = shared_matrices.attach(self.addresses)
+        self.assertEqual(attached.distances.tolist(), [[0, 5], [6, 0]])
+        self.assertEqual(list(self.shared_dir.glob('*.tmp')), [])
+
+    def test_failed_publish_leaves_no_temporary_file(self):
+        with mock.patch.object(TravelMatrix, 'save', side_effect=OSError("disk full")):
+            self.assertIsNone(shared_matrices.publish(self.addresses, self.matrix))
+        with mock.patch('api.shared_matrices.os.replace', side_effect=OSError("rename failed")):
+            self.assertIsNone(shared_matrices.publish(self.addresses, self.matrix))
+        self.assertEqual(list(self.shared_dir.iterdir()), [])
+
+
+class TaskDroppingTests(TestCase):
+    """Two tasks whose pickup windows one vehicle cannot both meet."""
+    def setUp(self):
+        self.depot = Location.objects.create(name='CEDIS', latitude=19.43, longitude=-99.13, type=Location.LocationType.CEDIS)
+        window = dict(opening_time=clock_time(9, 0), closing_time=clock_time(9, 5))
+        self.tasks = []
+        for name, latitude in (('North', 19.60), ('South', 19.26)):
+            origin = Location.objects.create(name=name, latitude=latitude, longitude=-99.13, **window)
+            destination = Location.objects.create(name=f'{name} drop', latitude=latitude, longitude=-99.10)
+            self.tasks.append(Task.objects.create(origin=origin, destination=destination, weight_kg=10,
+                                                  required_date='2026-03-02'))
+        van = VehicleType.objects.create(name='Van', max_weight_kg=1000, max_volume_m3=10)
+        self.vehicle = Vehicle.objects.create(license_plate='V1', type=van)
+        self.search_options = resolve_search_options({'search_profile': 'preview', 'time_limit_seconds': 1})
+
+    def solve(self, drop_penalty=None):
+        return solve_vrp(self.depot, self.tasks, [self.vehicle], matrix_provider=get_matrix_provider('haversine'),
+                         search_options=self.search_options, drop_penalty=drop_penalty)
+
+    def test_task_that_does_not_fit_is_dropped(self):
+        result = self.solve()
+        self.assertEqual(len(result['routes']), 1)
+        self.assertEqual(len(result['dropped_tasks']), 1)
+        self.assertEqual(result['rejected_tasks'], [])
+
+    def test_zero_penalty_makes_every_task_mandatory(self):
+        self.assertIsNone(self.solve(drop_penalty=0))
+
+
+class PrescreenTests(TestCase):
+    def test_all_tasks_rejected_returns_a_complete_result(self):
+        depot = Location.objects.create(name='CEDIS', latitude=19.43, longitude=-99.13, type=Location.LocationType.CEDIS)
+        origin = Location.objects.create(name='A', latitude=19.44, longitude=-99.12)
+        destination = Location.objects.create(name='B', latitude=19.45, longitude=-99.11)
+        van = VehicleType.objects.create(name='Van', max_weight_kg=1000, max_volume_m3=10)
+        vehicle = Vehicle.objects.create(license_plate='V1', type=van)
+        task = Task.objects.create(origin=origin, destination=destination, weight_kg=5000, required_date='2026-03-02')
+
+        result = solve_vrp(depot, [task], [vehicle], matrix_provider=get_matrix_provider('haversine'))
+        self.assertEqual(result['routes'], [])
+        self.assertEqual(result['dropped_tasks'], [task.id])
+        self.assertEqual([entry['task_id'] for entry in result['rejected_tasks']], [task.id])
+        self.assertIn('exceeds', result['rejected_tasks'][0]['reason'])
+        self.assertIs(result['cached'], False)
+
+
+class SolutionCacheTests(TestCase):
+    def test_results_are_copied_in_and_out(self):
+        cache = SolutionCache(max_entries=4, ttl_seconds=60)
+        result = {'routes': [{'vehicle_id': 1}]}
+        cache.put('a', result)
+        result['routes'].clear()
+        cached = cache.get('a')
+        self.assertEqual(cached, {'routes': [{'vehicle_id': 1}]})
+        cached['routes'].clear()
+        self.assertEqual(cache.get('a'), {'routes': [{'vehicle_id': 1}]})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (2, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = SolutionCache(max_entries=2, ttl_seconds=60)
+        cache.put('a', {})
+        cache.put('b', {})
+        cache.get('a')
+        cache.put('c', {})
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expired_entries_are_misses(self):
+        cache = SolutionCache(max_entries=2, ttl_seconds=0)
+        cache.put('a', {})
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled_cache_stores_nothing(self):
+        cache = SolutionCache(max_entries=0, ttl_seconds=60)
+        cache.put('a', {})
+        self.assertIsNone(cache.get('a'))
+
+    def test_invalidate_drops_entries_of_a_row(self):
+        cache = SolutionCache(max_entries=4, ttl_seconds=60)
+        cache.put('a', {}, [('task', 1), ('location', 7)])
+        cache.put('b', {}, [('task', 2), ('location', 7)])
+        cache.put('c', {}, [('task', 3)])
+        self.assertEqual(cache.invalidate('location', 7), 2)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.invalidate('location', 7), 0)
+
+    def test_saving_a_location_invalidates_its_solutions(self):
+        location = Location.objects.create(name='A', latitude=19.44, longitude=-99.12)
+        self.addCleanup(solution_cache.clear)
+        solution_cache.put('signal-test', {}, [('location', location.pk)])
+        location.name = 'A2'
+        location.save()
+        self.assertIsNone(solution_cache.get('signal-test'))
+
+    def test_dry_run_plans_are_served_from_the_cache(self):
+        depot = Location.objects.create(name='CEDIS', latitude=19.43, longitude=-99.13, type=Location.LocationType.CEDIS)
+        origin = Location.objects.create(name='A', latitude=19.44, longitude=-99.12)
+        destination = Location.objects.create(name='B', latitude=19.45, longitude=-99.11)
+        van = VehicleType.objects.create(name='Van', max_weight_kg=1000, max_volume_m3=10)
+        vehicle = Vehicle.objects.create(license_plate='V1', type=van)
+        task = Task.objects.create(origin=origin, destination=destination, weight_kg=10, required_date='2026-03-02')
+        solution_cache.clear()
+        self.addCleanup(solution_cache.clear)
+        request = {'depot_id': depot.id, 'task_ids': [task.id], 'vehicle_ids': [vehicle.id], 'date': '2026-03-02',
+                   'matrix_provider': 'haversine', 'search_profile': 'preview', 'dry_run': True}
+
+        first, first_status = execute_plan(request)
+        second, second_status = execute_plan(request)
+        self.assertEqual((first_status, second_status), (200, 200))
+        self.assertEqual((first['cached'], second['cached']), (False, True))
+        self.assertEqual(second['planned_routes'], first['planned_routes'])
+        self.assertEqual(Route.objects.count(), 0)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.TaskStatus.PENDING)
+
+        # Saving the cached plan assigns the task, so the same request then has nothing to plan
+        saved, saved_status = execute_plan(dict(request, dry_run=False))
+        self.assertEqual((saved_status, saved['cached'], saved['assigned_task_ids']), (201, True, [task.id]))
+        self.assertEqual(execute_plan(dict(request, dry_run=False))[1], 400)
+
+
+class BatchPlanningTests(TestCase):
+    def test_plans_sharing_a_vehicle_on_a_date_are_grouped(self):
+        plans = [
+            {'date': '2026-03-02', 'vehicle_ids': [1, 2]},
+            {'date': '2026-03-02', 'vehicle_ids': [3]},
+            {'date': '2026-03-02', 'vehicle_ids': [2, 4]},
+            {'date': '2026-03-03', 'vehicle_ids': [1]}, # Same vehicle, other day: independent
+            {'date': '2026-03-02', 'vehicle_ids': [4, 3]}, # Joins both groups transitively
+        ]
+        self.assertEqual(group_batch_plans(plans), [[0, 1, 2, 4], [3]])
+
+    def test_shared_matrix_file_survives_the_purge_and_is_removed_after_the_pool(self):
+        shared_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(shared_dir.cleanup)
+        addresses = [(19.43, -99.13), (19.44, -99.14)]
+        matrix = TravelMatrix(np.array([[0, 5], [6, 0]]), np.array([[0, 50], [60, 0]]))
+        matrix_paths = []
+        def solve_subproblem(spec):
+            shared_matrices.purge_expired_segments() # Another worker purging mid-batch
+            matrix_paths.append(Path(spec['matrix_path']))
+            provider = PrecomputedMatrixProvider.load(spec['matrix_path'], spec['matrix_addresses'])
+            return provider.get_matrices(addresses[::-1]).distances.tolist()
+
+        with override_settings(DISTANCE_MATRIX_SHARED_DIR=shared_dir.name, DISTANCE_MATRIX_SHARED_TTL_SECONDS=0), \
+                mock.patch('api.batch_planning.create_subproblem_pool', side_effect=thread_pool), \
+                mock.patch('api.decomposition.solve_subproblem', side_effect=solve_subproblem):
+            results = solve_on_shared_matrix([{}, {}], matrix, addresses, processes=2)
+        self.assertEqual(results, [[[0, 6], [5, 0]]] * 2)
+        self.assertEqual(matrix_paths[0].parent.parent, Path(shared_dir.name))
+        self.assertEqual(list(Path(shared_dir.name).iterdir()), [])
+
+    def test_parse_batch_request(self):
+        plans, vehicle_depots = _parse_batch_request({
+            'plans': [{'depot_id': '1', 'date': '2026-03-02', 'task_ids': ['5'], 'vehicle_ids': [2]}],
+            'vehicle_depots': {'2': {'start_depot_id': 1, 'end_depot_id': 9}, '3': {'start_depot_id': 4}},
+        })
+        self.assertEqual(plans, [{'depot_id': 1, 'date': '2026-03-02', 'task_ids': [5], 'vehicle_ids': [2]}])
+        self.assertEqual(vehicle_depots, {2: (1, 9), 3: (4, 4)})
+
+    def test_parse_batch_request_rejects_invalid_input(self):
+        plan = {'depot_id': 1, 'date': '2026-03-02', 'task_ids': [5], 'vehicle_ids': [2]}
+        for request_data in (
+                {'plans': []},
+                {'plans': [{'depot_id': 1}]},
+                {'plans': [dict(plan, date='next week')]},
+                {'plans': [plan, dict(plan, date='2026-03-03')]}, # Task 5 in two plans
+                {'plans': [plan], 'vehicle_depots': {'2': {'end_depot_id': 1}}}):
+            with self.assertRaises(SearchOptionsError, msg=request_data):
+                _parse_batch_request(request_data)
+
+
+class FleetSweepTests(TestCase):
+    def test_per_type_sweep_varies_one_type_at_a_time(self):
+        self.assertEqual(build_sweep_scenarios({1: 2, 2: 1}), [
+            {1: 2, 2: 1}, {1: 0, 2: 1}, {1: 1, 2: 1}, {1: 2, 2: 0},
+        ])
+
+    def test_single_type_sweep_skips_the_empty_fleet(self):
+        self.assertEqual(build_sweep_scenarios({1: 3}), [{1: 3}, {1: 1}, {1: 2}])
+
+    def test_joint_sweep_with_counts(self):
+        scenarios = build_sweep_scenarios({1: 4, 2: 2}, 'joint', {1: [2, 9]})
+        self.assertEqual(scenarios[0], {1: 4, 2: 2})
+        self.assertEqual(sorted(tuple(scenario.values()) for scenario in scenarios),
+                         [(2, 0), (2, 1), (2, 2), (4, 0), (4, 1), (4, 2)])
+
+    def test_summary(self):
+        def scenario(vans, trucks, assigned, distance, solved=True):
+            return {'vehicle_counts': {1: vans, 2: trucks}, 'num_vehicles': vans + trucks, 'solved': solved,
+                    'assigned_tasks': assigned, 'coverage': assigned / 10, 'total_distance_meters': distance}
+        summary = summarize_sweep([
+            scenario(3, 1, 10, 900), scenario(2, 1, 10, 950), scenario(1, 1, 7, 600),
+            scenario(3, 0, 9, 800), scenario(2, 0, 0, 0, solved=False),
+        ], {1: 3, 2: 1})
+        self.assertEqual(summary['target_assigned_tasks'], 10)
+        self.assertEqual(summary['min_vehicles_per_type'], {1: 2, 2: 1})
+        self.assertEqual(summary['smallest_fleets'], [{1: 2, 2: 1}])
+        self.assertEqual([(point['num_vehicles'], point['assigned_tasks'], point['total_distance_meters'])
+                          for point in summary['curve']], [(2, 7, 600), (3, 10, 950), (4, 10, 900)])
+
+
+class TaskInsertionTests(TestCase):
+    """
+    One planned route depot (0, 0) -> P1 (0, 10) -> D1 (0, 20) -> depot, in grid units of 1 km, and a new
+    task from A (1, 12) to B (1, 18). Added km per (pickup arc, delivery arc): (1, 1) 2, (1, 2) 4,
+    (0, 1) 8, (0, 2) 8, (2, 2) 14, (0, 0) 18.
+    """
+    plan_date = '2026-03-02'
+
+    def setUp(self):
+        def grid_location(name, row, column, **fields):
+            return Location.objects.create(name=name, latitude=19.40 + row / 100, longitude=-99.10 + column / 100, **fields)
+        self.depot = grid_location('CEDIS', 0, 0, type=Location.LocationType.CEDIS)
+        self.pickup_1 = grid_location('P1', 0, 10)
+        self.delivery_1 = grid_location('D1', 0, 20)
+        van = VehicleType.objects.create(name='Van', max_weight_kg=100, max_volume_m3=10)
+        self.route = Route.objects.create(vehicle=Vehicle.objects.create(license_plate='V1', type=van),
+                                          planned_date=self.plan_date, status=Route.RouteStatus.ASSIGNED,
+                                          total_distance_km=40)
+        for order, (location, stop_type) in enumerate([
+                (self.depot, RouteStop.StopType.START_DEPOT), (self.pickup_1, RouteStop.StopType.PICKUP),
+                (self.delivery_1, RouteStop.StopType.DELIVERY), (self.depot, RouteStop.StopType.END_DEPOT)]):
+            RouteStop.objects.create(route=self.route, location=location, sequence_order=order, stop_type=stop_type)
+        self.route_task = Task.objects.create(origin=self.pickup_1, destination=self.delivery_1, weight_kg=80,
+                                              type=Task.TaskType.PICKUP, required_date=self.plan_date,
+                                              status=Task.TaskStatus.ASSIGNED, route=self.route)
+        self.pickup_a = grid_location('A', 1, 12)
+        self.delivery_b = grid_location('B', 1, 18)
+
+    def new_task(self, weight_kg=10):
+        return Task.objects.create(origin=self.pickup_a, destination=self.delivery_b, weight_kg=weight_kg,
+                                   type=Task.TaskType.PICKUP, required_date=self.plan_date)
+
+    def best_insertion(self, task):
+        route = Route.objects.select_related('vehicle__type').prefetch_related('stops__location').get(pk=self.route.pk)
+        return find_best_insertion(task, [route], {route.id: [self.route_task]}, GridMatrixProvider())
+
+    def test_cheapest_position_between_the_route_stops(self):
+        best = self.best_insertion(self.new_task())
+        self.assertEqual((best['pickup_position'], best['delivery_position']), (1, 2))
+        self.assertEqual(best['added_distance_meters'], 2000)
+        self.assertEqual(best['end_time_seconds'], 4200)
+        self.assertEqual(best['evaluated_positions'], 6)
+        self.assertEqual(best['feasibility_checks'], 1)
+
+    def test_capacity_rejects_positions_overlapping_the_route_load(self):
+        best = self.best_insertion(self.new_task(weight_kg=30)) # 80 + 30 > 100 while P1 is on board
+        self.assertEqual((best['pickup_position'], best['delivery_position']), (2, 3))
+        self.assertEqual(best['added_distance_meters'], 14000)
+        self.assertEqual(best['feasibility_checks'], 5)
+
+    def test_time_window_rejects_late_positions(self):
+        # D1 is reached at 2000 s on the current route; any detour before it arrives too late
+        Location.objects.filter(pk=self.delivery_1.pk).update(closing_time=clock_time(0, 35))
+        best = self.best_insertion(self.new_task())
+        self.assertEqual((best['pickup_position'], best['delivery_position']), (2, 3))
+        self.assertEqual(best['feasibility_checks'], 5)
+
+    def test_no_feasible_position_raises_conflict(self):
+        with self.assertRaises(InsertionError) as raised:
+            self.best_insertion(self.new_task(weight_kg=200))
+        self.assertEqual(raised.exception.status_code, 409)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('planner'))
+        task = Task.objects.get(weight_kg=200)
+        response = client.post('/api/routes/insert-task/', {'task_id': task.id, 'matrix_provider': 'haversine'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.TaskStatus.PENDING)
+
+    def test_insert_task_renumbers_the_route_stops(self):
+        task = self.new_task()
+        with mock.patch('api.insertion.get_matrix_provider', return_value=GridMatrixProvider()):
+            result = insert_task(task.id)
+        self.assertEqual((result['pickup_sequence_order'], result['delivery_sequence_order']), (2, 3))
+        stops = list(self.route.stops.order_by('sequence_order').values_list('sequence_order', 'location_id'))
+        self.assertEqual(stops, list(enumerate([self.depot.id, self.pickup_1.id, self.pickup_a.id,
+                                                self.delivery_b.id, self.delivery_1.id, self.depot.id])))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.route_id), (Task.TaskStatus.ASSIGNED, self.route.id))
+        self.route.refresh_from_db()
+        self.assertAlmostEqual(self.route.total_distance_km, 42)
+        self.assertEqual(self.route.total_duration_mins, 70)
+
+
+def run_in_threads(fn, count):
+    """Runs fn(index) in `count` threads at once and returns their results (or exceptions) by index."""
+    results = [None] * count
+    def target(index):
+        try:
+            results[index] = fn(index)
+        except Exception as e:
+            results[index] = e
+        finally:
+            connection.close()
+    threads = [threading.Thread(target=target, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class MatrixFetchCoalescingTests(TransactionTestCase):
+    addresses = [(19.43, -99.13), (19.44, -99.14)]
+
+    def test_single_flight_runs_one_call_for_concurrent_callers(self):
+        flight = SingleFlight()
+        calls = []
+        def work():
+            calls.append(1)
+            time.sleep(0.3)
+            return object()
+        results = run_in_threads(lambda _: flight.do('key', work), 5)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_single_flight_error_reaches_every_waiter(self):
+        flight = SingleFlight()
+        error = ValueError("fetch failed")
+        def work():
+            time.sleep(0.3)
+            raise error
+        self.assertEqual(run_in_threads(lambda _: flight.do('key', work), 5), [error] * 5)
+        self.assertEqual(flight.do('key', lambda: 'retried'), 'retried')
+
+    def test_fetch_lease_makes_the_others_wait_for_the_leader(self):
+        released_at = []
+        with mock.patch('api.single_flight.LEASE_POLL_INTERVAL_SECONDS', 0.05):
+            def follower(_):
+                with fetch_lease('location-set') as is_leader:
+                    return is_leader, time.monotonic()
+            with fetch_lease('location-set') as is_leader:
+                self.assertTrue(is_leader)
+                followers = threading.Thread(target=lambda: released_at.extend(run_in_threads(follower, 2)))
+                followers.start()
+                time.sleep(0.3)
+                lease_released = time.monotonic()
+            followers.join()
+        self.assertEqual([leader for leader, _ in released_at], [False, False])
+        self.assertTrue(all(returned_at >= lease_released for _, returned_at in released_at))
+        with fetch_lease('location-set') as is_leader:
+            self.assertTrue(is_leader)
+
+    @override_settings(DISTANCE_MATRIX_SHARED_DIR='')
+    def test_concurrent_matrix_requests_build_once_and_count_one_miss_each(self):
+        cache = MatrixCache(max_bytes=1024 * 1024, ttl_seconds=60)
+        cells = {(i, j): (100 * (i != j), 10 * (i != j)) for i in range(2) for j in range(2)}
+        def load_known_cells(addresses, address_keys):
+            time.sleep(0.3)
+            return dict(cells), {}
+        with mock.patch('api.vrp_solver.distance_matrix_cache', cache), \
+                mock.patch('api.vrp_solver._load_known_cells', side_effect=load_known_cells) as load:
+            results = run_in_threads(lambda _: create_distance_matrix(None, self.addresses), 3)
+            self.assertEqual(load.call_count, 1)
+            self.assertEqual(results[0].distances.tolist(), [[0, 100], [100, 0]])
+            self.assertTrue(all(result is results[0] for result in results))
+            self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (0, 3))
+            self.assertIs(create_distance_matrix(None, self.addresses), results[0])
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 3))
+
+
+class MatrixProviderTests(TestCase):
+    def test_haversine_distances_and_durations(self):
+        # One degree of latitude is 111,195 m on the great circle; 36 km/h is 10 m/s
+        provider = HaversineMatrixProvider(detour_factor=1.0, average_speed_kmh=36)
+        matrix = provider.get_matrices([(0.0, 0.0), (1.0, 0.0), (0.0, 1.0)])
+        self.assertEqual(matrix.distances[0].tolist(), [0, 111195, 111195])
+        self.assertEqual(matrix.distances.tolist(), matrix.distances.T.tolist())
+        self.assertEqual(matrix.durations[0].tolist(), [0, 11120, 11120])
+
+        detoured = HaversineMatrixProvider(detour_factor=1.3, average_speed_kmh=36).get_matrices([(0.0, 0.0), (1.0, 0.0)])
+        self.assertEqual(detoured.distances[0, 1], 144553) # 111,194.9 m * 1.3
+
+    def test_chained_provider_falls_back_in_order(self):
+        calls = []
+        def link(name, error=None):
+            provider = mock.Mock(spec=MatrixProvider)
+            provider.name = name
+            def get_matrices(addresses):
+                calls.append(name)
+                if error:
+                    raise error
+                return name
+            provider.get_matrices.side_effect = get_matrices
+            return provider
+
+        chain = ChainedMatrixProvider([link('cache', MatrixProviderError("missing cells")),
+                                       link('google', ValueError("timeout")), link('haversine'), link('spare')])
+        self.assertEqual(chain.get_matrices([(0.0, 0.0)]), 'haversine')
+        self.assertEqual(calls, ['cache', 'google', 'haversine'])
+
+        with self.assertRaises(MatrixProviderError) as raised:
+            ChainedMatrixProvider([link('cache', MatrixProviderError("missing cells"))]).get_matrices([(0.0, 0.0)])
+        self.assertIn('cache: missing cells', str(raised.exception))
+
+    @override_settings(GOOGLE_MAPS_API_KEY='', VRP_MATRIX_PROVIDER_CHAIN=['cache', 'google', 'haversine'])
+    def test_chain_skips_unconfigured_providers(self):
+        chain = get_matrix_provider('chained')
+        self.assertEqual([provider.name for provider in chain.providers], ['cache', 'haversine'])
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances monotonic() instead of waiting."""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class DistanceMatrixRequestTests(TestCase):
+    def assert_tiles_cover(self, tiles, origins, destinations):
+        cells = [(i, j) for tile_origins, tile_destinations in tiles for i in tile_origins for j in tile_destinations]
+        self.assertEqual(sorted(cells), [(i, j) for i in origins for j in destinations])
+        for tile_origins, tile_destinations in tiles:
+            self.assertLessEqual(len(tile_origins), 25)
+            self.assertLessEqual(len(tile_destinations), 25)
+            self.assertLessEqual(len(tile_origins) * len(tile_destinations), 100)
+
+    def test_tiles_respect_the_request_limits(self):
+        tiles = _tile_block(list(range(25)), list(range(25)))
+        self.assertEqual(len(tiles), 7) # 4 x 25 tiles, the last one 1 x 25
+        self.assertEqual({(len(o), len(d)) for o, d in tiles}, {(4, 25), (1, 25)})
+        self.assert_tiles_cover(tiles, range(25), range(25))
+
+        tiles = _tile_block([3], list(range(60))) # A new row: 25 destinations per request
+        self.assertEqual([len(d) for _, d in tiles], [25, 25, 10])
+        self.assert_tiles_cover(tiles, [3], range(60))
+
+        tiles = _tile_block(list(range(60)), [7]) # A new column: 3 requests, split evenly
+        self.assertEqual([len(o) for o, _ in tiles], [20, 20, 20])
+        self.assert_tiles_cover(tiles, range(60), [7])
+
+    def stub_client(self, *outcomes):
+        client = mock.Mock()
+        client.distance_matrix.side_effect = list(outcomes)
+        return client
+
+    @override_settings(DISTANCE_MATRIX_MAX_RETRIES=3, DISTANCE_MATRIX_BACKOFF_BASE_SECONDS=0.5)
+    def test_over_query_limit_is_retried_with_backoff(self):
+        over_limit = googlemaps.exceptions.ApiError('OVER_QUERY_LIMIT')
+        client = self.stub_client(over_limit, over_limit, {'rows': []})
+        clock = FakeClock()
+        with mock.patch('api.vrp_solver.time', clock), mock.patch('api.vrp_solver._matrix_rate_limiter', None):
+            self.assertEqual(_request_with_backoff(client, ['a', 'b'], ['c']), {'rows': []})
+        self.assertEqual(client.distance_matrix.call_count, 3)
+        self.assertEqual(len(clock.sleeps), 2)
+        self.assertTrue(0.5 <= clock.sleeps[0] <= 1.0 and 1.0 <= clock.sleeps[1] <= 1.5, clock.sleeps)
+
+    @override_settings(DISTANCE_MATRIX_MAX_RETRIES=2, DISTANCE_MATRIX_BACKOFF_BASE_SECONDS=0.5)
+    def test_gives_up_after_max_retries_and_on_other_errors(self):
+        over_limit = googlemaps.exceptions.ApiError('OVER_QUERY_LIMIT')
+        client = self.stub_client(over_limit, over_limit, over_limit, {'rows': []})
+        clock = FakeClock()
+        with mock.patch('api.vrp_solver.time', clock), mock.patch('api.vrp_solver._matrix_rate_limiter', None):
+            with self.assertRaises(googlemaps.exceptions.ApiError):
+                _request_with_backoff(client, ['a'], ['b'])
+            self.assertEqual(client.distance_matrix.call_count, 3)
+
+            client = self.stub_client(googlemaps.exceptions.ApiError('INVALID_REQUEST'))
+            with self.assertRaises(googlemaps.exceptions.ApiError):
+                _request_with_backoff(client, ['a'], ['b'])
+            self.assertEqual(client.distance_matrix.call_count, 1)
+            self.assertEqual(len(clock.sleeps), 2)
+
+    def test_rate_limiter_paces_elements(self):
+        clock = FakeClock()
+        with mock.patch('api.vrp_solver.time', clock):
+            limiter = ElementRateLimiter(100)
+            limiter.acquire(100) # A full bucket serves one burst right away
+            self.assertEqual(clock.sleeps, [])
+            limiter.acquire(50)
+            self.assertAlmostEqual(sum(clock.sleeps), 0.5)
+            limiter.acquire(500) # Larger than the bucket: waits for a full bucket only
+            self.assertAlmostEqual(sum(clock.sleeps), 1.5)
+
+    def test_requests_take_their_elements_from_the_rate_limiter(self):
+        limiter = mock.Mock(spec=ElementRateLimiter)
+        with mock.patch('api.vrp_solver._matrix_rate_limiter', limiter):
+            _request_with_backoff(self.stub_client({'rows': []}), ['a', 'b'], ['c', 'd', 'e'])
+        limiter.acquire.assert_called_once_with(6)
+
+
+class MatrixCacheTests(TestCase):
+    """2x2 matrices hold 32 bytes (two int32 arrays)."""
+    def matrix(self):
+        return TravelMatrix(np.zeros((2, 2)), np.zeros((2, 2)))
+
+    def test_least_recently_used_entries_are_evicted_over_budget(self):
+        cache = MatrixCache(max_bytes=100, ttl_seconds=60, max_entries=10)
+        for key in 'abc':
+            cache.put(key, self.matrix())
+        cache.get('a')
+        cache.put('d', self.matrix()) # 128 bytes: 'b' is the least recently used
+        self.assertEqual([key for key in 'abcd' if key in cache], ['a', 'c', 'd'])
+        cache.put('e', self.matrix())
+        self.assertEqual([key for key in 'abcde' if key in cache], ['a', 'd', 'e'])
+        self.assertEqual(cache.stats()['evictions'], 2)
+        self.assertEqual(cache.stats()['bytes_held'], 96)
+
+    def test_memory_mapped_entries_are_bounded_by_the_entry_cap(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'matrix.npy'
+        self.matrix().save(path)
+        cache = MatrixCache(max_bytes=100, ttl_seconds=60, max_entries=2)
+        for key in 'abc':
+            cache.put(key, TravelMatrix.load(path, mmap=True))
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.stats()['bytes_held'], 0)
+
+    def test_expired_entries_are_misses_and_swept(self):
+        clock = FakeClock()
+        with mock.patch('api.matrix_cache.time', clock):
+            cache = MatrixCache(max_bytes=1000, ttl_seconds=30, max_entries=10)
+            cache.put('a', self.matrix())
+            clock.sleep(20)
+            cache.put('b', self.matrix())
+            self.assertIsNotNone(cache.get('a'))
+            clock.sleep(15) # 'a' expired, 'b' not yet
+            self.assertIsNone(cache.get('a'))
+            self.assertIsNone(cache.peek('a'))
+            self.assertIsNotNone(cache.peek('b'))
+            clock.sleep(60) # The sweep drops 'b' on any access
+            cache.get('c')
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(cache.stats()['expirations'], 2)
+
+    def test_stats(self):
+        cache = MatrixCache(max_bytes=1000, ttl_seconds=60, max_entries=10)
+        self.assertIsNone(cache.stats()['hit_rate'])
+        cache.put('a', self.matrix())
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        cache.peek('b')
+        self.assertEqual(cache.stats(), {
+            'entries': 1, 'bytes_held': 32, 'max_bytes': 1000, 'max_entries': 10, 'ttl_seconds': 60,
+            'hits': 2, 'misses': 1, 'hit_rate': 0.6667, 'evictions': 0, 'expirations': 0,
+        })
+
+
+def thread_pool(processes):
+    """Stands in for decomposition.create_subproblem_pool: threads instead of spawned processes."""
+    return ThreadPoolExecutor(max_workers=processes), threading.Event()
+
+
+def fake_subproblem_result(spec):
+    """One route serving all tasks of the spec on its first vehicle, 1 km per task."""
+    return {
+        'routes': [{'vehicle_id': spec['vehicle_ids'][0], 'total_distance_meters': 1000 * len(spec['task_ids']),
+                    'stops': [{'task_id': task_id, 'location_id': task_id, 'type': 'PICKUP'}
+                              for task_id in spec['task_ids']]}],
+        'dropped_tasks': [],
+    }
+
+
+class DecomposedSolveTests(TestCase):
+    """Four tasks around a depot at (0, 0), east and north form one region, west and south the other."""
+    def setUp(self):
+        self.depot = SimpleNamespace(id=1, latitude=0.0, longitude=0.0)
+        self.tasks = []
+        for task_id, (latitude, longitude) in enumerate([(0, 1), (1, 0), (0, -1), (-1, 0)], start=1):
+            point = SimpleNamespace(latitude=latitude, longitude=longitude)
+            self.tasks.append(SimpleNamespace(id=task_id, origin=point, destination=point, weight_kg=10))
+        self.vehicles = [SimpleNamespace(id=vehicle_id) for vehicle_id in (11, 12)]
+        self.specs = []
+
+    def solve(self, solve_subproblem):
+        def record(spec):
+            self.specs.append(spec)
+            return solve_subproblem(spec)
+        with mock.patch('api.decomposition.create_subproblem_pool', side_effect=thread_pool), \
+                mock.patch('api.decomposition.solve_subproblem', side_effect=record):
+            return solve_vrp_decomposed(self.depot, self.tasks, self.vehicles, search_options={'time_limit_seconds': 10},
+                                        cluster_size=2, processes=2)
+
+    def test_sweep_splits_tasks_into_neighboring_sectors(self):
+        clusters = sweep_clusters(self.depot, self.tasks, 2)
+        self.assertEqual([[task.id for task in cluster] for cluster in clusters], [[1, 2], [3, 4]])
+        self.assertEqual(sorted(task.id for cluster in sweep_clusters(self.depot, self.tasks, 3) for task in cluster),
+                         [1, 2, 3, 4])
+
+    def test_sweep_starts_at_the_widest_gap(self):
+        # Tasks just above and below the westward ray must not be cut apart
+        tasks = []
+        for task_id, (latitude, longitude) in enumerate([(0.1, -1), (-0.1, -1), (0, 1), (0.2, 1)], start=1):
+            point = SimpleNamespace(latitude=latitude, longitude=longitude)
+            tasks.append(SimpleNamespace(id=task_id, origin=point, destination=point, weight_kg=10))
+        clusters = sweep_clusters(self.depot, tasks, 2)
+        self.assertIn({1, 2}, [{task.id for task in cluster} for cluster in clusters])
+
+    def test_every_vehicle_is_allocated_once_and_every_region_gets_one(self):
+        vehicles = [SimpleNamespace(id=vehicle_id) for vehicle_id in range(7)]
+        clusters = [[SimpleNamespace(weight_kg=weight)] * count for weight, count in ((100, 5), (0, 1), (10, 2))]
+        allocation = allocate_vehicles(clusters, vehicles)
+        self.assertEqual(sorted(vehicle.id for region in allocation for vehicle in region), list(range(7)))
+        self.assertTrue(all(allocation))
+        self.assertEqual([len(region) for region in allocation], [5, 1, 1]) # By weight demand
+
+        unweighted = [[SimpleNamespace(weight_kg=None)] * count for count in (3, 1)]
+        self.assertEqual([len(region) for region in allocate_vehicles(unweighted, vehicles[:4])], [3, 1])
+        self.assertEqual([len(region) for region in allocate_vehicles(unweighted, vehicles[:2])], [1, 1])
+
+    def test_repair_never_raises_the_dropped_count(self):
+        def solve_subproblem(spec):
+            result = fake_subproblem_result(spec)
+            if spec['initial_routes']: # A shorter repair that drops a task is rejected
+                result['routes'][0]['stops'].pop()
+                result['routes'][0]['total_distance_meters'] = 0
+                result['dropped_tasks'] = [spec['task_ids'][-1]]
+            return result
+        result = self.solve(solve_subproblem)
+        self.assertEqual(result['dropped_tasks'], [])
+        self.assertEqual(result['decomposition']['repaired_region_pairs'], 0)
+
+    def test_repair_places_tasks_a_region_dropped(self):
+        def solve_subproblem(spec):
+            result = fake_subproblem_result(spec)
+            if not spec['initial_routes'] and 1 in spec['task_ids']:
+                result['routes'][0]['stops'].pop(0)
+                result['dropped_tasks'] = [1]
+            return result
+        result = self.solve(solve_subproblem)
+        self.assertEqual(result['dropped_tasks'], [])
+        self.assertEqual(result['decomposition']['repaired_region_pairs'], 1)
+        self.assertEqual(sorted(stop['task_id'] for route in result['routes'] for stop in route['stops']), [1, 2, 3, 4])
+
+    @override_settings(VRP_MAX_TIME_LIMIT_SECONDS=100)
+    def test_regions_and_repair_share_one_deadline(self):
+        started = time.time()
+        result = self.solve(fake_subproblem_result)
+        self.assertEqual(len(self.specs), 3) # Two regions, then one repair of the pair
+        self.assertEqual(len({spec['deadline'] for spec in self.specs}), 1)
+        self.assertTrue(started + 100 <= self.specs[0]['deadline'] <= time.time() + 100)
+        self.assertEqual(result['dropped_tasks'], [])
+
+    @override_settings(VRP_MAX_TIME_LIMIT_SECONDS=0)
+    def test_repair_is_skipped_after_the_deadline(self):
+        result = self.solve(fake_subproblem_result)
+        self.assertEqual(len(self.specs), 2)
+        self.assertEqual(result['decomposition']['repaired_region_pairs'], 0)
+
+    def test_regions_over_the_memory_limit_are_reported_dropped(self):
+        def solve_subproblem(spec):
+            if spec['initial_routes']:
+                raise BrokenProcessPool("A pool process died") # The repair loses the pool
+            if 1 in spec['task_ids']:
+                raise MemoryError()
+            return fake_subproblem_result(spec)
+        result = self.solve(solve_subproblem)
+        self.assertEqual(result['dropped_tasks'], [1, 2])
+        self.assertEqual([stop['task_id'] for route in result['routes'] for stop in route['stops']], [3, 4])
+
+    def test_limit_process_memory(self):
+        with mock.patch('resource.setrlimit') as setrlimit:
+            limit_process_memory(None)
+            setrlimit.assert_not_called()
+            limit_process_memory(512)
+        limit = 512 * 1024 * 1024
+        self.assertEqual(setrlimit.call_args.args[1], (limit, limit))
+
+    def test_cancellation_check_polls_once_per_interval(self):
+        job = enqueue_planning_job({'depot_id': 1})
+        check = CancellationCheck(job.pk, interval_seconds=60)
+        self.assertFalse(check())
+        PlanningJob.objects.filter(pk=job.pk).update(cancel_requested=True)
+        with self.assertNumQueries(0):
+            self.assertFalse(check()) # Within the interval: no query
+        check.interval_seconds = 0
+        self.assertTrue(check())
+        with self.assertNumQueries(0):
+            self.assertTrue(check()) # Cancellation is final
+
+
+class ColocatedLocationTests(TestCase):
+    """Two branches in the same building (coordinates equal up to the snap grid) share one matrix node."""
+    def setUp(self):
+        self.depot = Location.objects.create(name='CEDIS', latitude=19.43, longitude=-99.13, type=Location.LocationType.CEDIS)
+        self.branch_a = Location.objects.create(name='Branch A', latitude=19.440001, longitude=-99.120001)
+        self.branch_b = Location.objects.create(name='Branch B', latitude=19.44, longitude=-99.12)
+        self.customer_a = Location.objects.create(name='Customer A', latitude=19.45, longitude=-99.11)
+        self.customer_b = Location.objects.create(name='Customer B', latitude=19.46, longitude=-99.10)
+
+    def test_index_mapping_and_merged_addresses(self):
+        node_locations, location_index_map, addresses = merge_colocated_locations(
+            [self.depot, self.branch_a, self.customer_a, self.branch_b], decimals=5)
+        self.assertEqual([[location.name for location in group] for group in node_locations],
+                         [['CEDIS'], ['Branch A', 'Branch B'], ['Customer A']])
+        self.assertEqual(location_index_map, {self.depot.id: 0, self.branch_a.id: 1, self.customer_a.id: 2,
+                                              self.branch_b.id: 1})
+        self.assertEqual(addresses, [(19.43, -99.13), (19.44, -99.12), (19.45, -99.11)])
+
+        # A finer grid keeps the branches apart
+        _, location_index_map, addresses = merge_colocated_locations([self.depot, self.branch_a, self.branch_b], decimals=6)
+        self.assertEqual(len(addresses), 3)
+        self.assertNotEqual(location_index_map[self.branch_a.id], location_index_map[self.branch_b.id])
+
+    def test_stops_at_merged_locations_keep_their_own_location(self):
+        van = VehicleType.objects.create(name='Van', max_weight_kg=1000, max_volume_m3=10)
+        vehicle = Vehicle.objects.create(license_plate='V1', type=van)
+        task_a = Task.objects.create(origin=self.branch_a, destination=self.customer_a, weight_kg=10,
+                                     type=Task.TaskType.PICKUP, required_date='2026-03-02')
+        task_b = Task.objects.create(origin=self.branch_b, destination=self.customer_b, weight_kg=10,
+                                     type=Task.TaskType.PICKUP, required_date='2026-03-02')
+        result = solve_vrp(self.depot, [task_a, task_b], [vehicle], matrix_provider=get_matrix_provider('haversine'),
+                           search_options=resolve_search_options({'search_profile': 'preview', 'time_limit_seconds': 1}))
+        stops = result['routes'][0]['stops']
+        visits = {(stop['task_id'], stop['type']): stop['location_id'] for stop in stops if stop['task_id']}
+        self.assertEqual(visits, {
+            (task_a.id, 'PICKUP'): self.branch_a.id, (task_a.id, 'DELIVERY'): self.customer_a.id,
+            (task_b.id, 'PICKUP'): self.branch_b.id, (task_b.id, 'DELIVERY'): self.customer_b.id,
+        })
+        # Both pickups are one visit: same arrival time, back to back
+        pickups = [index for index, stop in enumerate(stops) if stop['type'] == 'PICKUP']
+        self.assertEqual(pickups[1] - pickups[0], 1)
+        self.assertEqual(stops[pickups[0]]['arrival_time_seconds'], stops[pickups[1]]['arrival_time_seconds'])
+        self.assertEqual([stop['location_id'] for stop in (stops[0], stops[-1])], [self.depot.id, self.depot.id])
+
+
+class SuccessorGraphTests(TestCase):
+    def test_graph_keeps_nearest_compatible_successors_and_required_arcs(self):
+        # Nodes on a line 0 (depot) .. 5, 1 km apart; node 5 closes before anyone can reach it from node 1
+        positions = np.arange(6)
+        distances = np.abs(positions[:, None] - positions[None, :]) * 1000
+        durations = distances // 10
+        time_windows = [(0, 86400)] * 5 + [(0, 250)]
+        graph = build_successor_graph(distances, durations, [0] * 6, time_windows, [0], 2, required_arcs=[(1, 4)])
+        self.assertIsNone(graph[0])
+        self.assertEqual(graph[1], [2, 3, 4]) # Nearest two plus the required pickup -> delivery arc
+        self.assertEqual(graph[2], [1, 3])
+        self.assertEqual(graph[3], [2, 4, 5]) # 3 is one of the two nearest predecessors of 5
+        self.assertEqual(graph[4], [3, 5])
+        self.assertEqual(graph[5], [3, 4])
+        self.assertNotIn(5, graph[1])
+
+    def test_restricted_solve_assigns_what_the_full_solve_assigns(self):
+        rng = np.random.default_rng(2)
+        depot = Location.objects.create(name='CEDIS', latitude=19.43, longitude=-99.13, type=Location.LocationType.CEDIS)
+        tasks = []
+        for index, (latitude, longitude) in enumerate(rng.uniform(-0.1, 0.1, size=(16, 2)).round(4)):
+            window = dict(opening_time=clock_time(1 + index % 4, 0), closing_time=clock_time(3 + index % 4, 0))
+            origin = Location.objects.create(name=f'P{index}', latitude=19.43 + latitude, longitude=-99.13 + longitude, **window)
+            destination = Location.objects.create(name=f'D{index}', latitude=19.43 + latitude + 0.01,
+                                                  longitude=-99.13 + longitude - 0.01)
+            tasks.append(Task.objects.create(origin=origin, destination=destination, weight_kg=100,
+                                             type=Task.TaskType.PICKUP, required_date='2026-03-02'))
+        van = VehicleType.objects.create(name='Van', max_weight_kg=400, max_volume_m3=10)
+        vehicles = [Vehicle.objects.create(license_plate=f'V{index}', type=van) for index in range(3)]
+
+        def assigned_tasks(num_neighbors):
+            search_options = resolve_search_options({'search_profile': 'preview', 'time_limit_seconds': 2,
+                                                     'num_neighbors': num_neighbors})
+            result = solve_vrp(depot, tasks, vehicles, matrix_provider=get_matrix_provider('haversine'),
+                               search_options=search_options)
+            return {stop['task_id'] for route in result['routes'] for stop in route['stops'] if stop['task_id']}
+
+        full = assigned_tasks(None)
+        self.assertTrue(full)
+        self.assertLessEqual(full, assigned_tasks(8))
+
+
+class SymmetryBreakingTests(TestCase):
+    """Four identical vans; the North and South pickups share a 5 minute window, so two vans are needed."""
+    def setUp(self):
+        self.depot = Location.objects.create(name='CEDIS', latitude=19.43, longitude=-99.13, type=Location.LocationType.CEDIS)
+        window = dict(opening_time=clock_time(9, 0), closing_time=clock_time(9, 5))
+        self.tasks = []
+        for name, latitude, longitude, pickup_window in (('North', 19.60, -99.13, window), ('South', 19.26, -99.13, window),
+                                                         ('East', 19.43, -99.00, {})):
+            origin = Location.objects.create(name=name, latitude=latitude, longitude=longitude, **pickup_window)
+            destination = Location.objects.create(name=f'{name} drop', latitude=latitude + 0.01, longitude=longitude + 0.02)
+            self.tasks.append(Task.objects.create(origin=origin, destination=destination, weight_kg=10,
+                                                  type=Task.TaskType.PICKUP, required_date='2026-03-02'))
+        van = VehicleType.objects.create(name='Van', max_weight_kg=1000, max_volume_m3=10)
+        self.vehicles = [Vehicle.objects.create(license_plate=f'V{index}', type=van) for index in range(4)]
+
+    def solve(self, symmetry_breaking):
+        solution_cache.clear()
+        search_options = resolve_search_options({
+            'search_profile': 'preview', 'time_limit_seconds': 1, 'symmetry_breaking': symmetry_breaking,
+            'first_solution_strategy': 'PARALLEL_CHEAPEST_INSERTION'})
+        result = solve_vrp(self.depot, self.tasks, self.vehicles, matrix_provider=get_matrix_provider('haversine'),
+                           search_options=search_options, drop_penalty=0)
+        return ({route['vehicle_id'] for route in result['routes']},
+                sum(route['total_distance_meters'] for route in result['routes']))
+
+    def test_identical_vehicles_are_used_in_order_at_the_same_distance(self):
+        _, distance = self.solve('none')
+        first_two = {vehicle.id for vehicle in self.vehicles[:2]}
+        for mode in ('ordered_usage', 'fixed_cost_tiers'):
+            used, mode_distance = self.solve(mode)
+            self.assertEqual(used, first_two, mode)
+            self.assertEqual(mode_distance, distance, mode)
+
+
+class SearchOptionsTests(TestCase):
+    profiles = {
+        'quick': {'first_solution_strategy': 'PATH_CHEAPEST_ARC', 'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH',
+                  'time_limit_seconds': 5},
+        'thorough': {'first_solution_strategy': 'PARALLEL_CHEAPEST_INSERTION', 'time_limit_seconds': 60,
+                     'random_seed': 3},
+    }
+
+    @override_settings(VRP_DEFAULT_SEARCH_PROFILE='thorough')
+    def test_request_fields_override_the_profile(self):
+        with override_settings(VRP_SEARCH_PROFILES=self.profiles):
+            options = resolve_search_options({'time_limit_seconds': '20', 'local_search_metaheuristic': 'tabu_search'})
+            self.assertEqual(options['search_profile'], 'thorough')
+            self.assertEqual(options['first_solution_strategy'], 'PARALLEL_CHEAPEST_INSERTION')
+            self.assertEqual(options['local_search_metaheuristic'], 'TABU_SEARCH')
+            self.assertEqual(options['time_limit_seconds'], 20.0)
+            self.assertEqual(options['random_seed'], 3)
+            self.assertIsNone(options['num_neighbors'])
+
+            options = resolve_search_options({'search_profile': 'quick', 'random_seed': None})
+            self.assertEqual((options['first_solution_strategy'], options['time_limit_seconds']), ('PATH_CHEAPEST_ARC', 5))
+            self.assertIsNone(options['random_seed'])
+            with self.assertRaises(SearchOptionsError):
+                resolve_search_options({'search_profile': 'preview'})
+
+    def test_random_seed_accepts_zero(self):
+        self.assertEqual(resolve_search_options({'random_seed': 0})['random_seed'], 0)
+        self.assertEqual(resolve_search_options({'random_seed': '42'})['random_seed'], 42)
+        for seed in (-1, 2 ** 31, 'abc'):
+            with self.assertRaises(SearchOptionsError, msg=seed):
+                resolve_search_options({'random_seed': seed})
+
+    @override_settings(VRP_MAX_TIME_LIMIT_SECONDS=100)
+    def test_invalid_fields_are_rejected(self):
+        for request_data in (
+                {'first_solution_strategy': 'FASTEST'},
+                {'local_search_metaheuristic': 'ANNEALING'},
+                {'time_limit_seconds': 0},
+                {'time_limit_seconds': 101},
+                {'solution_limit': -3},
+                {'num_neighbors': 0},
+                {'symmetry_breaking': 'random'},
+                {'symmetry_breaking': 'ordered_usage', 'first_solution_strategy': 'PATH_CHEAPEST_ARC'},
+                {'search_profile': 'weekly'}):
+            with self.assertRaises(SearchOptionsError, msg=request_data):
+                resolve_search_options(request_data)
+        self.assertIsNone(resolve_search_options({'symmetry_breaking': 'NONE'})['symmetry_breaking'])
+
+    @override_settings(VRP_MAX_TIME_LIMIT_SECONDS=100, VRP_SEARCH_PROFILES={'open': {'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH'}})
+    def test_endless_metaheuristic_needs_a_limit(self):
+        with self.assertRaises(SearchOptionsError):
+            resolve_search_options({'search_profile': 'open'})
+        self.assertEqual(resolve_search_options({'search_profile': 'open', 'solution_limit': 10})['solution_limit'], 10)
+        options = resolve_search_options({'search_profile': 'open', 'local_search_metaheuristic': 'GREEDY_DESCENT'})
+        # The server maximum always applies
+        self.assertEqual(build_search_parameters(options).time_limit.seconds, 100)
+
+    def test_portfolio_members_start_from_the_request(self):
+        members = resolve_portfolio_options({'search_profile': 'preview', 'time_limit_seconds': 3, 'portfolio': [
+            {'random_seed': 0}, {'local_search_metaheuristic': 'TABU_SEARCH'}]})
+        self.assertEqual([(member['time_limit_seconds'], member['random_seed'], member['local_search_metaheuristic'])
+                          for member in members], [(3, 0, 'GUIDED_LOCAL_SEARCH'), (3, None, 'TABU_SEARCH')])
+        for portfolio in ([{'time_limit': 3}], {'random_seed': 1}, ['fast']):
+            with self.assertRaises(SearchOptionsError, msg=portfolio):
+                resolve_portfolio_options({'portfolio': portfolio})
+
+
+class PortfolioTests(TestCase):
+    def test_members_share_a_deadline_and_the_fewest_dropped_tasks_win(self):
+        # Member by seed: (dropped tasks, route distance); seed 4 finds no solution
+        outcomes = {1: ([], 5000), 2: ([9], 1000), 3: ([], 4000), 4: None}
+        specs = []
+        def solve_subproblem(spec):
+            specs.append(spec)
+            outcome = outcomes[spec['search_options']['random_seed']]
+            if outcome is None:
+                return None
+            dropped, distance = outcome
+            return {'routes': [{'vehicle_id': 11, 'total_distance_meters': distance, 'stops': []}], 'dropped_tasks': dropped}
+
+        members = [dict(resolve_search_options({'search_profile': 'preview', 'time_limit_seconds': time_limit}),
+                        random_seed=seed) for seed, time_limit in ((1, 5), (2, 20), (3, 5), (4, 5))]
+        started = time.time()
+        with mock.patch('api.portfolio.create_subproblem_pool', side_effect=thread_pool), \
+                mock.patch('api.decomposition.solve_subproblem', side_effect=solve_subproblem):
+            result = solve_vrp_portfolio(SimpleNamespace(id=1), [SimpleNamespace(id=9)], [SimpleNamespace(id=11)],
+                                         members, processes=2)
+
+        self.assertEqual(len({spec['deadline'] for spec in specs}), 1)
+        self.assertTrue(started + 20 <= specs[0]['deadline'] <= time.time() + 20) # The longest member limit
+        self.assertEqual(result['portfolio']['winner'], 2)
+        self.assertEqual(result['routes'][0]['total_distance_meters'], 4000)
+        self.assertEqual([(member['cost'], member['dropped_tasks']) for member in result['portfolio']['members']],
+                         [(5000, 0), (1000, 1), (4000, 0), (None, None)])
+        self.assertEqual(result['portfolio']['winning_configuration']['random_seed'], 3)
+
+    def test_no_member_solution_returns_none(self):
+        with mock.patch('api.portfolio.create_subproblem_pool', side_effect=thread_pool), \
+                mock.patch('api.decomposition.solve_subproblem', return_value=None):
+            self.assertIsNone(solve_vrp_portfolio(SimpleNamespace(id=1), [], [], [resolve_search_options()] * 2))
+
+
+class MatrixStoreTests(TestCase):
+    addresses = [(19.4326081, -99.1332085), (19.44, -99.14), (19.45, -99.15)]
+
+    def test_coordinate_key(self):
+        self.assertEqual(matrix_store.coordinate_key((19.4326081, -99.1332085)), '19.432608,-99.133208')
+        self.assertEqual(matrix_store.coordinate_key(('19.44', -99.14)), '19.440000,-99.140000')
+
+    def test_saved_cells_load_back(self):
+        keys = [matrix_store.coordinate_key(address) for address in self.addresses]
+        matrix_store.save_cells({(keys[0], keys[1]): (1000, 100), (keys[1], keys[0]): (1100, 110),
+                                 (keys[0], keys[2]): (2000, 200)})
+        self.assertEqual(matrix_store.load_cells(self.addresses[:2]), {
+            (keys[0], keys[1]): (1000, 100), (keys[1], keys[0]): (1100, 110)})
+        self.assertEqual(matrix_store.load_cells(self.addresses[:1], self.addresses[2:]), {(keys[0], keys[2]): (2000, 200)})
+        self.assertEqual(matrix_store.load_cells([]), {})
+
+        # Saving a pair again refreshes it instead of failing
+        matrix_store.save_cells({(keys[0], keys[1]): (1200, 120)})
+        self.assertEqual(matrix_store.load_cells(self.addresses[:2])[(keys[0], keys[1])], (1200, 120))
+        self.assertEqual(DistanceMatrixEntry.objects.count(), 3)
+
+    def test_load_in_batches(self):
+        keys = [matrix_store.coordinate_key(address) for address in self.addresses]
+        cells = {(origin, destination): (i, i) for i, (origin, destination) in
+                 enumerate((origin, destination) for origin in keys for destination in keys)}
+        matrix_store.save_cells(cells)
+        with mock.patch('api.matrix_store.QUERY_BATCH_SIZE', 2):
+            self.assertEqual(matrix_store.load_cells(self.addresses), cells)
+
+    @override_settings(DISTANCE_MATRIX_STORE_TTL_SECONDS=3600)
+    def test_expired_cells_are_ignored_and_purged(self):
+        keys = [matrix_store.coordinate_key(address) for address in self.addresses]
+        matrix_store.save_cells({(keys[0], keys[1]): (1000, 100), (keys[1], keys[0]): (1100, 110)})
+        DistanceMatrixEntry.objects.filter(origin_key=keys[0]).update(fetched_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(matrix_store.load_cells(self.addresses[:2]), {(keys[1], keys[0]): (1100, 110)})
+
+        self.assertEqual(matrix_store.purge_expired_cells(), 1)
+        self.assertEqual(list(DistanceMatrixEntry.objects.values_list('origin_key', flat=True)), [keys[1]])
+        self.assertEqual(matrix_store.purge_expired_cells(), 0)
+
+
+class RecordingDistanceClient:
+    """Answers distance_matrix requests from the coordinates (1 m per 1e-5 degrees of latitude) and records them."""
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def distance_matrix(self, origins, destinations, mode):
+        with self.lock:
+            self.requests.append((list(origins), list(destinations)))
+        return {'rows': [{'elements': [
+            {'status': 'OK', 'distance': {'value': round(abs(o[0] - d[0]) * 1e5)}, 'duration': {'value': 1}}
+            for d in destinations]} for o in origins]}
+
+    def requested_cells(self):
+        return sorted((o, d) for origins, destinations in self.requests for o in origins for d in destinations)
+
+
+@override_settings(DISTANCE_MATRIX_SHARED_DIR='')
+class IncrementalMatrixFetchTests(TestCase):
+    addresses = [(19.40, -99.1), (19.41, -99.1), (19.42, -99.1), (19.43, -99.1)]
+
+    def test_origins_missing_the_same_destinations_share_a_block(self):
+        blocks = _group_missing_cells({0: [3], 1: [3], 2: [3], 3: [0, 1, 2, 3]})
+        self.assertEqual(sorted(blocks), [([0, 1, 2], [3]), ([3], [0, 1, 2, 3])])
+
+    def test_only_the_missing_cells_are_requested(self):
+        with mock.patch('api.vrp_solver.distance_matrix_cache', MatrixCache(max_bytes=1024 * 1024, ttl_seconds=60)), \
+                mock.patch('api.vrp_solver._matrix_rate_limiter', None):
+            # Warm the store with the first three locations, then add a fourth one
+            create_distance_matrix(RecordingDistanceClient(), self.addresses[:3])
+            client = RecordingDistanceClient()
+            matrix = create_distance_matrix(client, self.addresses)
+
+        new = self.addresses[3]
+        self.assertEqual(client.requested_cells(), sorted(
+            [(new, destination) for destination in self.addresses] +
+            [(origin, new) for origin in self.addresses[:3]]))
+        self.assertEqual(len(client.requests), 2) # The new row and the new column
+        self.assertEqual(matrix.distances[0].tolist(), [0, 1000, 2000, 3000])
+        self.assertEqual(matrix.distances[:, 3].tolist(), [3000, 2000, 1000, 0])
+
+    def test_prefetch_requests_only_the_missing_row_cells(self):
+        with mock.patch('api.vrp_solver._matrix_rate_limiter', None):
+            client = RecordingDistanceClient()
+            self.assertEqual(prefetch_matrix_rows(client, self.addresses[:2], [0]), 2)
+            client = RecordingDistanceClient()
+            self.assertEqual(prefetch_matrix_rows(client, self.addresses, [0, 1]), 6)
+            self.assertEqual(client.requested_cells(), sorted(
+                (origin, destination) for origin in self.addresses[:2] for destination in self.addresses
+                if (origin, destination) != (self.addresses[0], self.addresses[0])
+                and (origin, destination) != (self.addresses[0], self.addresses[1])))
+            self.assertEqual(prefetch_matrix_rows(RecordingDistanceClient(), self.addresses, [0, 1]), 0)
+
+
+@override_settings(DISTANCE_MATRIX_SHARED_DIR='')
+class WarmMatrixCacheCommandTests(TestCase):
+    def setUp(self):
+        Location.objects.create(name='CEDIS', latitude=19.43, longitude=-99.13, type=Location.LocationType.CEDIS)
+        origin = Location.objects.create(name='A', latitude=19.44, longitude=-99.12)
+        destination = Location.objects.create(name='B', latitude=19.45, longitude=-99.11)
+        Task.objects.create(origin=origin, destination=destination, weight_kg=10, required_date='2026-03-02')
+        Task.objects.create(origin=origin, destination=origin, weight_kg=10, required_date='2026-03-02',
+                            status=Task.TaskStatus.ASSIGNED)
+        self.client_stub = RecordingDistanceClient()
+
+    def warm(self, *args):
+        out = StringIO()
+        with mock.patch('api.management.commands.warm_matrix_cache.get_google_maps_client',
+                        return_value=self.client_stub) as get_client, \
+                mock.patch('api.vrp_solver._matrix_rate_limiter', None):
+            call_command('warm_matrix_cache', *args, stdout=out)
+        return out.getvalue(), get_client.call_count
+
+    def test_dry_run_only_reports(self):
+        output, client_calls = self.warm('--dry-run')
+        self.assertIn('1 depots and 2 task locations -> 3 matrix nodes. 0/9 pairs already stored.', output)
+        self.assertEqual(client_calls, 0)
+        self.assertEqual(DistanceMatrixEntry.objects.count(), 0)
+
+    def test_element_budget_stops_the_run_and_the_next_run_resumes(self):
+        output, _ = self.warm('--batch-size', '1', '--max-elements', '3')
+        self.assertIn('Batch 1/3: requested 3 elements (3 total).', output)
+        self.assertIn('Reached --max-elements (3). Run again to resume.', output)
+        self.assertNotIn('Batch 2/3', output)
+        self.assertEqual(DistanceMatrixEntry.objects.count(), 3)
+
+        output, _ = self.warm('--batch-size', '1')
+        self.assertIn('3/9 pairs already stored.', output)
+        self.assertIn('Batch 1/3: requested 0 elements (0 total).', output)
+        self.assertIn('Batch 3/3: requested 3 elements (6 total).', output)
+        self.assertIn('Matrix store warm: 9 pairs for 3 nodes.', output)
+        self.assertEqual(len(self.client_stub.requested_cells()), 9) # No pair was requested twice
+
+        output, client_calls = self.warm()
+        self.assertIn('9/9 pairs already stored.', output)
+        self.assertEqual(client_calls, 0)
@@ -0,0 +1,88 @@
+"""
+Compact distance/duration matrix type shared by the matrix providers, the caches and the solver.
+"""
+import numpy as np
+
+# Values are clipped to this bound when converted, so they always fit in int32
+MAX_MATRIX_VALUE = np.iinfo(np.int32).max
+
+
+class TravelMatrix:
+    """
+    Distance (meters) and duration (seconds) matrices backed by contiguous int32 NumPy arrays.
+    4 bytes per cell instead of a Python int (28+ bytes) plus list overhead.
+
+    Unpacks like the old (distance_matrix, duration_matrix) tuple:
+        distances, durations = matrix
+    """
+    def __init__(self, distances, durations):
+        self.distances = self._as_int32(distances)
+        self.durations = self._as_int32(durations)
+        if self.distances.shape != self.durations.shape or self.distances.ndim != 2 \
+                or self.distances.shape[0] != self.distances.shape[1]:
+            raise ValueError(
+                f"Distance and duration matrices must be square and of equal shape, "
+                f"got {self.distances.shape} and {self.durations.shape}.")
+
+    @staticmethod
+    def _as_int32(values):
+        """Converts to a C-contiguous int32 array, without copying if it already is one (e.g. a memmap)."""
+        if isinstance(values, np.ndarray) and values.dtype == np.int32 and values.flags['C_CONTIGUOUS']:
+            return values
+        return np.ascontiguousarray(np.clip(np.asarray(values), 0, MAX_MATRIX_VALUE), dtype=np.int32)
+
+    @classmethod
+    def empty(cls, size):
+        """Allocates a zero-filled size x size matrix pair, to be filled in place."""
+        return cls(np.zeros((size, size), dtype=np.int32), np.zeros((size, size), dtype=np.int32))
+
+    @property
+    def size(self):
+        """Number of locations (rows/columns)."""
+        return self.distances.shape[0]
+
+    @property
+    def nbytes(self):
+        """Bytes held by both arrays."""
+        return self.distances.nbytes + self.durations.nbytes
+
+    @property
+    def is_memory_mapped(self):
+        """True if the arrays are backed by a memory-mapped file (shared, not private memory)."""
+        return isinstance(self.distances.base, np.memmap) or isinstance(self.distances, np.memmap)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        # Allows `distances, durations = matrix`
+        return iter((self.distances, self.durations))
+
+    def submatrix(self, indices):
+        """
+        Returns a new TravelMatrix restricted to the given row/column indices, in that order.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        grid = np.ix_(indices, indices)
+        return TravelMatrix(self.distances[grid], self.durations[grid])
+
+    def save(self, path):
+        """
+        Writes both arrays into a single .npy file of shape (2, N, N), loadable with `load(path, mmap=True)`.
+        """
+        np.save(path, np.stack([self.distances, self.durations]))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a matrix written by save().
+        Args:
+            path: Path to the .npy file.
+            mmap: If True, the arrays are memory-mapped read-only instead of read into memory,
+                  so processes loading the same file share the OS page cache.
+        """
+        stacked = np.load(path, mmap_mode='r' if mmap else None)
+        return cls(stacked[0], stacked[1])
+
+    def __repr__(self):
+        return f"<TravelMatrix {self.size}x{self.size} ({self.nbytes} bytes)>"
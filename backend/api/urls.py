@@ -17,9 +17,15 @@ router.register(r'user-profiles', views.UserProfileViewSet, basename='userprofil
 urlpatterns = [
     # Specific function-based views first
     path('routes/plan/', views.plan_routes_view, name='plan-routes'),
+    path('routes/plan/batch/', views.plan_batch_view, name='plan-batch'),
+    path('routes/fleet-sweep/', views.fleet_sweep_view, name='fleet-sweep'),
+    path('routes/plan/jobs/<int:pk>/', views.planning_job_detail_view, name='planning-job-detail'),
+    path('routes/plan/jobs/<int:pk>/stream/', views.planning_job_stream_view, name='planning-job-stream'),
+    path('routes/insert-task/', views.insert_task_view, name='insert-task'),
     path('locations/import/', views.import_locations_csv, name='import-locations-csv'),
     path('routes/<int:pk>/update_status/', views.update_route_status_view, name='update-route-status'),
     path('maintenance/stats/', views.maintenance_stats_view, name='maintenance-stats'),
+    path('metrics/matrix-cache/', views.matrix_cache_stats_view, name='matrix-cache-stats'),
     # Then include the router URLs
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,23 +1,38 @@
 from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from django.utils.translation import gettext_lazy as _
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes, parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser
 from django_filters.rest_framework import DjangoFilterBackend
+import asyncio
 import csv
 import io
+import json
+import os
+import time
 from django.db.models import Count, Avg, Sum, F, ExpressionWrapper, FloatField
 from django.utils import timezone
 from datetime import timedelta
 
-from .models import Location, UserProfile, VehicleType, Vehicle, Task, Route, RouteStop, MaintenanceType, MaintenanceLog
+from .models import Location, UserProfile, VehicleType, Vehicle, Task, Route, RouteStop, MaintenanceType, MaintenanceLog, PlanningJob
 from .serializers import (
     LocationSerializer, UserProfileSerializer, VehicleTypeSerializer, 
     VehicleSerializer, TaskSerializer, TaskBasicSerializer, RouteSerializer, 
-    RouteStopSerializer, MaintenanceTypeSerializer, MaintenanceLogSerializer
+    RouteStopSerializer, MaintenanceTypeSerializer, MaintenanceLogSerializer,
+    PlanningJobSerializer
 )
-from .vrp_solver import solve_vrp
+from .vrp_solver import distance_matrix_cache, solution_cache
+from .batch_planning import execute_batch_plan
+from .fleet_sizing import execute_fleet_sweep
+from .insertion import InsertionError, insert_task
+from .planning import REQUIRED_PLAN_FIELDS, missing_plan_fields, execute_plan, resolve_drop_penalty
+from .planning_jobs import FINISHED_JOB_STATUSES, cancel_planning_job, enqueue_planning_job
+from .search_options import SearchOptionsError, parse_boolean, resolve_portfolio_options, resolve_search_options
+from . import shared_matrices
 
 # Create your views here.
 
@@ -103,121 +118,255 @@ def plan_routes_view(request):
         "depot_id": 1,
         "task_ids": [1, 2, 5, 8],
         "vehicle_ids": [1, 3],
-        "date": "YYYY-MM-DD" # The date for which to plan
+        "date": "YYYY-MM-DD", # The date for which to plan
+        "matrix_provider": "google", # Optional: google, cache, haversine or chained
+        "search_profile": "preview", # Optional: preview, standard, overnight (settings.VRP_SEARCH_PROFILES)
+        # Optional overrides of the profile:
+        "first_solution_strategy": "PATH_CHEAPEST_ARC",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+        "time_limit_seconds": 5,
+        "solution_limit": 100,
+        "log_search": false,
+        "random_seed": 7,
+        "num_neighbors": 40, # Successors kept per stop (sparse successor graph)
+        "symmetry_breaking": "ordered_usage", # Identical vehicles: ordered_usage, fixed_cost_tiers or none
+        "reoptimize": false, # Optional: if true, re-plan the date's current routes from this depot together with these tasks
+        "decompose": null, # Optional: force (true) or disable (false) regional decomposition of large plans
+        "portfolio": false, # Optional: true (or a list of option overrides) runs several searches in parallel, keeps the best
+        "drop_penalty": 1000000, # Optional: cost of leaving a task unplanned (0: every task is mandatory)
+        "dry_run": false, # Optional: if true, return the planned routes without saving them (tasks stay PENDING)
+        "async": false # Optional: if true, enqueue a planning job and return 202 with its id
     }
     """
-    required_fields = ["depot_id", "task_ids", "vehicle_ids", "date"]
-    if not all(field in request.data for field in required_fields):
+    missing = missing_plan_fields(request.data)
+    if missing:
         return Response(
-            {"error": f"Missing required fields: {required_fields}"},
+            {"error": f"Missing required fields: {REQUIRED_PLAN_FIELDS}"},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    depot_id = request.data.get("depot_id")
-    task_ids = request.data.get("task_ids", [])
-    vehicle_ids = request.data.get("vehicle_ids", [])
-    plan_date_str = request.data.get("date") # Keep as string for now
+    # Reject invalid search options now rather than in a background worker
+    try:
+        resolve_search_options(request.data)
+        resolve_portfolio_options(request.data)
+        resolve_drop_penalty(request.data)
+        parse_boolean(request.data.get("reoptimize"), 'reoptimize')
+        parse_boolean(request.data.get("dry_run"), 'dry_run')
+        if request.data.get("decompose") is not None:
+            parse_boolean(request.data["decompose"], 'decompose')
+        run_async = parse_boolean(request.data.get("async"), 'async')
+    except SearchOptionsError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Long plans can run in a background worker instead of holding this web worker
+    if run_async:
+        job = enqueue_planning_job(request.data, user=request.user)
+        return Response(
+            PlanningJobSerializer(job, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    payload, http_status = execute_plan(request.data)
+    return Response(payload, status=http_status)
 
-    # --- Fetch Data ---
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAuthenticatedOrReadOnlyForTesting])
+def planning_job_detail_view(request, pk):
+    """
+    GET: Returns the status, progress and (once finished) the result of a background planning job.
+    DELETE: Cancels the job. A queued job is cancelled immediately (200); a running solve is asked
+    to stop (202) and its worker saves the best routes found so far. Finished jobs return 409.
+    """
     try:
-        depot = Location.objects.get(pk=depot_id, type=Location.LocationType.CEDIS)
-        # Fetch only PENDING tasks for the specified IDs
-        tasks_to_plan = list(Task.objects.filter(pk__in=task_ids, status=Task.TaskStatus.PENDING))
-        # Fetch only AVAILABLE vehicles for the specified IDs
-        available_vehicles = list(Vehicle.objects.filter(pk__in=vehicle_ids, is_available=True))
-
-        if not tasks_to_plan:
-            return Response({"warning": "No pending tasks found for the given IDs."}, status=status.HTTP_400_BAD_REQUEST)
-        if not available_vehicles:
-            return Response({"warning": "No available vehicles found for the given IDs."}, status=status.HTTP_400_BAD_REQUEST)
-
-    except Location.DoesNotExist:
-        return Response({"error": f"Depot location with ID {depot_id} not found or is not a CEDIS."}, status=status.HTTP_404_NOT_FOUND)
-    except Vehicle.DoesNotExist: # Should not happen with filter but good practice
-         return Response({"error": "One or more specified vehicles not found."}, status=status.HTTP_404_NOT_FOUND)
-    except Task.DoesNotExist: # Should not happen with filter but good practice
-         return Response({"error": "One or more specified tasks not found."}, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
-         return Response({"error": f"Error fetching data: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        job = PlanningJob.objects.get(pk=pk)
+    except PlanningJob.DoesNotExist:
+        return Response({"error": "Planning job not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'DELETE':
+        if not cancel_planning_job(job):
+            return Response({"error": f"Planning job {pk} has already finished."}, status=status.HTTP_409_CONFLICT)
+        job.refresh_from_db()
+        http_status = status.HTTP_200_OK if job.status == PlanningJob.JobStatus.CANCELLED else status.HTTP_202_ACCEPTED
+        return Response(PlanningJobSerializer(job, context={'request': request}).data, status=http_status)
+
+    return Response(PlanningJobSerializer(job, context={'request': request}).data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticatedOrReadOnlyForTesting])
+def plan_batch_view(request):
+    """
+    Plans several depots and dates in one request. Plans of the same date that list the same vehicle
+    share it and are solved as one multi-depot problem; all other problems are solved concurrently
+    in a process pool with one shared distance matrix.
+    Expects POST data like:
+    {
+        "plans": [
+            {"depot_id": 1, "date": "YYYY-MM-DD", "task_ids": [1, 2], "vehicle_ids": [1, 2]},
+            {"depot_id": 2, "date": "YYYY-MM-DD", "task_ids": [5, 8], "vehicle_ids": [2, 3]}
+        ],
+        "vehicle_depots": {"2": {"start_depot_id": 1, "end_depot_id": 2}}, # Optional: default is the first plan's depot
+        "matrix_provider": "google", # Optional: as for plan_routes_view, like the search options and drop_penalty
+        "async": false # Optional: if true, enqueue a planning job and return 202 with its id
+    }
+    """
+    # Reject invalid search options now rather than in a background worker
+    try:
+        resolve_search_options(request.data)
+        resolve_drop_penalty(request.data)
+        run_async = parse_boolean(request.data.get("async"), 'async')
+    except SearchOptionsError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if run_async:
+        job = enqueue_planning_job(request.data, user=request.user)
+        return Response(
+            PlanningJobSerializer(job, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    payload, http_status = execute_batch_plan(request.data)
+    return Response(payload, status=http_status)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticatedOrReadOnlyForTesting])
+def fleet_sweep_view(request):
+    """
+    Fleet-sizing what-if: solves one task set with varying numbers of vehicles per VehicleType, in
+    parallel processes on one distance matrix, and returns a cost/coverage curve. No routes are saved.
+    Expects POST data like:
+    {
+        "depot_id": 1,
+        "date": "YYYY-MM-DD", # Or "task_ids": [1, 2, 3]; tasks of any status, e.g. a past peak day
+        "vehicle_ids": [1, 2, 3, 4], # Optional: candidate pool, default all available vehicles
+        "sweep": "per_type", # Optional: "per_type" (vary one type, others at full count) or "joint" (all combinations)
+        "counts": {"2": [2, 4, 6]}, # Optional: counts to try per vehicle type id
+        "scenarios": [{"vehicle_counts": {"1": 3, "2": 1}, "time_limit_seconds": 60}], # Optional: instead of a sweep
+        "matrix_provider": "google", # Optional: as for plan_routes_view, like the search options and drop_penalty
+        "async": false # Optional: if true, enqueue a planning job and return 202 with its id
+    }
+    The response has min_vehicles_per_type, smallest_fleets, the curve (best scenario per fleet size)
+    and every scenario's coverage, distance and dropped tasks.
+    """
+    # Reject invalid search options now rather than in a background worker
+    try:
+        resolve_search_options(request.data)
+        resolve_drop_penalty(request.data)
+        run_async = parse_boolean(request.data.get("async"), 'async')
+    except SearchOptionsError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if run_async:
+        job = enqueue_planning_job(dict(request.data.items(), fleet_sweep=True), user=request.user)
+        return Response(
+            PlanningJobSerializer(job, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    payload, http_status = execute_fleet_sweep(request.data)
+    return Response(payload, status=http_status)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticatedOrReadOnlyForTesting])
+def insert_task_view(request):
+    """
+    Inserts one PENDING task into the cheapest feasible position of a date's planned routes,
+    without re-running the solver (milliseconds instead of a full solve).
+    Expects POST data like:
+    {
+        "task_id": 12,
+        "date": "YYYY-MM-DD", # Optional: defaults to the task's required date
+        "matrix_provider": "cache" # Optional: google, cache, haversine or chained
+    }
+    Returns 409 if no route can take the task; re-optimize the date's routes instead (plan with "reoptimize": true).
+    """
+    task_id = request.data.get("task_id")
+    if task_id is None:
+        return Response({"error": "Missing required field: task_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-    # --- Call Solver ---
     try:
-        # TODO: Pass plan_date_str to solver if needed for multi-day or date-specific logic
-        solution = solve_vrp(depot, tasks_to_plan, available_vehicles)
-    except ValueError as e: # Catch specific errors like missing API key
+        result = insert_task(task_id, plan_date_str=request.data.get("date"),
+                             matrix_provider_name=request.data.get("matrix_provider"))
+    except InsertionError as e:
+        return Response({"error": str(e)}, status=e.status_code)
+    except ValueError as e: # e.g. unknown matrix provider or missing API key
         return Response({"error": f"Solver configuration error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     except Exception as e:
-        # Log the full error details here
-        print(f"Unhandled solver error: {e}")
-        return Response({"error": f"An unexpected error occurred during route planning: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-    # --- Process Solution ---
-    if solution and solution.get('routes'):
-        try:
-            with transaction.atomic(): # Ensure all DB changes succeed or fail together
-                created_routes = []
-                assigned_task_ids = set()
-
-                for route_data in solution['routes']:
-                    vehicle = Vehicle.objects.get(pk=route_data['vehicle_id'])
-                    # Create Route object
-                    new_route = Route.objects.create(
-                        vehicle=vehicle,
-                        planned_date=plan_date_str, # Store the planned date
-                        status=Route.RouteStatus.ASSIGNED, # Mark as assigned
-                        total_distance_km=route_data['total_distance_meters'] / 1000.0,
-                        total_duration_mins=round(route_data['total_duration_seconds'] / 60.0),
-                        # Add start/end times later if calculated by solver
-                    )
-                    created_routes.append(new_route.id)
-
-                    # Create RouteStop objects
-                    for i, stop_data in enumerate(route_data['stops']):
-                        location = Location.objects.get(pk=stop_data['location_id'])
-                        RouteStop.objects.create(
-                            route=new_route,
-                            location=location,
-                            sequence_order=i,
-                            stop_type=stop_data['type'],
-                            # TODO: Convert seconds back to DateTime based on plan_date_str + seconds
-                            # estimated_arrival_time=...,
-                            # estimated_departure_time=...,
-                            # Add load changes etc. later
-                        )
-                        # Mark associated task as assigned
-                        if stop_data['task_id']:
-                            assigned_task_ids.add(stop_data['task_id'])
-
-                # Update status of assigned tasks
-                Task.objects.filter(pk__in=assigned_task_ids).update(
-                    status=Task.TaskStatus.ASSIGNED,
-                    route=new_route # WARNING: This assigns ALL tasks to the LAST route created. Needs fix!
-                    # TODO: Fix task assignment - link task to the specific route it belongs to.
-                    # The solver output needs to associate tasks with specific routes/vehicles.
-                    # For now, just update status. Route linking needs refinement.
-                )
-                Task.objects.filter(pk__in=assigned_task_ids).update(status=Task.TaskStatus.ASSIGNED)
-
-
-            # Include the detailed solution routes in the response
-            return Response({
-                "message": "Routes planned successfully.",
-                "created_route_ids": created_routes,
-                "assigned_task_ids": list(assigned_task_ids),
-                "planned_routes": solution.get('routes', []), # Add the detailed routes here
-                # "dropped_task_ids": solution.get('dropped_tasks', []) # Add later
-            }, status=status.HTTP_201_CREATED)
-
-        except Exception as e:
-            # Log the error
-            print(f"Error saving solution to database: {e}")
-            return Response({"error": f"Failed to save planned routes: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    else:
-        # Handle case where solver runs but finds no solution
-        return Response({
-            "message": "No feasible routes found for the given tasks and vehicles.",
-            # "dropped_task_ids": tasks_to_plan # Assume all tasks dropped if no routes
-            }, status=status.HTTP_200_OK) # 200 OK, but indicate no solution found
+        print(f"Unhandled task insertion error: {e}")
+        return Response({"error": f"An unexpected error occurred during task insertion: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return Response(result, status=status.HTTP_200_OK)
+
+
+# Seconds between database polls of a streamed job, and between keep-alive comments
+JOB_STREAM_POLL_SECONDS = 0.5
+JOB_STREAM_KEEPALIVE_SECONDS = 15
+
+
+def _sse_event(event, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def _planning_job_events(job_id):
+    """Yields SSE events for a planning job until it finishes: progress, each new best solution and done."""
+    last_progress = None
+    last_solution_number = None
+    last_sent = time.monotonic()
+    while True:
+        job = await PlanningJob.objects.filter(pk=job_id).values(
+            'status', 'progress', 'best_solution', 'result', 'result_status_code', 'error').afirst()
+        if job is None:
+            yield _sse_event('error', {"error": "Planning job not found."})
+            return
+
+        events = []
+        if job['progress'] != last_progress:
+            last_progress = job['progress']
+            events.append(_sse_event('progress', {"status": job['status'], **(job['progress'] or {})}))
+        best_solution = job['best_solution']
+        if best_solution and best_solution.get('solution_number') != last_solution_number:
+            last_solution_number = best_solution.get('solution_number')
+            events.append(_sse_event('solution', best_solution))
+        if job['status'] in FINISHED_JOB_STATUSES:
+            events.append(_sse_event('done', {
+                "status": job['status'],
+                "result_status_code": job['result_status_code'],
+                "result": job['result'],
+                "error": job['error'],
+            }))
+
+        for event in events:
+            yield event
+        if job['status'] in FINISHED_JOB_STATUSES:
+            return
+
+        now = time.monotonic()
+        if events:
+            last_sent = now
+        elif now - last_sent >= JOB_STREAM_KEEPALIVE_SECONDS:
+            last_sent = now
+            yield ": keep-alive\n\n" # SSE comment, keeps proxies from closing an idle connection
+        await asyncio.sleep(JOB_STREAM_POLL_SECONDS)
+
+
+@require_GET
+async def planning_job_stream_view(request, pk):
+    """
+    Streams a background planning job as Server-Sent Events (text/event-stream):
+    'progress' on every progress update, 'solution' with each improving solution found
+    by the solver (anytime solving), and a final 'done' event with the result.
+    Read-only like the job detail endpoint. Streaming needs the ASGI server (vrp_core/asgi.py);
+    under WSGI the response is only sent once the job finishes, so poll the detail endpoint instead.
+    """
+    if not await PlanningJob.objects.filter(pk=pk).aexists():
+        return JsonResponse({"error": "Planning job not found."}, status=status.HTTP_404_NOT_FOUND)
+    response = StreamingHttpResponse(_planning_job_events(pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Disable proxy buffering (nginx)
+    return response
 
 
 # --- CSV Import Endpoint ---
@@ -535,3 +684,21 @@ def calculate_percentage_change(old_value, new_value):
     
     change = ((new_value - old_value) / old_value) * 100
     return round(change)
+
+
+# --- Metrics Endpoints ---
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def matrix_cache_stats_view(request):
+    """
+    Returns the in-memory distance matrix cache counters of the worker serving the request
+    (hits, misses, evictions, expirations, bytes held). Each worker process has its own cache.
+    Also lists the matrix segments shared between workers, if shared mode is enabled,
+    and the counters of the worker's solution cache.
+    """
+    stats = distance_matrix_cache.stats()
+    stats['pid'] = os.getpid()
+    stats['shared_segments'] = shared_matrices.list_segments()
+    stats['solution_cache'] = solution_cache.stats()
+    return Response(stats)
@@ -2,90 +2,390 @@
 Core VRP Solver using Google OR-Tools and Google Maps API.
 """
 import googlemaps
+import numpy as np
+import requests
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
-import time # Added for caching timestamp
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from .models import Location, Vehicle, Task # Import necessary models
+from . import matrix_store, shared_matrices
+from .matrix_providers import get_matrix_provider
+from .travel_matrix import TravelMatrix
+from .matrix_cache import MatrixCache
+from .single_flight import SingleFlight, fetch_lease, lease_key
+from .search_options import build_search_parameters, resolve_search_options
+from .solution_cache import SolutionCache, solution_cache_key, solution_references
 
 # TODO: Add error handling and logging
 
-# Simple in-memory cache for distance matrix results
-distance_matrix_cache = {}
-CACHE_DURATION_SECONDS = 3600 # Cache results for 1 hour
+# Bounded in-memory LRU cache for distance matrix results (budget and TTL from settings)
+distance_matrix_cache = MatrixCache()
+# Coalesces concurrent builds of the same matrix within this process
+_matrix_single_flight = SingleFlight()
+# Bounded in-memory LRU cache of solver results, keyed by the hash of the solver input
+solution_cache = SolutionCache()
+UNREACHABLE_COST = 999999999 # Represents a very high cost/time for pairs without a route
+# Time dimension limits: waiting time (slack) allowed at a stop, and the cap on any route time
+# (time dimension cumul, in seconds)
+SLACK_MAX_SECONDS = 24 * 3600
+MAX_ROUTE_DURATION_SECONDS = 10 * 3600
+# Time allowed to extend the current routes with new tasks when warm-starting a re-optimization
+WARM_START_TIME_LIMIT_SECONDS = 10
+# Sparse successor graph: successors kept per node (None = full graph), and the model size (nodes)
+# from which the configured count is used
+DEFAULT_NEIGHBOR_COUNT = None
+DEFAULT_NEIGHBOR_GRAPH_MIN_NODES = 200
+# Cost of leaving a task unplanned (in the objective's unit, meters); 0 makes every task mandatory
+DEFAULT_TASK_DROP_PENALTY = 1000000
+# Fixed cost step between consecutive vehicles of a group with 'fixed_cost_tiers' symmetry breaking:
+# small enough that route distance always dominates, large enough to make equal plans unequal
+SYMMETRY_FIXED_COST_STEP = 1
+DEFAULT_COORDINATE_SNAP_DECIMALS = 5 # ~1.1 m; locations closer than this share a matrix node
+
+# Distance Matrix API per-request limits (standard plan)
+MAX_ORIGINS_PER_REQUEST = 25
+MAX_DESTINATIONS_PER_REQUEST = 25
+MAX_ELEMENTS_PER_REQUEST = 100
+# Defaults for concurrent fetching, overridable in Django settings
+DEFAULT_MATRIX_MAX_WORKERS = 8
+DEFAULT_MATRIX_ELEMENTS_PER_SECOND = 1000
+DEFAULT_MATRIX_MAX_RETRIES = 5
+DEFAULT_MATRIX_BACKOFF_BASE_SECONDS = 0.5
+
+# Shared Google Maps client and request pool, created once per process
+_gmaps_client = None
+_matrix_executor = None
+_matrix_rate_limiter = None
+_client_lock = threading.Lock()
+
+
+class ElementRateLimiter:
+    """
+    Thread-safe token bucket limiting Distance Matrix elements per second.
+    """
+    def __init__(self, elements_per_second):
+        self.rate = float(elements_per_second)
+        self.capacity = float(elements_per_second)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, elements):
+        """Blocks until `elements` tokens are available."""
+        elements = min(float(elements), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= elements:
+                    self.tokens -= elements
+                    return
+                wait_seconds = (elements - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
 
 def get_google_maps_client():
-    """Initializes and returns a Google Maps client."""
+    """Returns the process-wide Google Maps client, initializing it (and its pooled HTTP session) on first use."""
+    global _gmaps_client
     # Ensure GOOGLE_MAPS_API_KEY is set in Django settings
     if not hasattr(settings, 'GOOGLE_MAPS_API_KEY') or not settings.GOOGLE_MAPS_API_KEY:
         raise ValueError("GOOGLE_MAPS_API_KEY not configured in Django settings.")
-    return googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY)
+    with _client_lock:
+        if _gmaps_client is None:
+            # Size the connection pool to the number of concurrent matrix requests
+            max_workers = getattr(settings, 'DISTANCE_MATRIX_MAX_WORKERS', DEFAULT_MATRIX_MAX_WORKERS)
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+            session.mount('https://', adapter)
+            # OVER_QUERY_LIMIT retries are handled by _request_with_backoff
+            _gmaps_client = googlemaps.Client(
+                key=settings.GOOGLE_MAPS_API_KEY,
+                requests_session=session,
+                retry_over_query_limit=False)
+        return _gmaps_client
+
+
+def _get_matrix_executor():
+    """Returns the bounded thread pool shared by all matrix fetches in this process."""
+    global _matrix_executor, _matrix_rate_limiter
+    with _client_lock:
+        if _matrix_executor is None:
+            max_workers = getattr(settings, 'DISTANCE_MATRIX_MAX_WORKERS', DEFAULT_MATRIX_MAX_WORKERS)
+            elements_per_second = getattr(
+                settings, 'DISTANCE_MATRIX_ELEMENTS_PER_SECOND', DEFAULT_MATRIX_ELEMENTS_PER_SECOND)
+            _matrix_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='distance-matrix')
+            _matrix_rate_limiter = ElementRateLimiter(elements_per_second)
+        return _matrix_executor
+
+
+def _tile_block(origin_indices, destination_indices):
+    """
+    Splits a block of the matrix into tiles that fit the per-request API limits,
+    choosing the tile shape that needs the fewest requests.
+    Returns:
+        A list of (origin_indices, destination_indices) tuples.
+    """
+    num_origins = len(origin_indices)
+    num_destinations = len(destination_indices)
+    best_shape = None
+    for rows in range(1, min(num_origins, MAX_ORIGINS_PER_REQUEST) + 1):
+        cols = min(num_destinations, MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST // rows)
+        num_requests = -(-num_origins // rows) * -(-num_destinations // cols)
+        if best_shape is None or num_requests < best_shape[0]:
+            best_shape = (num_requests, rows, cols)
+    _, rows, cols = best_shape
+
+    return [
+        (origin_indices[i:i + rows], destination_indices[j:j + cols])
+        for i in range(0, num_origins, rows)
+        for j in range(0, num_destinations, cols)
+    ]
+
+
+def _request_with_backoff(client, origins, destinations):
+    """
+    Calls the Distance Matrix API, retrying with exponential backoff (plus jitter)
+    on OVER_QUERY_LIMIT and transient transport errors.
+    """
+    max_retries = getattr(settings, 'DISTANCE_MATRIX_MAX_RETRIES', DEFAULT_MATRIX_MAX_RETRIES)
+    backoff_base = getattr(settings, 'DISTANCE_MATRIX_BACKOFF_BASE_SECONDS', DEFAULT_MATRIX_BACKOFF_BASE_SECONDS)
+    attempt = 0
+    while True:
+        if _matrix_rate_limiter is not None:
+            _matrix_rate_limiter.acquire(len(origins) * len(destinations))
+        try:
+            return client.distance_matrix(origins=origins, destinations=destinations, mode="driving")
+        except (googlemaps.exceptions.ApiError, googlemaps.exceptions.Timeout, googlemaps.exceptions.TransportError) as e:
+            retriable = not isinstance(e, googlemaps.exceptions.ApiError) or e.status == 'OVER_QUERY_LIMIT'
+            if not retriable or attempt >= max_retries:
+                raise
+            delay = backoff_base * (2 ** attempt) + random.uniform(0, backoff_base)
+            print(f"Distance Matrix request failed ({e}). Retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries}).")
+            time.sleep(delay)
+            attempt += 1
+
+
+def _fetch_cells(client, addresses, origin_indices, destination_indices):
+    """
+    Requests one tile of the matrix from the Distance Matrix API.
+    Args:
+        client: Initialized googlemaps.Client instance.
+        addresses: The full list of (lat, lng) tuples.
+        origin_indices: Indices (into addresses) of the tile's origins.
+        destination_indices: Indices (into addresses) of the tile's destinations.
+    Returns:
+        A dict mapping (origin_index, destination_index) to (distance_meters, duration_seconds).
+    """
+    matrix = _request_with_backoff(
+        client,
+        [addresses[i] for i in origin_indices],
+        [addresses[j] for j in destination_indices])
+    # TODO: Handle potential errors from the API response (e.g., ZERO_RESULTS)
+
+    cells = {}
+    for row, i in enumerate(origin_indices):
+        elements = matrix['rows'][row]['elements']
+        for col, j in enumerate(destination_indices):
+            element = elements[col]
+            if element['status'] == 'OK':
+                cells[(i, j)] = (element['distance']['value'], element['duration']['value']) # meters, seconds
+            else:
+                # Handle cases where a route is not found (e.g., set a very high cost)
+                # Using a large number is better for the solver than 0
+                print(f"Warning: Could not find route between {addresses[i]} and {addresses[j]}. Status: {element['status']}")
+                cells[(i, j)] = (UNREACHABLE_COST, UNREACHABLE_COST)
+    return cells
+
+
+def _group_missing_cells(missing_by_origin):
+    """
+    Groups origins that miss the same destinations into rectangular request blocks.
+    Adding one new location to a known set yields two blocks: the new row and the new column.
+    Args:
+        missing_by_origin: A dict mapping origin index to the list of missing destination indices.
+    Returns:
+        A list of (origin_indices, destination_indices) tuples.
+    """
+    blocks = {}
+    for origin_idx, destination_indices in missing_by_origin.items():
+        blocks.setdefault(tuple(destination_indices), []).append(origin_idx)
+    return [(origin_indices, list(destination_indices)) for destination_indices, origin_indices in blocks.items()]
+
+
+def _load_known_cells(addresses, address_keys):
+    """
+    Reads the cells already in the persistent pair store shared by all workers.
+    Returns:
+        A tuple (known_cells, missing_by_origin): known_cells maps (i, j) to (distance, duration),
+        missing_by_origin maps origin index i to the list of destination indices still unknown.
+    """
+    try:
+        stored_cells = matrix_store.load_cells(addresses)
+    except Exception as e:
+        print(f"Warning: Could not read persistent distance matrix store: {e}")
+        stored_cells = {}
+
+    known_cells = {}
+    missing_by_origin = {}
+    for i, origin_key in enumerate(address_keys):
+        for j, destination_key in enumerate(address_keys):
+            cell = stored_cells.get((origin_key, destination_key))
+            if cell is not None:
+                known_cells[(i, j)] = cell
+            else:
+                missing_by_origin.setdefault(i, []).append(j)
+    return known_cells, missing_by_origin
+
+
+def _fetch_missing_cells(client, addresses, address_keys, missing_by_origin):
+    """
+    Fetches the missing cells from the API (tiled, concurrently) and persists them.
+    Returns:
+        A dict mapping (i, j) to (distance_meters, duration_seconds) for the fetched cells.
+    """
+    blocks = _group_missing_cells(missing_by_origin)
+    tiles = [tile for origin_indices, destination_indices in blocks
+             for tile in _tile_block(origin_indices, destination_indices)]
+    missing_count = sum(len(o) * len(d) for o, d in blocks)
+    print(f"Calling Google Maps API for {missing_count} missing elements in {len(tiles)} request(s).")
+
+    # Run the tiles concurrently on the shared, bounded pool
+    executor = _get_matrix_executor()
+    futures = [
+        executor.submit(_fetch_cells, client, addresses, origin_indices, destination_indices)
+        for origin_indices, destination_indices in tiles
+    ]
+    fetched_cells = {}
+    for future in futures:
+        fetched_cells.update(future.result())
+
+    # Persist the new pairs so other workers (and later deploys) can reuse them
+    try:
+        matrix_store.save_cells({
+            (address_keys[i], address_keys[j]): cell for (i, j), cell in fetched_cells.items()
+        })
+    except Exception as e:
+        print(f"Warning: Could not write to persistent distance matrix store: {e}")
+    return fetched_cells
+
+
+def prefetch_matrix_rows(client, addresses, origin_indices):
+    """
+    Makes sure the persistent store holds the cells from the given origins to every address,
+    fetching only the missing ones. Used to warm the store without building a full matrix.
+    Args:
+        client: Initialized googlemaps.Client instance.
+        addresses: A list of (lat, lng) tuples.
+        origin_indices: Indices (into addresses) of the rows to prefetch.
+    Returns:
+        The number of elements requested from the API.
+    """
+    address_keys = [matrix_store.coordinate_key(addr) for addr in addresses]
+    stored_cells = matrix_store.load_cells([addresses[i] for i in origin_indices], addresses)
+    missing_by_origin = {}
+    for i in origin_indices:
+        missing = [j for j, destination_key in enumerate(address_keys)
+                   if (address_keys[i], destination_key) not in stored_cells]
+        if missing:
+            missing_by_origin[i] = missing
+    if not missing_by_origin:
+        return 0
+    return len(_fetch_missing_cells(client, addresses, address_keys, missing_by_origin))
+
 
 def create_distance_matrix(client, addresses):
     """
     Calculates the distance and duration matrix using Google Maps API, with caching.
+    Cells already known (in the persistent store) are reused; only the missing
+    rows/columns are requested from the API. Concurrent requests for the same
+    addresses are coalesced, within this process and across worker processes.
     Args:
         client: Initialized googlemaps.Client instance.
-        addresses: A list of address strings or (lat, lng) tuples.
+        addresses: A list of (lat, lng) tuples.
     Returns:
-        A tuple containing two lists of lists: (distance_matrix, duration_matrix).
+        A TravelMatrix (int32 distance and duration arrays, unpackable as a tuple).
         Distances are in meters, durations are in seconds.
     """
-    # Create a stable cache key from sorted addresses (assuming addresses are hashable tuples like lat/lng)
-    # Convert list of tuples to tuple of tuples for hashing
+    # Create a cache key from the addresses (assuming addresses are hashable tuples like lat/lng)
+    # Convert list of tuples to tuple of tuples for hashing. The key keeps the input order,
+    # since the cached matrices are indexed in that order.
     try:
-        # Ensure addresses are tuples if they aren't already, then sort
-        sorted_addresses = tuple(sorted(tuple(addr) for addr in addresses))
+        # Ensure addresses are tuples if they aren't already
+        addresses_key = tuple(tuple(addr) for addr in addresses)
     except TypeError:
         # Handle cases where addresses might not be directly sortable/hashable (e.g., complex objects)
         # For simplicity, we'll skip caching if the key can't be made easily.
-        # A more robust solution might involve using IDs or a custom hashing function.
         print("Warning: Could not create cache key for addresses. Skipping cache.")
-        sorted_addresses = None
+        addresses_key = None
 
-    current_time = time.time()
-
-    # Check cache first
-    if sorted_addresses and sorted_addresses in distance_matrix_cache:
-        cached_time, cached_dist_matrix, cached_dur_matrix = distance_matrix_cache[sorted_addresses]
-        if current_time - cached_time < CACHE_DURATION_SECONDS:
+    # Check cache first (expired entries are dropped by the cache itself)
+    if addresses_key:
+        cached_matrix = distance_matrix_cache.get(addresses_key)
+        if cached_matrix is not None:
             print(f"Cache hit for {len(addresses)} addresses. Using cached distance matrix.")
-            return cached_dist_matrix, cached_dur_matrix
-        else:
-            print(f"Cache expired for {len(addresses)} addresses.")
-            # Remove expired entry
-            del distance_matrix_cache[sorted_addresses]
+            return cached_matrix
+        # Threads asking for the same addresses share one build
+        return _matrix_single_flight.do(addresses_key, lambda: _build_distance_matrix(client, addresses, addresses_key))
+    return _build_distance_matrix(client, addresses, addresses_key)
+
+
+def _build_distance_matrix(client, addresses, addresses_key):
+    """Builds the matrix from the persistent store and the API. See create_distance_matrix."""
+    # A thread that waited on the single flight may find the result already cached
+    # (peek: the caller's lookup was already counted as a miss)
+    if addresses_key:
+        cached_matrix = distance_matrix_cache.peek(addresses_key)
+        if cached_matrix is not None:
+            return cached_matrix
+
+    # Attach zero-copy to a matrix another worker already published (shared mode only)
+    shared_matrix = shared_matrices.attach(addresses)
+    if shared_matrix is not None:
+        print(f"Attached shared matrix segment for {len(addresses)} addresses.")
+        if addresses_key:
+            distance_matrix_cache.put(addresses_key, shared_matrix)
+        return shared_matrix
+
+    num_locations = len(addresses)
+    address_keys = [matrix_store.coordinate_key(addr) for addr in addresses]
+    known_cells, missing_by_origin = _load_known_cells(addresses, address_keys)
 
-    print(f"Cache miss or expired. Calling Google Maps API for {len(addresses)} addresses.")
     try:
-        # Call Google Maps API
-        matrix = client.distance_matrix(origins=addresses, destinations=addresses, mode="driving")
-        # TODO: Handle potential errors from the API response (e.g., ZERO_RESULTS)
-
-        num_locations = len(addresses)
-        distance_matrix = [[0] * num_locations for _ in range(num_locations)]
-        duration_matrix = [[0] * num_locations for _ in range(num_locations)]
-
-        for i in range(num_locations):
-            for j in range(num_locations):
-                if matrix['rows'][i]['elements'][j]['status'] == 'OK':
-                    distance_matrix[i][j] = matrix['rows'][i]['elements'][j]['distance']['value'] # meters
-                    duration_matrix[i][j] = matrix['rows'][i]['elements'][j]['duration']['value'] # seconds
+        if missing_by_origin:
+            print(f"Store has {len(known_cells)}/{num_locations * num_locations} cells.")
+            # Only one worker process fetches a given location set; the others wait and re-read the store
+            with fetch_lease(lease_key(address_keys)) as is_leader:
+                if not is_leader:
+                    known_cells, missing_by_origin = _load_known_cells(addresses, address_keys)
+                if missing_by_origin:
+                    known_cells.update(_fetch_missing_cells(client, addresses, address_keys, missing_by_origin))
                 else:
-                    # Handle cases where a route is not found (e.g., set a very high cost)
-                    # For now, let's raise an error or use a large number
-                    print(f"Warning: Could not find route between {addresses[i]} and {addresses[j]}. Status: {matrix['rows'][i]['elements'][j]['status']}")
-                    # Using a large number might be better for the solver than 0
-                    large_number = 999999999 # Represents a very high cost/time
-                    distance_matrix[i][j] = large_number
-                    duration_matrix[i][j] = large_number
+                    print(f"Cells for {num_locations} addresses were fetched by another worker.")
+        else:
+            print(f"Persistent store hit for {num_locations} addresses. No API elements requested.")
+
+        # Fill the int32 arrays in place (no intermediate lists of Python ints)
+        matrix = TravelMatrix.empty(num_locations)
+        for (i, j), (distance, duration) in known_cells.items():
+            matrix.distances[i, j] = distance
+            matrix.durations[i, j] = duration
+
+        # Publish for the other workers and keep the memory-mapped copy instead of a private one
+        if shared_matrices.publish(addresses, matrix) is not None:
+            shared_matrices.purge_expired_segments()
+            matrix = shared_matrices.attach(addresses) or matrix
 
         # Store result in cache if key was created
-        if sorted_addresses:
-            distance_matrix_cache[sorted_addresses] = (current_time, distance_matrix, duration_matrix)
+        if addresses_key:
+            distance_matrix_cache.put(addresses_key, matrix)
             print(f"Stored distance matrix for {len(addresses)} addresses in cache.")
 
-        return distance_matrix, duration_matrix
+        return matrix
     except googlemaps.exceptions.ApiError as e:
         print(f"Google Maps API Error: {e}")
         # Handle API errors appropriately (e.g., raise exception, return None)
@@ -95,13 +395,453 @@ def create_distance_matrix(client, addresses):
         raise
 
 
-def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicle]):
+def merge_colocated_locations(locations, decimals=None):
+    """
+    Snaps coordinates to a grid and merges locations that share a snapped coordinate
+    into a single matrix node (e.g. branches in the same building).
+    Args:
+        locations: A list of unique Location objects. The first one (the depot) becomes node 0.
+        decimals: Decimals kept when rounding lat/lng. Defaults to settings.VRP_COORDINATE_SNAP_DECIMALS
+                  (5 decimals is about 1.1 m).
+    Returns:
+        A tuple (node_locations, location_index_map, addresses):
+        node_locations[i] is the list of Location objects merged into node i,
+        location_index_map maps Location ID to node index,
+        addresses[i] is the snapped (lat, lng) of node i.
+    """
+    if decimals is None:
+        decimals = getattr(settings, 'VRP_COORDINATE_SNAP_DECIMALS', DEFAULT_COORDINATE_SNAP_DECIMALS)
+
+    node_by_coordinate = {}
+    node_locations = []
+    location_index_map = {}
+    addresses = []
+    for loc in locations:
+        coordinate = (round(loc.latitude, decimals), round(loc.longitude, decimals))
+        if coordinate not in node_by_coordinate:
+            node_by_coordinate[coordinate] = len(node_locations)
+            node_locations.append([])
+            addresses.append(coordinate)
+        node_index = node_by_coordinate[coordinate]
+        node_locations[node_index].append(loc)
+        location_index_map[loc.id] = node_index
+    return node_locations, location_index_map, addresses
+
+
+def _location_time_window(loc):
+    """Returns the (start, end) service window of a Location in seconds from midnight."""
+    start_sec = 0
+    end_sec = 86400 # Default to full day
+
+    if loc.opening_time:
+        start_sec = loc.opening_time.hour * 3600 + loc.opening_time.minute * 60 + loc.opening_time.second
+    if loc.closing_time:
+        # Ensure closing time is after opening time, handle overnight if necessary (not done here)
+        end_sec = loc.closing_time.hour * 3600 + loc.closing_time.minute * 60 + loc.closing_time.second
+        if end_sec < start_sec: # Basic check, assumes same day
+             print(f"  - Warning: Location {loc.name} closing time {loc.closing_time} is before opening time {loc.opening_time}. Using full day.")
+             end_sec = 86400
+    return start_sec, end_sec
+
+
+def prescreen_tasks(tasks, vehicles, location_index_map, distance_matrix, time_matrix, service_times,
+                    time_windows, depot_pairs):
+    """
+    Finds tasks that no vehicle can serve, even alone on an otherwise empty route, so they are rejected
+    up front instead of making the whole search fail. Checks, vectorized over all tasks at once:
+    weight/volume against the largest vehicle, road connectivity, and the earliest possible schedule
+    depot -> origin -> destination -> depot against the location time windows and the route time cap.
+    Args:
+        tasks, vehicles: As passed to solve_vrp.
+        location_index_map: Location id to node index.
+        distance_matrix, time_matrix, service_times, time_windows: Node data of the solver model.
+        depot_pairs: The distinct (start node, end node) pairs of the vehicles. A routing check rejects
+                     a task only if it fails for every pair. Depot time windows are not enforced, as in
+                     the routing model.
+    Returns:
+        A list of {'task_id', 'reason'} dicts for the rejected tasks.
+    """
+    if not tasks or not vehicles:
+        return []
+    distances = np.asarray(distance_matrix, dtype=np.int64)
+    durations = np.asarray(time_matrix, dtype=np.int64)
+    service = np.asarray(service_times, dtype=np.int64)
+    window_start = np.array([window[0] for window in time_windows], dtype=np.int64)
+    window_end = np.array([window[1] for window in time_windows], dtype=np.int64)
+    depot_nodes = sorted({node for pair in depot_pairs for node in pair})
+    window_start[depot_nodes], window_end[depot_nodes] = 0, MAX_ROUTE_DURATION_SECONDS
+
+    origins = np.array([location_index_map[task.origin_id] for task in tasks])
+    destinations = np.array([location_index_map[task.destination_id] for task in tasks])
+    weights = np.array([int(task.weight_kg or 0) for task in tasks])
+    volumes = np.array([int(task.volume_m3 or 0) for task in tasks])
+    max_weight = max(int(vehicle.type.max_weight_kg or 0) for vehicle in vehicles)
+    max_volume = max(int(vehicle.type.max_volume_m3 or 0) for vehicle in vehicles)
+
+    # Earliest schedule of a route serving only this task (waiting for a window to open is allowed),
+    # from every start/end depot pair; a check fails only if it fails for all of them
+    same_node = origins == destinations
+    unreachable = origin_late = destination_late = too_long = np.ones(len(tasks), dtype=bool)
+    for start, end in depot_pairs:
+        arrive_origin = np.maximum(durations[start, origins], window_start[origins])
+        arrive_destination = np.where(
+            same_node, arrive_origin,
+            np.maximum(arrive_origin + service[origins] + durations[origins, destinations], window_start[destinations]))
+        back_at_depot = arrive_destination + service[destinations] + durations[destinations, end]
+        unreachable = unreachable & ((distances[start, origins] >= UNREACHABLE_COST)
+                                     | (distances[origins, destinations] >= UNREACHABLE_COST)
+                                     | (distances[destinations, end] >= UNREACHABLE_COST))
+        origin_late = origin_late & (arrive_origin > window_end[origins])
+        destination_late = destination_late & (arrive_destination > window_end[destinations])
+        too_long = too_long & (back_at_depot > MAX_ROUTE_DURATION_SECONDS)
+
+    checks = [
+        (weights > max_weight, lambda task: f"Weight {task.weight_kg} kg exceeds the largest vehicle capacity ({max_weight} kg)."),
+        (volumes > max_volume, lambda task: f"Volume {task.volume_m3} m3 exceeds the largest vehicle capacity ({max_volume} m3)."),
+        (unreachable, lambda task: "No road route connects the depot and the task locations."),
+        (origin_late, lambda task: f"The time window of {task.origin.name} cannot be reached from the depot."),
+        (destination_late,
+         lambda task: f"The time window of {task.destination.name} cannot be reached after serving {task.origin.name}."),
+        (too_long,
+         lambda task: f"The task cannot be completed within the maximum route duration ({MAX_ROUTE_DURATION_SECONDS // 3600} h)."),
+    ]
+    rejected = {}
+    for failed, reason in checks:
+        for position in np.flatnonzero(failed):
+            task = tasks[position]
+            rejected.setdefault(task.id, {'task_id': task.id, 'reason': reason(task)}) # Keep the first reason
+    return list(rejected.values())
+
+
+def build_successor_graph(distance_matrix, time_matrix, service_times, time_windows, depots, num_neighbors,
+                          required_arcs=()):
+    """
+    Builds a sparse successor graph over the matrix nodes: each visit node keeps only its num_neighbors
+    nearest nodes (by distance) that can still be reached inside their time window when leaving it as
+    early as possible, and stays a successor of its num_neighbors nearest such predecessors (so an
+    outlying node, nobody's nearest, can still be inserted after the nodes around it).
+    A truck never drives from one edge of the city to the other between two stops, so pruning the
+    other arcs shrinks the search space from O(N^2) arcs to O(N * k).
+    Args:
+        distance_matrix, time_matrix: Node matrices (meters, seconds).
+        service_times: Service time of each node in seconds.
+        time_windows: (start, end) of each node in seconds.
+        depots: The depot nodes. Their successors are not restricted, and every node may end its route.
+        num_neighbors: Successors kept per node (k).
+        required_arcs: (from_node, to_node) arcs always kept, e.g. pickup -> delivery, or current route arcs.
+    Returns:
+        A list with the sorted successor nodes of each node (None for a depot).
+    """
+    depots = set(depots)
+    num_nodes = len(distance_matrix)
+    window_start = np.array([window[0] for window in time_windows], dtype=np.int64)
+    window_end = np.array([window[1] for window in time_windows], dtype=np.int64)
+    earliest_arrival = (window_start + np.asarray(service_times, dtype=np.int64))[:, np.newaxis] + np.asarray(time_matrix, dtype=np.int64)
+    compatible = earliest_arrival <= window_end[np.newaxis, :]
+    np.fill_diagonal(compatible, False)
+    compatible[:, sorted(depots)] = False # Returning to a depot is allowed separately (route ends)
+    scores = np.where(compatible, np.asarray(distance_matrix, dtype=np.float64), np.inf)
+    num_neighbors = min(num_neighbors, num_nodes - 1)
+    nearest = np.argpartition(scores, num_neighbors - 1, axis=1)[:, :num_neighbors]
+    nearest_predecessors = np.argpartition(scores, num_neighbors - 1, axis=0)[:num_neighbors, :]
+
+    graph = []
+    for node in range(num_nodes):
+        if node in depots:
+            graph.append(None)
+            continue
+        graph.append({int(successor) for successor in nearest[node] if np.isfinite(scores[node, successor])})
+    for node in range(num_nodes):
+        for predecessor in nearest_predecessors[:, node]:
+            if graph[predecessor] is not None and np.isfinite(scores[predecessor, node]):
+                graph[predecessor].add(node)
+    for from_node, to_node in required_arcs:
+        if from_node not in depots and to_node not in depots and from_node != to_node:
+            graph[from_node].add(to_node)
+    return [sorted(successors) if successors is not None else None for successors in graph]
+
+
+def _neighbor_count(search_options, num_nodes):
+    """
+    Returns the number of successors to keep per node, or None to keep the full graph.
+    An explicit num_neighbors search option always applies; otherwise settings.VRP_NEIGHBOR_COUNT
+    (off by default) applies to models of at least settings.VRP_NEIGHBOR_GRAPH_MIN_NODES nodes.
+    """
+    num_neighbors = search_options.get('num_neighbors')
+    if num_neighbors is None:
+        if num_nodes < getattr(settings, 'VRP_NEIGHBOR_GRAPH_MIN_NODES', DEFAULT_NEIGHBOR_GRAPH_MIN_NODES):
+            return None
+        num_neighbors = getattr(settings, 'VRP_NEIGHBOR_COUNT', DEFAULT_NEIGHBOR_COUNT)
+    # Nothing to prune if every node is already a neighbor
+    return num_neighbors if num_neighbors and num_neighbors < num_nodes - 1 else None
+
+
+def vehicle_symmetry_groups(vehicles, initial_routes=None):
+    """
+    Groups interchangeable vehicles for symmetry breaking. Vehicles of the same VehicleType have
+    identical capacities, so any permutation of their routes is an equivalent plan.
+    Args:
+        vehicles: The Vehicle list passed to solve_vrp (defines the vehicle indices).
+        initial_routes: Optional warm-start routes (vehicle id -> location ids). Vehicles with a current
+                        route are ranked first in their group, so the warm start respects the ordering.
+    Returns:
+        Lists of vehicle indices in rank order, one per type with at least two vehicles.
+    """
+    groups = {}
+    for index, vehicle in enumerate(vehicles):
+        groups.setdefault(vehicle.type_id, []).append(index)
+    routed = {vehicle_id for vehicle_id, location_ids in (initial_routes or {}).items() if location_ids}
+    return [sorted(group, key=lambda index: (vehicles[index].id not in routed, index))
+            for group in groups.values() if len(group) > 1]
+
+
+def _build_routing_model(data):
+    """
+    Builds the OR-Tools routing model (transits, time/capacity dimensions, pickup & delivery)
+    from the data model prepared by solve_vrp.
+    Kept separate so the same model can be built more than once (e.g. to construct a warm start).
+    Returns:
+        A tuple (manager, routing, time_dimension).
+    """
+    # --- 4. Create Routing Model ---
+    if data.get('starts'):
+        # Multi-depot: every vehicle starts and ends at its own depot node
+        manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']), data['num_vehicles'],
+                                               data['starts'], data['ends'])
+    else:
+        manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']), data['num_vehicles'], data['depot'])
+    routing = pywrapcp.RoutingModel(manager)
+
+    # --- 5. Define Transits and Dimensions ---
+    # Transits are registered as precomputed node matrices/vectors instead of Python callbacks:
+    # OR-Tools evaluates them millions of times during local search, and native lookups avoid
+    # a C++ -> Python call (plus IndexToNode and nested lookups) on every evaluation.
+
+    # Distance transit
+    transit_callback_index = routing.RegisterTransitMatrix(data['distance_matrix'].tolist())
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # Time transit (Travel Time + Service Time)
+    # Service time is incurred *before* leaving the 'from' node for the 'to' node,
+    # so it is folded into each row of the travel time matrix once, up front.
+    time_with_service = data['time_matrix'].astype(np.int64) + np.asarray(data['service_times'], dtype=np.int64)[:, np.newaxis]
+    time_callback_index = routing.RegisterTransitMatrix(time_with_service.tolist())
+
+    # Time Dimension (for time windows and route duration limits)
+    time_dimension_name = 'Time'
+    # Horizon: max time allowed (e.g., 24 hours in seconds)
+    # TODO: Make horizon configurable (e.g., working day)
+    # Horizon: max time allowed (e.g., 24 hours in seconds) - used for slack calculation
+    slack_max = SLACK_MAX_SECONDS
+    # Max route duration constraint (3 hours in seconds)
+    max_route_duration = MAX_ROUTE_DURATION_SECONDS # Increased from 3 hours to 10 hours
+    routing.AddDimension(
+        time_callback_index,
+        slack_max,  # Allow waiting time (slack) up to horizon
+        max_route_duration,  # Max time per vehicle route (3 hours)
+        False,  # Don't force start cumul to zero, depends on vehicle start time
+        time_dimension_name)
+    time_dimension = routing.GetDimensionOrDie(time_dimension_name)
+
+    # Add time window constraints for each location node
+    for location_idx, time_window in enumerate(data['time_windows']):
+        if location_idx in data['depot_nodes']:
+            continue
+        index = manager.NodeToIndex(location_idx)
+        time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
+
+    # Add time window constraints for the depot (start/end of day)
+    # Example: Start between 8 AM and 9 AM
+    # depot_start_time = 8 * 3600
+    # depot_end_time = 18 * 3600 # Example end time
+    # for i in range(data['num_vehicles']):
+    #     index = routing.Start(i)
+    #     time_dimension.CumulVar(index).SetRange(depot_start_time, depot_end_time) # Adjust as needed
+
+    # Add Driver Break Constraint (30 mins around 2 PM)
+    break_duration = 30 * 60  # 30 minutes in seconds
+    # Define the window when the break *must* occur (e.g., between 1:45 PM and 2:15 PM)
+    # Adjust this window as needed. A wider window gives more flexibility.
+    break_window_start = (13 * 3600) + (45 * 60) # 1:45 PM
+    break_window_end = (14 * 3600) + (15 * 60)   # 2:15 PM
+
+    # Create break intervals for each vehicle
+    break_intervals = []
+    for i in range(data['num_vehicles']):
+        break_interval = routing.solver().FixedDurationIntervalVar(
+            break_window_start,  # earliest start time
+            break_window_end,    # latest start time
+            break_duration,      # duration
+            False,               # optionality (False = mandatory)
+            f'Break for vehicle {i}'
+        )
+        break_intervals.append(break_interval)
+
+    # Add the break constraint to the time dimension for each vehicle individually
+    # node_visit_transits = [time_callback_index] # Transit callback index wrapped in a list
+    # Temporarily commented out break constraint application for debugging
+    # for i in range(data['num_vehicles']):
+    #     # Apply the break interval created earlier for this specific vehicle index 'i'
+    #     vehicle_breaks = [break_intervals[i]] # Get the specific break interval for vehicle i
+    #     time_dimension.SetBreakIntervalsOfVehicle(vehicle_breaks, i, node_visit_transits)
+
+    # print(f"Added mandatory {break_duration/60} min break constraint between {break_window_start}s and {break_window_end}s for all vehicles.") # Commented out print statement as well
+    #     index = routing.End(i)
+    #     time_dimension.CumulVar(index).SetRange(depot_start_time, depot_end_time) # Adjust as needed
+
+
+    # Capacity Dimensions (Weight and Volume), demands registered as per-node vectors
+    demand_callback_weight_index = routing.RegisterUnaryTransitVector(data['demands_weight'])
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_weight_index,
+        0,  # Slack zero - capacity cannot be exceeded
+        data['vehicle_capacities_weight'],
+        True,  # Start cumul to zero
+        'CapacityWeight')
+
+    demand_callback_volume_index = routing.RegisterUnaryTransitVector(data['demands_volume'])
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_volume_index,
+        0,  # Slack zero
+        data['vehicle_capacities_volume'],
+        True,  # Start cumul to zero
+        'CapacityVolume')
+
+    # Pickup and Delivery Constraint
+    for request in data['pickup_delivery_pairs']:
+        pickup_index = manager.NodeToIndex(request[0])
+        delivery_index = manager.NodeToIndex(request[1])
+        routing.AddPickupAndDelivery(pickup_index, delivery_index)
+        # Ensure same vehicle serves both pickup and delivery
+        routing.solver().Add(
+            routing.VehicleVar(pickup_index) == routing.VehicleVar(delivery_index))
+        # Ensure pickup happens before delivery in the time dimension
+        routing.solver().Add(
+            time_dimension.CumulVar(pickup_index) <= time_dimension.CumulVar(delivery_index))
+
+
+    # Sparse successor graph (large instances): a visit can only be followed by one of its
+    # successors, a route end, or itself (inactive)
+    if data.get('successor_graph'):
+        end_indices = [routing.End(vehicle_id) for vehicle_id in range(data['num_vehicles'])]
+        for node, successors in enumerate(data['successor_graph']):
+            if successors is None:
+                continue
+            index = manager.NodeToIndex(node)
+            routing.NextVar(index).SetValues(
+                [index] + [manager.NodeToIndex(successor) for successor in successors] + end_indices)
+
+    # Symmetry breaking among identical vehicles (see vehicle_symmetry_groups)
+    for group in data.get('vehicle_groups', []):
+        if data['symmetry_breaking'] == 'ordered_usage':
+            # Used vehicles form a prefix of the group: a vehicle is used only if its predecessor is
+            for previous, vehicle in zip(group, group[1:]):
+                previous_used = routing.NextVar(routing.Start(previous)) != routing.End(previous)
+                used = routing.NextVar(routing.Start(vehicle)) != routing.End(vehicle)
+                routing.solver().Add(previous_used >= used)
+        elif data['symmetry_breaking'] == 'fixed_cost_tiers':
+            for rank, vehicle in enumerate(group):
+                routing.SetFixedCostOfVehicle(rank * SYMMETRY_FIXED_COST_STEP, vehicle)
+
+    # Allow tasks to be dropped: a node may be skipped at its drop penalty
+    for node, penalty in data.get('drop_penalties', {}).items():
+        routing.AddDisjunction([manager.NodeToIndex(node)], penalty)
+    # Nodes whose tasks were all rejected by the pre-screen are never visited
+    for node in data.get('unused_nodes', []):
+        index = manager.NodeToIndex(node)
+        routing.AddDisjunction([index], 0)
+        routing.ActiveVar(index).SetValue(0)
+
+    return manager, routing, time_dimension
+
+
+def _initial_route_chains(initial_routes, vehicles, location_index_map, depot_nodes, unused_nodes=()):
+    """
+    Converts current routes into node chains for a warm start.
+    Args:
+        initial_routes: Dict mapping vehicle id to the ordered location ids the vehicle currently visits.
+        vehicles: The Vehicle list passed to solve_vrp (defines the vehicle indices).
+        location_index_map: Location id to node index (from merge_colocated_locations).
+        depot_nodes: The depot nodes, which are never part of a chain.
+        unused_nodes: Nodes without tasks (e.g. all rejected by the pre-screen), also skipped.
+    Returns:
+        One list of node indices per vehicle. Locations that are no longer planned are skipped,
+        and a node is kept only at its first visit (merged locations or a node in two routes).
+    """
+    chains = []
+    seen_nodes = {*depot_nodes, *unused_nodes}
+    for vehicle in vehicles:
+        chain = []
+        for location_id in initial_routes.get(vehicle.id, []):
+            node = location_index_map.get(location_id)
+            if node is None or node in seen_nodes:
+                continue
+            seen_nodes.add(node)
+            chain.append(node)
+        chains.append(chain)
+    return chains
+
+
+def _complete_route_chains(data, chains):
+    """
+    Extends the current route chains with the nodes they don't visit yet (e.g. new tasks).
+    The chains are locked in a separate model and a cheapest-insertion first solution places the
+    remaining nodes, so no full construction phase is needed.
+    Returns:
+        A complete list of node routes per vehicle, or None if the chains cannot be completed feasibly.
+    """
+    manager, routing, _ = _build_routing_model(data)
+    parameters = pywrapcp.DefaultRoutingSearchParameters()
+    parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.LOCAL_CHEAPEST_INSERTION
+    parameters.solution_limit = 1 # First solution only, local search runs on the main model
+    parameters.time_limit.FromSeconds(WARM_START_TIME_LIMIT_SECONDS)
+    routing.CloseModelWithParameters(parameters)
+    if not routing.ApplyLocksToAllVehicles(chains, False):
+        return None
+    seed = routing.SolveWithParameters(parameters)
+    if seed is None:
+        return None
+
+    routes = []
+    for vehicle_id in range(data['num_vehicles']):
+        nodes = []
+        index = seed.Value(routing.NextVar(routing.Start(vehicle_id)))
+        while not routing.IsEnd(index):
+            nodes.append(manager.IndexToNode(index))
+            index = seed.Value(routing.NextVar(index))
+        routes.append(nodes)
+    return routes
+
+
+def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicle], matrix_provider=None,
+              progress_callback=None, search_options=None, solution_callback=None, should_stop=None,
+              initial_routes=None, drop_penalty=None, vehicle_depots=None):
     """
     Main function to solve the Vehicle Routing Problem.
     Args:
         depot_location: The Location object representing the depot.
         tasks: A list of Task objects to be scheduled.
         vehicles: A list of Vehicle objects available for routing.
+        matrix_provider: Optional MatrixProvider for distances/durations.
+                         Defaults to the provider configured in settings.VRP_MATRIX_PROVIDER.
+        progress_callback: Optional callable(stage, message) notified as the solve advances
+                           (used by background planning jobs).
+        search_options: Optional dict from search_options.resolve_search_options (strategy,
+                        metaheuristic, limits). Defaults to the configured default search profile.
+        solution_callback: Optional callable(snapshot) called with every improving solution found
+                           while the search runs (anytime solving). The snapshot is a dict with
+                           solution_number, cost, elapsed_seconds and routes (stop sequence per vehicle).
+        should_stop: Optional callable() -> bool checked continuously during the search. Once it returns
+                     True the search stops and the best solution found so far is returned (cancellation).
+        initial_routes: Optional dict mapping vehicle id to the ordered location ids of its current route
+                        (re-optimization). The current routes, extended with any new tasks, are used as
+                        the initial solution, so local search starts from the existing plan.
+        drop_penalty: Cost of leaving a task unplanned (meters of route distance). Tasks that cannot be
+                      fitted are dropped and reported instead of failing the whole solve. 0 makes every
+                      task mandatory. Defaults to settings.VRP_TASK_DROP_PENALTY.
+                      Tasks that are provably infeasible (see prescreen_tasks) are always rejected up front.
+        vehicle_depots: Optional dict mapping vehicle id to its (start Location, end Location), for plans
+                        over several depots (multi-depot). Vehicles not listed start and end at depot_location.
     Returns:
         A dictionary containing the solution routes, or None if no solution found.
         Example structure:
@@ -118,7 +858,9 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
                 },
                 ...
             ],
-            'dropped_tasks': [task.id, ...] # Tasks that couldn't be assigned
+            'dropped_tasks': [task.id, ...], # Tasks that couldn't be assigned (rejected or dropped)
+            'rejected_tasks': [{'task_id': task.id, 'reason': ...}, ...], # Rejected by the pre-screen
+            'cached': False # True if returned from the solution cache (unchanged input, see solution_cache)
         }
     """
     print(f"Starting VRP solver for {len(tasks)} tasks and {len(vehicles)} vehicles.")
@@ -127,7 +869,8 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
         print("No tasks or vehicles provided.")
         return None
 
-    gmaps = get_google_maps_client()
+    if matrix_provider is None:
+        matrix_provider = get_matrix_provider()
 
     # --- 1. Prepare Data for OR-Tools ---
     # Combine depot and all unique task locations (origins and destinations)
@@ -136,6 +879,14 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
     locations_for_matrix = [depot_location]
     task_indices_map = {} # Map task ID to its index(es) in the matrix
 
+    # Multi-depot: the vehicles' own start/end depots follow the main depot
+    vehicle_depots = vehicle_depots or {}
+    for start_location, end_location in vehicle_depots.values():
+        for location in (start_location, end_location):
+            if location.id not in location_map:
+                location_map[location.id] = location
+                locations_for_matrix.append(location)
+
     # Add unique task locations (origins and destinations)
     # Add unique task locations
     for task in tasks:
@@ -147,19 +898,24 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
             locations_for_matrix.append(task.destination)
 
     # Create addresses list for Google Maps API
-    # Using lat/lng is generally more reliable than addresses
-    addresses = [(loc.latitude, loc.longitude) for loc in locations_for_matrix]
-    num_locations = len(locations_for_matrix)
-    location_index_map = {loc.id: i for i, loc in enumerate(locations_for_matrix)} # Map location ID to matrix index
-
-    print(f"Number of unique locations (incl. depot): {num_locations}")
+    # Using lat/lng is generally more reliable than addresses.
+    # Co-located locations (same snapped coordinates) share one matrix node, which shrinks
+    # the matrix quadratically; their service times and demands are summed per node.
+    num_unique_locations = len(locations_for_matrix)
+    node_locations, location_index_map, addresses = merge_colocated_locations(locations_for_matrix)
+    locations_for_matrix = [group[0] for group in node_locations] # Representative Location per node
+    num_locations = len(node_locations)
+
+    print(f"Number of unique locations (incl. depot): {num_unique_locations}, matrix nodes after merging: {num_locations}")
     if num_locations <= 1:
         print("Not enough locations for routing.")
         return None
 
     # --- 2. Get Distance/Duration Matrix ---
+    if progress_callback:
+        progress_callback('matrix', f"Getting distance/duration matrix for {num_locations} nodes.")
     try:
-        distance_matrix, duration_matrix = create_distance_matrix(gmaps, addresses)
+        travel_matrix = matrix_provider.get_matrices(addresses)
         print("Distance and duration matrices obtained.")
     except Exception as e:
         print(f"Failed to get distance/duration matrix: {e}")
@@ -167,12 +923,88 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
 
     # --- 3. Create OR-Tools Data Model ---
     data = {}
-    data['distance_matrix'] = distance_matrix
+    # int32 arrays from the TravelMatrix, used directly (no copies into Python lists)
+    data['distance_matrix'] = travel_matrix.distances
     # We need travel time + service time for the time dimension
     # Service times are per location. Add them to the duration matrix diagonal? No, add during dimension setup.
-    data['time_matrix'] = duration_matrix
+    data['time_matrix'] = travel_matrix.durations
     data['num_vehicles'] = len(vehicles)
     data['depot'] = 0 # Index of the depot in our locations_for_matrix
+    # Start/end node of every vehicle; only multi-depot models get explicit starts and ends
+    starts = [location_index_map[vehicle_depots[v.id][0].id] if v.id in vehicle_depots else data['depot'] for v in vehicles]
+    ends = [location_index_map[vehicle_depots[v.id][1].id] if v.id in vehicle_depots else data['depot'] for v in vehicles]
+    if any(node != data['depot'] for node in starts + ends):
+        data['starts'], data['ends'] = starts, ends
+    depot_nodes = {data['depot'], *starts, *ends}
+    data['depot_nodes'] = depot_nodes
+
+    # Time Windows
+    # OR-Tools expects time windows as (start_time, end_time) tuples in seconds from midnight
+    # or a consistent epoch if spanning multiple days (not handled here yet).
+    # For now, assume single day, convert HH:MM to seconds.
+    time_windows = [(0, 86400)] * num_locations # Default: open all day (0 to 24*3600 seconds)
+    # Apply time windows based on Location model's opening/closing times
+    print("Applying location time windows:")
+    for i, loc in enumerate(locations_for_matrix):
+        if i in depot_nodes:
+            # Set a wide window for the depot, e.g., 8 AM to 6 PM (adjust as needed)
+            # Or leave as full day if vehicles can start/end anytime
+            depot_start_seconds = 8 * 3600 # 8 AM
+            depot_end_seconds = 18 * 3600 # 6 PM
+            time_windows[i] = (depot_start_seconds, depot_end_seconds)
+            print(f"  - Depot ({loc.name}): {depot_start_seconds}s - {depot_end_seconds}s")
+            continue
+
+        # A merged node must be visited when all of its locations are open (window intersection)
+        member_windows = [_location_time_window(member) for member in node_locations[i]]
+        start_sec = max(window[0] for window in member_windows)
+        end_sec = min(window[1] for window in member_windows)
+        if end_sec < start_sec:
+            print(f"  - Warning: Merged locations at node {i} have no common time window. Using {loc.name}'s window.")
+            start_sec, end_sec = member_windows[0]
+
+        time_windows[i] = (start_sec, end_sec)
+        print(f"  - Loc {i} ({loc.name}): {start_sec}s - {end_sec}s")
+
+    data['time_windows'] = time_windows
+
+    # Service times (in seconds)
+    service_times = [0] * num_locations
+    for i, group in enumerate(node_locations):
+        # Convert service times to integers (seconds), summed over merged locations
+        service_times[i] = sum(int((loc.average_service_time_mins or 0) * 60) for loc in group)
+
+    data['service_times'] = service_times
+
+    if search_options is None:
+        search_options = resolve_search_options()
+    if drop_penalty is None:
+        drop_penalty = getattr(settings, 'VRP_TASK_DROP_PENALTY', DEFAULT_TASK_DROP_PENALTY)
+
+    # --- Solution cache: an unchanged input returns the stored result without searching ---
+    cache_key = solution_cache_key(depot_location, node_locations, tasks, vehicles, travel_matrix, time_windows,
+                                   service_times, search_options, initial_routes, drop_penalty, vehicle_depots)
+    cache_references = solution_references(depot_location, tasks, vehicles, vehicle_depots)
+    cached_result = solution_cache.get(cache_key)
+    if cached_result is not None:
+        print(f"Solution cache hit ({cache_key[:12]}). Returning the stored solution.")
+        if progress_callback:
+            progress_callback('solving', "Unchanged plan input: using the stored solution.")
+        cached_result['cached'] = True
+        return cached_result
+
+    # --- Pre-screen: reject tasks no vehicle can serve, in milliseconds instead of a failed search ---
+    rejected_tasks = prescreen_tasks(tasks, vehicles, location_index_map, data['distance_matrix'],
+                                     data['time_matrix'], service_times, time_windows, sorted(set(zip(starts, ends))))
+    if rejected_tasks:
+        rejected_ids = {entry['task_id'] for entry in rejected_tasks}
+        for entry in rejected_tasks:
+            print(f"  - Task {entry['task_id']} rejected: {entry['reason']}")
+        tasks = [task for task in tasks if task.id not in rejected_ids]
+        if not tasks:
+            print("All tasks were rejected by the feasibility pre-check.")
+            return {'routes': [], 'dropped_tasks': sorted(rejected_ids), 'rejected_tasks': rejected_tasks,
+                    'warm_started': False, 'cached': False}
 
     # Demands (Weight and Volume) - For Pickup & Delivery, this is more complex.
     # Let's handle simple delivery first: demand is at the destination.
@@ -182,6 +1014,7 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
     demands_weight = [0] * num_locations
     demands_volume = [0] * num_locations
     pickup_delivery_pairs = [] # For P&D constraint
+    node_stops = {} # Map node index to the individual (location, task, stop type) visits it stands for
 
     # Process Tasks for demands and P&D pairs
     for task in tasks:
@@ -208,9 +1041,13 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
             demands_weight[dest_idx] -= int(task.weight_kg or 0) # Delivery removes demand
             demands_volume[dest_idx] -= int(task.volume_m3 or 0)
 
-        # Store pickup/delivery pairs for P&D constraint
-        pickup_delivery_pairs.append((origin_idx, dest_idx))
+        # Store pickup/delivery pairs for P&D constraint.
+        # Merged nodes can repeat a pair, or put both ends of a task on the same node (no constraint needed).
+        if origin_idx != dest_idx and (origin_idx, dest_idx) not in pickup_delivery_pairs:
+            pickup_delivery_pairs.append((origin_idx, dest_idx))
         task_indices_map[task.id] = {'pickup': origin_idx, 'delivery': dest_idx}
+        node_stops.setdefault(origin_idx, []).append((task.origin, task.id, 'PICKUP'))
+        node_stops.setdefault(dest_idx, []).append((task.destination, task.id, 'DELIVERY'))
 
 
     data['demands_weight'] = demands_weight
@@ -219,196 +1056,123 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
     data['vehicle_capacities_weight'] = [int(v.type.max_weight_kg or 0) for v in vehicles]
     data['vehicle_capacities_volume'] = [int(v.type.max_volume_m3 or 0) for v in vehicles]
 
-    # Time Windows
-    # OR-Tools expects time windows as (start_time, end_time) tuples in seconds from midnight
-    # or a consistent epoch if spanning multiple days (not handled here yet).
-    # For now, assume single day, convert HH:MM to seconds.
-    time_windows = [(0, 86400)] * num_locations # Default: open all day (0 to 24*3600 seconds)
-    # Apply time windows based on Location model's opening/closing times
-    print("Applying location time windows:")
-    for i, loc in enumerate(locations_for_matrix):
-        if i == data['depot']:
-            # Set a wide window for the depot, e.g., 8 AM to 6 PM (adjust as needed)
-            # Or leave as full day if vehicles can start/end anytime
-            depot_start_seconds = 8 * 3600 # 8 AM
-            depot_end_seconds = 18 * 3600 # 6 PM
-            time_windows[i] = (depot_start_seconds, depot_end_seconds)
-            print(f"  - Depot ({loc.name}): {depot_start_seconds}s - {depot_end_seconds}s")
-            continue
-
-        start_sec = 0
-        end_sec = 86400 # Default to full day
-
-        if loc.opening_time:
-            start_sec = loc.opening_time.hour * 3600 + loc.opening_time.minute * 60 + loc.opening_time.second
-        if loc.closing_time:
-            # Ensure closing time is after opening time, handle overnight if necessary (not done here)
-            end_sec = loc.closing_time.hour * 3600 + loc.closing_time.minute * 60 + loc.closing_time.second
-            if end_sec < start_sec: # Basic check, assumes same day
-                 print(f"  - Warning: Location {loc.name} closing time {loc.closing_time} is before opening time {loc.opening_time}. Using full day.")
-                 end_sec = 86400
-
-        time_windows[i] = (start_sec, end_sec)
-        print(f"  - Loc {i} ({loc.name}): {start_sec}s - {end_sec}s")
-
-    data['time_windows'] = time_windows
-
-    # Service times (in seconds)
-    service_times = [0] * num_locations
-    for i, loc in enumerate(locations_for_matrix):
-        # Convert service times to integers (seconds)
-        service_times[i] = int((loc.average_service_time_mins or 0) * 60)
-
-    # --- 4. Create Routing Model ---
-    manager = pywrapcp.RoutingIndexManager(num_locations, data['num_vehicles'], data['depot'])
-    routing = pywrapcp.RoutingModel(manager)
-
-    # --- 5. Define Callbacks and Dimensions ---
-
-    # Distance Callback
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    # Time Callback (Travel Time + Service Time)
-    def time_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        # Travel time from matrix + Service time at the 'from' node
-        # Service time is incurred *before* leaving the 'from' node for the 'to' node.
-        travel_time = data['time_matrix'][from_node][to_node]
-        serv_time = service_times[from_node]
-        return travel_time + serv_time
-
-    time_callback_index = routing.RegisterTransitCallback(time_callback)
-
-    # Time Dimension (for time windows and route duration limits)
-    time_dimension_name = 'Time'
-    # Horizon: max time allowed (e.g., 24 hours in seconds)
-    # TODO: Make horizon configurable (e.g., working day)
-    # Horizon: max time allowed (e.g., 24 hours in seconds) - used for slack calculation
-    slack_max = 24 * 3600
-    # Max route duration constraint (3 hours in seconds)
-    max_route_duration = 10 * 3600 # Increased from 3 hours to 10 hours
-    routing.AddDimension(
-        time_callback_index,
-        slack_max,  # Allow waiting time (slack) up to horizon
-        max_route_duration,  # Max time per vehicle route (3 hours)
-        False,  # Don't force start cumul to zero, depends on vehicle start time
-        time_dimension_name)
-    time_dimension = routing.GetDimensionOrDie(time_dimension_name)
-
-    # Add time window constraints for each location node
-    for location_idx, time_window in enumerate(data['time_windows']):
-        if location_idx == data['depot']:
-            continue
-        index = manager.NodeToIndex(location_idx)
-        time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
-
-    # Add time window constraints for the depot (start/end of day)
-    # Example: Start between 8 AM and 9 AM
-    # depot_start_time = 8 * 3600
-    # depot_end_time = 18 * 3600 # Example end time
-    # for i in range(data['num_vehicles']):
-    #     index = routing.Start(i)
-    #     time_dimension.CumulVar(index).SetRange(depot_start_time, depot_end_time) # Adjust as needed
-
-    # Add Driver Break Constraint (30 mins around 2 PM)
-    break_duration = 30 * 60  # 30 minutes in seconds
-    # Define the window when the break *must* occur (e.g., between 1:45 PM and 2:15 PM)
-    # Adjust this window as needed. A wider window gives more flexibility.
-    break_window_start = (13 * 3600) + (45 * 60) # 1:45 PM
-    break_window_end = (14 * 3600) + (15 * 60)   # 2:15 PM
-
-    # Create break intervals for each vehicle
-    break_intervals = []
-    for i in range(data['num_vehicles']):
-        break_interval = routing.solver().FixedDurationIntervalVar(
-            break_window_start,  # earliest start time
-            break_window_end,    # latest start time
-            break_duration,      # duration
-            False,               # optionality (False = mandatory)
-            f'Break for vehicle {i}'
-        )
-        break_intervals.append(break_interval)
-
-    # Add the break constraint to the time dimension for each vehicle individually
-    # node_visit_transits = [time_callback_index] # Transit callback index wrapped in a list
-    # Temporarily commented out break constraint application for debugging
-    # for i in range(data['num_vehicles']):
-    #     # Apply the break interval created earlier for this specific vehicle index 'i'
-    #     vehicle_breaks = [break_intervals[i]] # Get the specific break interval for vehicle i
-    #     time_dimension.SetBreakIntervalsOfVehicle(vehicle_breaks, i, node_visit_transits)
+    data['pickup_delivery_pairs'] = pickup_delivery_pairs
+
+    # Drop penalties: a task's penalty is split over its two stops (a dropped pickup/delivery pair
+    # pays both). Merged nodes carry the penalties of all their stops.
+    if drop_penalty:
+        data['drop_penalties'] = {node: max(1, len(stops) * int(drop_penalty) // 2)
+                                  for node, stops in node_stops.items() if node not in depot_nodes}
+    data['unused_nodes'] = [node for node in range(num_locations)
+                            if node not in depot_nodes and node not in node_stops]
+
+    # Sparse successor graph: only the k nearest time-compatible successors of each node are kept
+    num_neighbors = _neighbor_count(search_options, num_locations)
+    if num_neighbors:
+        required_arcs = list(pickup_delivery_pairs)
+        if initial_routes:
+            # Keep the current routes valid as a warm start
+            for chain in _initial_route_chains(initial_routes, vehicles, location_index_map, depot_nodes,
+                                               data['unused_nodes']):
+                required_arcs.extend(zip(chain, chain[1:]))
+        data['successor_graph'] = build_successor_graph(
+            data['distance_matrix'], data['time_matrix'], service_times, time_windows, depot_nodes,
+            num_neighbors, required_arcs)
+        print(f"Sparse successor graph: {num_neighbors} nearest compatible successors per node.")
+
+    # Symmetry breaking: equivalent permutations of identical vehicles are not searched
+    data['symmetry_breaking'] = search_options.get('symmetry_breaking')
+    if data['symmetry_breaking']:
+        data['vehicle_groups'] = vehicle_symmetry_groups(vehicles, initial_routes)
+        print(f"Symmetry breaking ({data['symmetry_breaking']}) over {len(data['vehicle_groups'])} groups "
+              f"of identical vehicles.")
+
+    # --- 4. & 5. Create Routing Model, Transits and Dimensions ---
+    manager, routing, time_dimension = _build_routing_model(data)
 
-    # print(f"Added mandatory {break_duration/60} min break constraint between {break_window_start}s and {break_window_end}s for all vehicles.") # Commented out print statement as well
-    #     index = routing.End(i)
-    #     time_dimension.CumulVar(index).SetRange(depot_start_time, depot_end_time) # Adjust as needed
-
-
-    # Capacity Dimensions (Weight and Volume)
-    def demand_callback_weight(from_index):
-        from_node = manager.IndexToNode(from_index)
-        return data['demands_weight'][from_node]
-
-    demand_callback_weight_index = routing.RegisterUnaryTransitCallback(demand_callback_weight)
-    routing.AddDimensionWithVehicleCapacity(
-        demand_callback_weight_index,
-        0,  # Slack zero - capacity cannot be exceeded
-        data['vehicle_capacities_weight'],
-        True,  # Start cumul to zero
-        'CapacityWeight')
-
-    def demand_callback_volume(from_index):
-        from_node = manager.IndexToNode(from_index)
-        return data['demands_volume'][from_node]
-
-    demand_callback_volume_index = routing.RegisterUnaryTransitCallback(demand_callback_volume)
-    routing.AddDimensionWithVehicleCapacity(
-        demand_callback_volume_index,
-        0,  # Slack zero
-        data['vehicle_capacities_volume'],
-        True,  # Start cumul to zero
-        'CapacityVolume')
-
-    # Pickup and Delivery Constraint
-    for request in pickup_delivery_pairs:
-        pickup_index = manager.NodeToIndex(request[0])
-        delivery_index = manager.NodeToIndex(request[1])
-        routing.AddPickupAndDelivery(pickup_index, delivery_index)
-        # Ensure same vehicle serves both pickup and delivery
-        routing.solver().Add(
-            routing.VehicleVar(pickup_index) == routing.VehicleVar(delivery_index))
-        # Ensure pickup happens before delivery in the time dimension
-        routing.solver().Add(
-            time_dimension.CumulVar(pickup_index) <= time_dimension.CumulVar(delivery_index))
-
-
-    # Allow tasks to be dropped (optional, add penalty)
-    # penalty = 100000 # High cost for dropping a task
-    # for node in range(1, len(data['distance_matrix'])): # Skip depot
-    #     routing.AddDisjunction([manager.NodeToIndex(node)], penalty)
+    # --- 6. Set Search Parameters ---
+    search_parameters = build_search_parameters(search_options)
+    if search_options.get('random_seed') is not None: # 0 is a valid seed
+        # Diversifies the randomized search operators, e.g. between portfolio members
+        routing.solver().ReSeed(search_options['random_seed'])
+    print(f"Search options: {search_options}")
+
+    # --- Anytime solving: snapshot each improving solution while the search runs ---
+    if solution_callback:
+        search_started = time.monotonic()
+        best_found = {'cost': None, 'count': 0}
+
+        def snapshot_routes():
+            # Inside the solution callback the routing variables hold the current solution
+            routes = []
+            for vehicle_id in range(data['num_vehicles']):
+                stops = []
+                index = routing.NextVar(routing.Start(vehicle_id)).Value()
+                while not routing.IsEnd(index):
+                    for visit_location, task_id, stop_type in node_stops.get(manager.IndexToNode(index), []):
+                        stops.append({'location_id': visit_location.id, 'task_id': task_id, 'type': stop_type})
+                    index = routing.NextVar(index).Value()
+                if stops:
+                    routes.append({'vehicle_id': vehicles[vehicle_id].id, 'stops': stops})
+            return routes
+
+        def on_solution():
+            cost = routing.CostVar().Value()
+            if best_found['cost'] is not None and cost >= best_found['cost']:
+                return # Metaheuristics also report non-improving solutions
+            best_found['cost'] = cost
+            best_found['count'] += 1
+            try:
+                solution_callback({
+                    'solution_number': best_found['count'],
+                    'cost': cost,
+                    'elapsed_seconds': round(time.monotonic() - search_started, 3),
+                    'routes': snapshot_routes(),
+                })
+            except Exception as e:
+                # Never let a reporting problem abort the search
+                print(f"Warning: Solution callback failed: {e}")
 
+        routing.AddAtSolutionCallback(on_solution)
 
-    # --- 6. Set Search Parameters ---
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-    # search_parameters.local_search_metaheuristic = (
-    #     routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-    # search_parameters.time_limit.FromSeconds(30) # Set a time limit
+    # --- Cancellation: a custom search limit ends the search, keeping the best solution so far ---
+    if should_stop:
+        routing.AddSearchMonitor(routing.solver().CustomLimit(should_stop))
 
     # --- 7. Solve the Problem ---
     print("Solving VRP...")
-    solution = routing.SolveWithParameters(search_parameters)
+    if progress_callback:
+        progress_callback('solving', f"Solving for {len(tasks)} tasks and {len(vehicles)} vehicles.")
+    initial_assignment = None
+    if initial_routes:
+        chains = _initial_route_chains(initial_routes, vehicles, location_index_map, depot_nodes,
+                                       data['unused_nodes'])
+        completed_routes = _complete_route_chains(data, chains) if any(chains) else None
+        if completed_routes is not None:
+            routing.CloseModelWithParameters(search_parameters)
+            initial_assignment = routing.ReadAssignmentFromRoutes(completed_routes, True)
+        if initial_assignment is None:
+            print("Warning: Current routes could not be used as a warm start. Solving from scratch.")
+        else:
+            print(f"Warm start from {sum(1 for chain in chains if chain)} current routes.")
+
+    if initial_assignment is not None:
+        solution = routing.SolveFromAssignmentWithParameters(initial_assignment, search_parameters)
+    else:
+        solution = routing.SolveWithParameters(search_parameters)
 
     # --- 8. Process the Solution ---
     if solution:
         print("Solution found!")
-        result = {'routes': [], 'dropped_tasks': []} # Add dropped tasks later if disjunctions used
+        result = {'routes': [], 'dropped_tasks': [], 'rejected_tasks': rejected_tasks,
+                  'warm_started': initial_assignment is not None, 'cached': False}
+
+        # Tasks with a stop on a skipped node were dropped (a skipped pickup skips its delivery too)
+        dropped_task_ids = set()
+        for node, stops in node_stops.items():
+            index = manager.NodeToIndex(node)
+            if node not in depot_nodes and solution.Value(routing.NextVar(index)) == index:
+                dropped_task_ids.update(task_id for _, task_id, _ in stops)
 
         total_distance = 0
         total_load = 0 # Example tracking, not used yet
@@ -428,49 +1192,35 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
                 time_var = time_dimension.CumulVar(index)
                 location_obj = locations_for_matrix[node_index] # Get Location object
 
-                # Determine stop type and associated task(s)
-                stop_type = 'UNKNOWN'
-                task_id = None
-                if node_index == data['depot']:
-                    stop_type = 'START_DEPOT' if routing.IsStart(index) else 'END_DEPOT'
+                # Determine stop type and associated task(s).
+                # A node stands for every location merged into it and every task visiting it,
+                # so it expands to one stop per (location, task) visit.
+                if node_index in depot_nodes:
+                    visits = [(location_obj, None, 'START_DEPOT' if routing.IsStart(index) else 'END_DEPOT')]
                 else:
-                    # Find task associated with this stop (this logic might need refinement for P&D)
-                    # A stop might be a pickup OR a delivery.
-                    # Check if this node_index is a pickup or delivery for any task
-                    is_pickup = any(p_idx == node_index for p_idx, d_idx in pickup_delivery_pairs)
-                    is_delivery = any(d_idx == node_index for p_idx, d_idx in pickup_delivery_pairs)
-
-                    # Simple assumption: if it's a pickup node, type is PICKUP, if delivery, type is DELIVERY
-                    # This breaks if a location is both pickup for Task A and delivery for Task B on same route.
-                    # A better way might be to link the stop directly to the task it serves.
-                    # For now, let's try to find the task based on index:
-                    current_task = None
-                    for t_id, indices in task_indices_map.items():
-                        if indices['pickup'] == node_index:
-                            stop_type = 'PICKUP'
-                            task_id = t_id
-                            break
-                        elif indices['delivery'] == node_index:
-                            stop_type = 'DELIVERY'
-                            task_id = t_id
-                            break
-
-                route_stops.append({
-                    'location_id': location_obj.id,
-                    'location_name': location_obj.name,
-                    'task_id': task_id,
-                    'type': stop_type,
-                    'arrival_time_seconds': solution.Min(time_var),
-                    'departure_time_seconds': solution.Max(time_var), # Max includes service time? Check OR-Tools docs
-                    # Add load, distance etc. later
-                })
+                    visits = node_stops.get(node_index) or [(location_obj, None, 'UNKNOWN')]
+
+                for visit_location, task_id, stop_type in visits:
+                    if task_id in dropped_task_ids:
+                        continue # Other stop of the task was skipped
+                    route_stops.append({
+                        'location_id': visit_location.id,
+                        'location_name': visit_location.name,
+                        'task_id': task_id,
+                        'type': stop_type,
+                        'arrival_time_seconds': solution.Min(time_var),
+                        'departure_time_seconds': solution.Max(time_var), # Max includes service time? Check OR-Tools docs
+                        # Add load, distance etc. later
+                    })
 
                 plan_output += f' {location_obj.name} (Time={solution.Min(time_var)}s -> {solution.Max(time_var)}s) ->'
                 previous_index = index
                 index = solution.Value(routing.NextVar(index))
                 route_distance += routing.GetArcCostForVehicle(previous_index, index, vehicle_id)
                 # Route duration calculation needs care - use time dimension difference?
-                # route_duration += time_callback(previous_index, index) # This includes service time
+            # The arc cost out of the start includes the vehicle's fixed cost (symmetry breaking tiers)
+            if routing.IsVehicleUsed(solution, vehicle_id):
+                route_distance -= routing.GetFixedCostOfVehicle(vehicle_id)
 
             # Add the final depot stop
             node_index = manager.IndexToNode(index)
@@ -505,16 +1255,14 @@ def solve_vrp(depot_location: Location, tasks: list[Task], vehicles: list[Vehicl
         print(f'Total distance of all routes: {total_distance}m')
         # print(f'Total time of all routes: {total_time}s') # Less meaningful metric
 
-        # Identify dropped tasks if using disjunctions
-        # for node in range(routing.Size()):
-        #     if routing.IsStart(node) or routing.IsEnd(node):
-        #         continue
-        #     if solution.Value(routing.NextVar(node)) == node:
-        #         # Find task corresponding to this node index
-        #         # ... logic to map node index back to task ID ...
-        #         # result['dropped_tasks'].append(task_id)
-        #         print(f'Task at node {manager.IndexToNode(node)} was dropped.')
+        # Dropped tasks: rejected by the pre-screen or left out by the solver at their penalty
+        if dropped_task_ids:
+            print(f"Dropped {len(dropped_task_ids)} tasks that could not be fitted: {sorted(dropped_task_ids)}")
+        result['dropped_tasks'] = sorted(dropped_task_ids | {entry['task_id'] for entry in rejected_tasks})
 
+        # A search stopped on request is not the answer for this input; don't cache it
+        if not (should_stop and should_stop()):
+            solution_cache.put(cache_key, result, cache_references)
         return result
     else:
         print('No solution found!')
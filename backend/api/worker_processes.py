@@ -0,0 +1,113 @@
+"""
+Entry points for Django code running in separate worker processes.
+
+Kept free of model imports at module level: with the 'spawn' start method
+(Windows/macOS) the child imports this module before Django is set up.
+"""
+import os
+import time
+
+
+def init_django_process():
+    """Sets up Django in a freshly started worker process (no-op if already set up, e.g. after fork)."""
+    from django.apps import apps
+    if apps.ready:
+        return
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vrp_core.settings')
+    django.setup()
+
+
+def limit_process_memory(limit_mb):
+    """
+    Caps the address space of the current process (Unix only), so a runaway solve fails with
+    MemoryError/std::bad_alloc in its own worker instead of starving the other workers.
+    Args:
+        limit_mb: The limit in megabytes; None or 0 disables it.
+    """
+    if not limit_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        print("Warning: Memory limits for solver workers are not supported on this platform.")
+        return
+    limit_bytes = int(limit_mb) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+
+
+def run_planning_worker(index, poll_interval, memory_limit_mb=None):
+    """Process target for a planning job worker (see the run_planning_workers command)."""
+    limit_process_memory(memory_limit_mb)
+    init_django_process()
+    from .planning_jobs import default_worker_name, worker_loop
+    try:
+        worker_loop(default_worker_name(index), poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the whole process group; the supervisor handles shutdown
+        pass
+
+
+# Set in each decomposition pool process: shared event the parent sets to stop all sub-problem searches
+_subproblem_stop_event = None
+
+
+def init_subproblem_process(stop_event):
+    """Pool initializer for decomposed plans (see decomposition.solve_vrp_decomposed)."""
+    global _subproblem_stop_event
+    _subproblem_stop_event = stop_event
+    init_django_process()
+
+
+def solve_subproblem(spec):
+    """
+    Solves one sub-problem in a pool process: a region of a decomposed plan or a portfolio member.
+    Args:
+        spec: Dict with depot_id, task_ids, vehicle_ids, matrix_provider (name), search_options,
+              initial_routes (ids only, so the spec pickles cheaply; objects are loaded here) and
+              an optional drop_penalty.
+              Optional vehicle_depots (vehicle id -> (start depot id, end depot id)) make it a multi-depot plan.
+              Optional matrix_path and matrix_addresses point to a precomputed union matrix file that is
+              memory-mapped instead of asking the matrix provider.
+              An optional deadline (time.time() value) shared by all sub-problems caps the time limit,
+              so sub-problems queued behind others do not overrun it.
+    Returns:
+        The solve_vrp result dict, or None if no solution was found (or the deadline had already passed).
+    """
+    from .matrix_providers import PrecomputedMatrixProvider, get_matrix_provider
+    from .models import Location, Task, Vehicle
+    from .vrp_solver import solve_vrp
+
+    depot = Location.objects.get(pk=spec['depot_id'])
+    tasks_by_id = Task.objects.select_related('origin', 'destination').in_bulk(spec['task_ids'])
+    vehicles_by_id = Vehicle.objects.select_related('type').in_bulk(spec['vehicle_ids'])
+    vehicle_depots = None
+    if spec.get('vehicle_depots'):
+        depot_ids = {depot_id for pair in spec['vehicle_depots'].values() for depot_id in pair}
+        depots_by_id = Location.objects.in_bulk(depot_ids)
+        vehicle_depots = {vehicle_id: (depots_by_id[start_id], depots_by_id[end_id])
+                          for vehicle_id, (start_id, end_id) in spec['vehicle_depots'].items()}
+    if spec.get('matrix_path'):
+        matrix_provider = PrecomputedMatrixProvider.load(spec['matrix_path'], spec['matrix_addresses'])
+    else:
+        matrix_provider = get_matrix_provider(spec['matrix_provider'])
+    stop_event = _subproblem_stop_event
+    search_options = spec['search_options']
+    if spec.get('deadline'):
+        remaining = spec['deadline'] - time.time()
+        if remaining < 1 or (stop_event is not None and stop_event.is_set()):
+            print("Sub-problem skipped: the shared deadline has passed.")
+            return None
+        search_options = dict(search_options, time_limit_seconds=min(
+            search_options.get('time_limit_seconds') or remaining, remaining))
+    return solve_vrp(
+        depot,
+        [tasks_by_id[task_id] for task_id in spec['task_ids']],
+        [vehicles_by_id[vehicle_id] for vehicle_id in spec['vehicle_ids']],
+        matrix_provider=matrix_provider,
+        search_options=search_options,
+        should_stop=stop_event.is_set if stop_event is not None else None,
+        initial_routes=spec.get('initial_routes'),
+        drop_penalty=spec.get('drop_penalty'),
+        vehicle_depots=vehicle_depots,
+    )
@@ -29,6 +29,116 @@ SECRET_KEY = 'django-insecure-bp*e8w(4h9khi)x&3n)iws75s&@4b$#ai#lw9d=d27uqkn-kr9
 # Google Maps API Key - Load from environment variable
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY')
 
+# Distance matrix cells stored in the database are re-fetched after this many seconds (30 days)
+DISTANCE_MATRIX_STORE_TTL_SECONDS = int(os.environ.get('DISTANCE_MATRIX_STORE_TTL_SECONDS', 30 * 24 * 3600))
+# Per-worker in-memory matrix cache: memory budget (bytes, LRU eviction), entry cap and TTL.
+# The cap also bounds memory-mapped (shared) matrices, which don't count against the byte budget.
+DISTANCE_MATRIX_CACHE_MAX_BYTES = int(os.environ.get('DISTANCE_MATRIX_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+DISTANCE_MATRIX_CACHE_MAX_ENTRIES = int(os.environ.get('DISTANCE_MATRIX_CACHE_MAX_ENTRIES', 256))
+DISTANCE_MATRIX_CACHE_TTL_SECONDS = 3600
+# Share built matrices zero-copy between worker processes as memory-mapped files in this directory
+# (e.g. /dev/shm/vrp_matrices). Disabled when empty.
+DISTANCE_MATRIX_SHARED_DIR = os.environ.get('DISTANCE_MATRIX_SHARED_DIR', '')
+DISTANCE_MATRIX_SHARED_TTL_SECONDS = 3600
+# Concurrent Distance Matrix requests per process, client-side element rate limit and OVER_QUERY_LIMIT retries
+DISTANCE_MATRIX_MAX_WORKERS = int(os.environ.get('DISTANCE_MATRIX_MAX_WORKERS', 8))
+DISTANCE_MATRIX_ELEMENTS_PER_SECOND = int(os.environ.get('DISTANCE_MATRIX_ELEMENTS_PER_SECOND', 1000))
+DISTANCE_MATRIX_MAX_RETRIES = 5
+DISTANCE_MATRIX_BACKOFF_BASE_SECONDS = 0.5
+# Cross-process coalescing: one worker fetches a location set, others wait up to the wait time
+DISTANCE_MATRIX_FETCH_LEASE_SECONDS = 300
+DISTANCE_MATRIX_FETCH_LEASE_WAIT_SECONDS = 120
+
+# Matrix provider used by the solver: 'google', 'cache' (store only), 'haversine' (offline) or 'chained'
+VRP_MATRIX_PROVIDER = os.environ.get('VRP_MATRIX_PROVIDER', 'google')
+# Providers tried in order by the 'chained' provider
+VRP_MATRIX_PROVIDER_CHAIN = ['cache', 'google', 'haversine']
+# Offline estimate: road distance = great-circle distance * detour factor, at a constant average speed
+VRP_HAVERSINE_DETOUR_FACTOR = 1.3
+VRP_HAVERSINE_AVERAGE_SPEED_KMH = 40
+
+# Coordinates are rounded to this many decimals (5 = ~1.1 m) before building the matrix;
+# locations that snap to the same point are merged into one node
+VRP_COORDINATE_SNAP_DECIMALS = 5
+
+# Sparse successor graph: in models of at least VRP_NEIGHBOR_GRAPH_MIN_NODES nodes each stop may only be
+# followed by its VRP_NEIGHBOR_COUNT nearest time-window-compatible stops (per plan: "num_neighbors").
+# Off by default (None): pruning trades plan quality for search speed, so measure before enabling it.
+VRP_NEIGHBOR_COUNT = None
+VRP_NEIGHBOR_GRAPH_MIN_NODES = 200
+
+# Penalty (in objective units, i.e. meters) for leaving a task unplanned; tasks the solver cannot fit
+# are dropped and reported instead of failing the whole plan. 0 makes every task mandatory (per plan: "drop_penalty").
+VRP_TASK_DROP_PENALTY = 1000000
+
+# Solver results cached per worker process, keyed by a hash of the solver input (tasks, vehicles,
+# locations, time windows, search options, travel matrix); 0 entries disables the cache
+VRP_SOLUTION_CACHE_MAX_ENTRIES = 64
+VRP_SOLUTION_CACHE_TTL_SECONDS = 3600
+
+# Solver worker processes started by `manage.py run_planning_workers` for async planning jobs
+VRP_PLANNING_WORKERS = int(os.environ.get('VRP_PLANNING_WORKERS', 2))
+# Address space limit per solver worker process in MB (0 disables it), so one plan cannot starve the others
+VRP_WORKER_MEMORY_LIMIT_MB = int(os.environ.get('VRP_WORKER_MEMORY_LIMIT_MB', 2048))
+# Running jobs check for a cancel request at most this often
+VRP_CANCEL_POLL_INTERVAL_SECONDS = 1.0
+# Improving solutions of running jobs are saved (and streamed) at most this often
+VRP_SOLUTION_SNAPSHOT_INTERVAL_SECONDS = 1.0
+# Running jobs refresh their heartbeat this often, even while the solver reports nothing; keep it well
+# below run_planning_workers --stale-after (1800 s), or live jobs get requeued
+VRP_JOB_HEARTBEAT_INTERVAL_SECONDS = 30.0
+
+# Solver search profiles selectable per plan request ("search_profile"); each option can also be
+# overridden per request. Strategy/metaheuristic names are OR-Tools enum names.
+VRP_SEARCH_PROFILES = {
+    'preview': {  # Interactive preview
+        'first_solution_strategy': 'PATH_CHEAPEST_ARC',
+        'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH',
+        'time_limit_seconds': 5,
+    },
+    'standard': {
+        'first_solution_strategy': 'PATH_CHEAPEST_ARC',
+        'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH',
+        'time_limit_seconds': 30,
+    },
+    'overnight': {  # Batch planning, run as an async planning job
+        'first_solution_strategy': 'PARALLEL_CHEAPEST_INSERTION',
+        'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH',
+        'time_limit_seconds': 600,
+    },
+}
+VRP_DEFAULT_SEARCH_PROFILE = os.environ.get('VRP_DEFAULT_SEARCH_PROFILE', 'standard')
+# Server-enforced solver wall time: caps requested time limits and applies when none is requested
+VRP_MAX_TIME_LIMIT_SECONDS = 3600
+
+# Searches run side by side for plans requested with "portfolio": true; each entry overrides the plan's
+# search options (random_seed diversifies randomized search operators). The lowest-cost solution wins.
+VRP_PORTFOLIO = [
+    {'first_solution_strategy': 'PATH_CHEAPEST_ARC', 'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH'},
+    {'first_solution_strategy': 'PARALLEL_CHEAPEST_INSERTION', 'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH'},
+    {'first_solution_strategy': 'LOCAL_CHEAPEST_INSERTION', 'local_search_metaheuristic': 'TABU_SEARCH'},
+    {'first_solution_strategy': 'PATH_CHEAPEST_ARC', 'local_search_metaheuristic': 'SIMULATED_ANNEALING', 'random_seed': 7},
+]
+# Processes running portfolio searches of one plan (None = one per search); extra searches share the deadline
+VRP_PORTFOLIO_PROCESSES = None
+
+# Plans with at least this many tasks are split into regional sub-problems solved in parallel
+# (a plan request can force it with "decompose": true/false)
+VRP_DECOMPOSITION_MIN_TASKS = 1000
+# Target number of tasks per regional sub-problem
+VRP_DECOMPOSITION_CLUSTER_SIZE = 200
+# Processes solving sub-problems of one plan (None = number of CPUs); each inherits the worker memory limit
+VRP_DECOMPOSITION_PROCESSES = None
+# Time limit for re-solving each pair of neighboring regions after the regional solves
+VRP_DECOMPOSITION_REPAIR_TIME_LIMIT_SECONDS = 30
+
+# Processes solving the independent (depot, date) problems of a batch plan (routes/plan/batch/) and the
+# scenarios of a fleet-sizing sweep; None: CPU count
+VRP_BATCH_PROCESSES = None
+
+# Upper bound on the scenarios of one fleet-sizing sweep (routes/fleet-sweep/, fleet_sweep command)
+VRP_FLEET_SWEEP_MAX_SCENARIOS = 100
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 